@@ -1,15 +1,15 @@
 import os
+import asyncio
 from contextlib import asynccontextmanager
-from pathlib import Path
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 
-from core.config import DOCUMENTS_DIR, INDEX_DIR
-from core.indexing import global_model, global_faiss_index, global_all_chunks_data, load_global_index_and_chunks, save_global_index_and_chunks, build_faiss_index_from_embeddings
-from utils.file_ops import extract_text_from_document
-from utils.chunking import recursive_chunk_text
+from core.config import DOCUMENTS_DIR, INDEX_DIR, SERVER_WORKERS
+from core.startup import warm_up
+from core.jobs import ingestion_queue
 
-from app.routers import documents, query
+from utils.metrics import MetricsMiddleware, enable_multiprocess_metrics, mark_worker_stopped
+from app.routers import documents, jobs, query, metrics, health
 
 # Ensure directories exist
 os.makedirs(DOCUMENTS_DIR, exist_ok=True)
@@ -17,62 +17,15 @@ os.makedirs(INDEX_DIR, exist_ok=True)
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    # Startup event
-    print("Loading SentenceTransformer model...")
-    global_model.set_model('all-MiniLM-L6-v2') # Initialize the model
-    
-    print("Loading global FAISS index and chunks...")
-    loaded_index, loaded_chunks_data = load_global_index_and_chunks()
-    global_faiss_index.set_index(loaded_index)
-    global_all_chunks_data.set_data(loaded_chunks_data)
-
-    # Get list of files currently in the index
-    indexed_files = {metadata["source"] for metadata in global_all_chunks_data.data["metadata"]}
-
-    # Scan documents directory for new/updated files
-    documents_path = Path(DOCUMENTS_DIR)
-    all_document_files = []
-    for ext in ["*.pdf", "*.docx", "*.txt"]:
-        all_document_files.extend(documents_path.glob(ext))
-
-    new_documents_found = False
-    for doc_file_path in all_document_files:
-        if doc_file_path.name not in indexed_files:
-            print(f"Found new document: {doc_file_path.name}. Processing...")
-            new_documents_found = True
-            try:
-                text = extract_text_from_document(str(doc_file_path))
-                if text:
-                    chunks = recursive_chunk_text(text, max_chunk_size=1024, overlap=100)
-                    for chunk in chunks:
-                        global_all_chunks_data.data["texts"].append(chunk)
-                        global_all_chunks_data.data["metadata"].append({"source": doc_file_path.name})
-                else:
-                    print(f"Warning: Could not extract text from {doc_file_path.name}.")
-            except Exception as e:
-                print(f"Error processing {doc_file_path.name} during startup: {e}")
-
-    if new_documents_found or global_faiss_index.index is None and global_all_chunks_data.data["texts"]:
-        print("Rebuilding FAISS index with all documents...")
-        if global_all_chunks_data.data["texts"]:
-            embeddings = global_model.model.encode(global_all_chunks_data.data["texts"])
-            global_faiss_index.set_index(build_faiss_index_from_embeddings(embeddings))
-            save_global_index_and_chunks(global_faiss_index.index, global_all_chunks_data.data)
-        else:
-            print("No documents to index after scanning.")
-            global_faiss_index.set_index(None)
-            global_all_chunks_data.set_data({"texts": [], "metadata": []})
-            # Clean up index files if no documents are present
-            if os.path.exists(os.path.join(INDEX_DIR, "faiss_index.bin")):
-                os.remove(os.path.join(INDEX_DIR, "faiss_index.bin"))
-            if os.path.exists(os.path.join(INDEX_DIR, "chunks.pkl")):
-                os.remove(os.path.join(INDEX_DIR, "chunks.pkl"))
-    elif global_faiss_index.index is None:
-        print("No existing index or documents found. Starting fresh.")
+    # Startup event: the model and index load in the background, so the port opens right away.
+    # Routes that need them answer 503 until /readyz reports ready.
+    asyncio.get_running_loop().run_in_executor(None, warm_up)
 
     yield
 
-    # Shutdown event (optional)
+    # Shutdown event: uploads still queued are indexed by the next startup's reconcile
+    ingestion_queue.shutdown()
+    mark_worker_stopped()
     print("Application shutting down.")
 
 app = FastAPI(lifespan=lifespan)
@@ -85,11 +38,18 @@ app.add_middleware(
     allow_methods=["*"],  # Allows all methods
     allow_headers=["*"],  # Allows all headers
 )
+app.add_middleware(MetricsMiddleware)
 
 # Include routers
 app.include_router(documents.router, tags=["documents"])
+app.include_router(jobs.router, tags=["jobs"])
 app.include_router(query.router, tags=["query"])
+app.include_router(metrics.router, tags=["metrics"])
+app.include_router(health.router, tags=["health"])
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    # Workers are started from the import string, each loading its own model and mapping the shared index
+    if SERVER_WORKERS > 1:
+        enable_multiprocess_metrics()
+    uvicorn.run("app.main:app", host="0.0.0.0", port=8000, workers=SERVER_WORKERS)
@@ -1,13 +1,15 @@
 import os
+import shutil
+import asyncio
 from pathlib import Path
-from fastapi import APIRouter, UploadFile, File, HTTPException
+from fastapi import APIRouter, UploadFile, File, HTTPException, Depends
 
-from core.config import DOCUMENTS_DIR, INDEX_DIR, MAX_CHUNK_SIZE, OVERLAP
-from core.indexing import global_model, global_faiss_index, global_all_chunks_data, save_global_index_and_chunks
-
-from utils.file_ops import extract_text_from_document
-from utils.chunking import recursive_chunk_text
-from utils.semantic_search import build_faiss_index_from_embeddings
+from core.config import DOCUMENTS_DIR
+from core.indexing import global_model, index_writer
+from core.manifest import update_manifest_document
+from core.jobs import ingestion_queue
+from utils.metrics import stage
+from app.routers.health import require_ready
 
 router = APIRouter()
 
@@ -17,61 +19,53 @@ async def list_documents():
     documents = os.listdir(DOCUMENTS_DIR)
     return {"documents": documents}
 
-@router.post("/upload_document")
+def _save_upload(file, file_location):
+    with open(file_location, "wb+") as file_object:
+        shutil.copyfileobj(file.file, file_object)
+
+@router.post("/upload_document", status_code=202, dependencies=[Depends(require_ready)])
 async def upload_document(file: UploadFile = File(...)):
-    global global_faiss_index, global_all_chunks_data, global_model
+    """
+    Saves the document and queues it for indexing. Returns 202 with a job id right away;
+    poll GET /jobs/{job_id} for its progress and outcome.
+    """
+    global global_model
 
     if not global_model.model:
         raise HTTPException(status_code=500, detail="SentenceTransformer model not loaded.")
+    if ingestion_queue.full():
+        raise HTTPException(status_code=503, detail="Too many uploads in progress; try again later.", headers={"Retry-After": "5"})
 
     file_location = Path(DOCUMENTS_DIR) / file.filename
     os.makedirs(DOCUMENTS_DIR, exist_ok=True)
     try:
-        with open(file_location, "wb+") as file_object:
-            file_object.write(await file.read())
+        with stage("upload_write"):
+            await asyncio.to_thread(_save_upload, file, file_location)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Could not save file: {e}")
 
-    try:
-        text = extract_text_from_document(str(file_location))
-        if not text:
-            raise HTTPException(status_code=400, detail="Could not extract text from document.")
-
-        chunks = recursive_chunk_text(text, max_chunk_size=MAX_CHUNK_SIZE, overlap=OVERLAP)
-        if not chunks:
-            raise HTTPException(status_code=400, detail="No chunks generated from document.")
-
-        new_chunks_data = {"texts": [], "metadata": []}
-        for chunk in chunks:
-            new_chunks_data["texts"].append(chunk)
-            new_chunks_data["metadata"].append({"source": file.filename})
-
-        # Combine old and new chunks
-        combined_texts = global_all_chunks_data.data["texts"] + new_chunks_data["texts"]
-        combined_metadata = global_all_chunks_data.data["metadata"] + new_chunks_data["metadata"]
-
-        # Rebuild FAISS index with combined data
-        if combined_texts:
-            embeddings = global_model.model.encode(combined_texts)
-            global_faiss_index.set_index(build_faiss_index_from_embeddings(embeddings))
-            global_all_chunks_data.set_data({"texts": combined_texts, "metadata": combined_metadata})
-            save_global_index_and_chunks(global_faiss_index.index, global_all_chunks_data.data)
-        else:
-            global_faiss_index.set_index(None)
-            global_all_chunks_data.set_data({"texts": [], "metadata": []})
-            # Optionally delete index files if no chunks remain
-            if os.path.exists(os.path.join(INDEX_DIR, "faiss_index.bin")):
-                os.remove(os.path.join(INDEX_DIR, "faiss_index.bin"))
-            if os.path.exists(os.path.join(INDEX_DIR, "chunks.pkl")):
-                os.remove(os.path.join(INDEX_DIR, "chunks.pkl"))
-
-        return {"message": f"Document {file.filename} uploaded and processed successfully."}
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error processing document: {e}")
-
-@router.delete("/documents/{filename}")
+    job = ingestion_queue.submit(file.filename, str(file_location))
+    return {
+        "message": f"Document {file.filename} uploaded and queued for processing.",
+        "job_id": job.id,
+        "status": job.status,
+        "status_url": f"/jobs/{job.id}",
+    }
+
+def _remove_from_index(filename):
+    with index_writer() as writer:
+        # Drop the deleted file's vectors by id; nothing needs re-encoding
+        with stage("index_update"):
+            writer.remove_document_chunks(filename)
+
+        # An empty snapshot is published if no chunks remain
+        with stage("index_save"):
+            writer.publish()
+            update_manifest_document(filename)
+
+@router.delete("/documents/{filename}", dependencies=[Depends(require_ready)])
 async def delete_document(filename: str):
-    global global_faiss_index, global_all_chunks_data, global_model
+    global global_model
 
     file_location = Path(DOCUMENTS_DIR) / filename
 
@@ -81,28 +75,8 @@ async def delete_document(filename: str):
     try:
         os.remove(file_location)
 
-        # Remove chunks related to the deleted file
-        new_texts = []
-        new_metadata = []
-        for i, meta in enumerate(global_all_chunks_data.data["metadata"]):
-            if meta["source"] != filename:
-                new_texts.append(global_all_chunks_data.data["texts"][i])
-                new_metadata.append(meta)
-        
-        global_all_chunks_data.set_data({"texts": new_texts, "metadata": new_metadata})
-
-        # Rebuild FAISS index with remaining data
-        if global_all_chunks_data.data["texts"]:
-            embeddings = global_model.model.encode(global_all_chunks_data.data["texts"])
-            global_faiss_index.set_index(build_faiss_index_from_embeddings(embeddings))
-            save_global_index_and_chunks(global_faiss_index.index, global_all_chunks_data.data)
-        else:
-            global_faiss_index.set_index(None)
-            # Clean up index files if no chunks remain
-            if os.path.exists(os.path.join(INDEX_DIR, "faiss_index.bin")):
-                os.remove(os.path.join(INDEX_DIR, "faiss_index.bin"))
-            if os.path.exists(os.path.join(INDEX_DIR, "chunks.pkl")):
-                os.remove(os.path.join(INDEX_DIR, "chunks.pkl"))
+        # Waits for the index write lock, e.g. while upload jobs publish, off the event loop
+        await asyncio.to_thread(_remove_from_index, filename)
 
         return {"message": f"Document '{filename}' deleted and index updated successfully."}
     except Exception as e:
@@ -0,0 +1,24 @@
+from fastapi import APIRouter, HTTPException
+from fastapi.responses import JSONResponse
+
+from core.startup import startup_state
+
+router = APIRouter()
+
+def require_ready():
+    """Dependency for routes that need the model and index: 503 until the warm-up has finished."""
+    if not startup_state.ready:
+        state = startup_state.snapshot()
+        detail = f"Startup failed: {state['error']}" if state["status"] == "failed" else "The model and index are still loading."
+        raise HTTPException(status_code=503, detail=detail, headers={"Retry-After": "5"})
+
+@router.get("/healthz")
+async def liveness():
+    """Liveness probe: the process is up and serving HTTP."""
+    return {"status": "ok"}
+
+@router.get("/readyz")
+async def readiness():
+    """Readiness probe: 200 once the model and index are loaded, 503 while starting or if startup failed."""
+    state = startup_state.snapshot()
+    return JSONResponse(state, status_code=200 if startup_state.ready else 503)
@@ -0,0 +1,21 @@
+from fastapi import APIRouter, HTTPException
+
+from core.jobs import load_job, list_jobs
+
+router = APIRouter()
+
+@router.get("/jobs")
+async def get_jobs(limit: int = 50):
+    """Lists recent upload jobs, newest first."""
+    return {"jobs": list_jobs(limit)}
+
+@router.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    """
+    Progress of an upload job: "queued", "extracting" (which includes chunking), "embedding" or "publishing",
+    then "succeeded" (with its chunk count and the index generation it went live in) or "failed".
+    """
+    job = load_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job '{job_id}' not found.")
+    return job
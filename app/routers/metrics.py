@@ -0,0 +1,11 @@
+from fastapi import APIRouter, Response
+from prometheus_client import generate_latest, CONTENT_TYPE_LATEST
+
+from utils.metrics import scrape_registry
+
+router = APIRouter()
+
+@router.get("/metrics")
+async def metrics():
+    """Prometheus scrape endpoint; with several workers, their metrics are added up."""
+    return Response(generate_latest(scrape_registry()), media_type=CONTENT_TYPE_LATEST)
@@ -1,9 +1,35 @@
-from fastapi import APIRouter
-from models.requests import QueryRequest
-from utils.decision_engine import get_decision_for_document_and_query
+import json
+from fastapi import APIRouter, HTTPException, Depends
+from fastapi.responses import StreamingResponse
+from core.config import MAX_BATCH_ITEMS
+from models.requests import QueryRequest, BatchQueryRequest
+from app.routers.health import require_ready
+from utils.decision_engine import (
+    get_decision_for_document_and_query_async, get_decisions_for_batch_async, stream_decision_for_document_and_query,
+)
 
 router = APIRouter()
 
-@router.post("/query")
+@router.post("/query", dependencies=[Depends(require_ready)])
 async def query_document(request: QueryRequest):
-    return get_decision_for_document_and_query(request.policy_filename, request.user_query)
+    return await get_decision_for_document_and_query_async(request.policy_filename, request.user_query)
+
+@router.post("/query/stream", dependencies=[Depends(require_ready)])
+async def query_document_stream(request: QueryRequest):
+    """Server-sent events: "retrieval" first, then "token" events while the LLM answers, then "decision" (or "error")."""
+    async def event_stream():
+        async for event, data in stream_decision_for_document_and_query(request.policy_filename, request.user_query):
+            yield f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@router.post("/query/batch", dependencies=[Depends(require_ready)])
+async def query_documents_batch(request: BatchQueryRequest):
+    if len(request.items) > MAX_BATCH_ITEMS:
+        raise HTTPException(status_code=413, detail=f"Batch too large: at most {MAX_BATCH_ITEMS} items per request.")
+    results = await get_decisions_for_batch_async([(item.policy_filename, item.user_query) for item in request.items])
+    return {"results": results}
@@ -0,0 +1,337 @@
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import platform
+import tempfile
+import subprocess
+from pathlib import Path
+from datetime import datetime, timezone
+
+import numpy as np
+
+from core.config import DOCUMENTS_DIR, SENTENCE_TRANSFORMER_MODEL, MAX_CHUNK_SIZE, OVERLAP, LLM_DEADLINE_SECONDS
+from core.indexing import global_model, global_index, IndexSnapshot, ChunksData
+from core.ingestion import find_document_files
+from utils.file_ops import extract_text_from_document
+from utils.bm25 import BM25Index
+from utils.chunking import recursive_chunk_text
+from utils.encoder import load_encoder
+from utils.semantic_search import build_faiss_index_from_embeddings, search_topk, search_topk_ids, prepare_embeddings, to_storage
+from utils.decision_cache import DecisionCache
+from utils.stub_llm import StubLLMClient
+from utils.llm_client import HTTPLLMBackend, ResilientLLMClient
+import utils.decision_engine as decision_engine
+
+EMBED_BATCH_SIZE = 64
+
+PROCEDURES = ["knee surgery", "cataract surgery", "air ambulance", "maternity cover", "dental treatment",
+              "organ donor expenses", "ayush treatment", "day care procedure", "hernia repair", "dialysis"]
+CITIES = ["Mumbai", "Pune", "Delhi", "Nagpur", "Chennai", "Kolkata", "Bengaluru", "Hyderabad"]
+CLAUSE_WORDS = ["insured", "hospitalisation", "expenses", "waiting", "period", "pre-existing", "disease", "claim",
+                "sum", "benefit", "exclusion", "policy", "coverage", "treatment", "medical", "practitioner",
+                "deductible", "co-payment", "network", "provider", "emergency", "room", "rent", "limit"]
+
+def generate_synthetic_corpus(output_dir, num_documents=20, pages_per_document=10, seed=0):
+    """Writes policy-like text documents of a controllable size. The same seed always gives the same corpus."""
+    rng = random.Random(seed)
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    for doc_number in range(num_documents):
+        pages = []
+        for page_number in range(pages_per_document):
+            paragraphs = []
+            for clause_number in range(rng.randint(6, 12)):
+                sentences = []
+                for _ in range(rng.randint(2, 6)):
+                    words = rng.choices(CLAUSE_WORDS + PROCEDURES, k=rng.randint(8, 24))
+                    sentences.append(" ".join(words).capitalize() + ".")
+                paragraphs.append(f"{page_number + 1}.{clause_number + 1} " + " ".join(sentences))
+            pages.append("\n\n".join(paragraphs))
+        (output_dir / f"synthetic_policy_{doc_number:03d}.txt").write_text("\x0c".join(pages), encoding="utf-8")
+    return find_document_files(output_dir)
+
+def generate_queries(doc_names, num_queries, seed=0):
+    rng = random.Random(seed)
+    return [
+        (rng.choice(doc_names),
+         f"{rng.randint(18, 75)}{rng.choice('MF')}, {rng.choice(PROCEDURES)}, {rng.choice(CITIES)}, {rng.randint(1, 24)}-month policy")
+        for _ in range(num_queries)
+    ]
+
+def summarize(timings, items=None):
+    """Latency percentiles over the timed calls; `items` counts work units (e.g. chunks) for throughput."""
+    timings = np.asarray(timings, dtype="float64")
+    total = float(timings.sum())
+    items = len(timings) if items is None else items
+    return {
+        "calls": len(timings),
+        "items": items,
+        "total_seconds": total,
+        "mean_ms": float(timings.mean() * 1000) if len(timings) else 0.0,
+        "p50_ms": float(np.percentile(timings, 50) * 1000) if len(timings) else 0.0,
+        "p95_ms": float(np.percentile(timings, 95) * 1000) if len(timings) else 0.0,
+        "p99_ms": float(np.percentile(timings, 99) * 1000) if len(timings) else 0.0,
+        "max_ms": float(timings.max() * 1000) if len(timings) else 0.0,
+        "items_per_second": items / total if total else 0.0,
+    }
+
+def timed(func, *args, **kwargs):
+    started = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - started
+
+def benchmark_corpus(doc_files, model, num_queries, repeat=1, seed=0):
+    """Times every pipeline stage on one corpus, feeding each stage the previous stage's output."""
+    stages = {}
+
+    timings, texts = [], {}
+    for _ in range(repeat):
+        for doc_file in doc_files:
+            texts[doc_file.name], elapsed = timed(extract_text_from_document, str(doc_file))
+            timings.append(elapsed)
+    stages["extract"] = summarize(timings)
+
+    timings, chunks = [], {}
+    for _ in range(repeat):
+        for name, text in texts.items():
+            chunks[name], elapsed = timed(recursive_chunk_text, text, MAX_CHUNK_SIZE, OVERLAP)
+            timings.append(elapsed)
+    stages["chunk"] = summarize(timings, items=repeat * sum(len(doc_chunks) for doc_chunks in chunks.values()))
+
+    all_texts = [chunk for doc_chunks in chunks.values() for chunk in doc_chunks]
+    sources = [name for name, doc_chunks in chunks.items() for _ in doc_chunks]
+    if not all_texts:
+        return {"documents": len(doc_files), "chunks": 0, "stages": stages}
+    # Documents without extractable text have no chunks to query
+    queries = generate_queries([name for name, doc_chunks in chunks.items() if doc_chunks], num_queries, seed)
+
+    timings, batches = [], []
+    for _ in range(repeat):
+        batches = []
+        for start in range(0, len(all_texts), EMBED_BATCH_SIZE):
+            vectors, elapsed = timed(model.encode, all_texts[start:start + EMBED_BATCH_SIZE])
+            batches.append(np.asarray(vectors, dtype="float32"))
+            timings.append(elapsed)
+    embeddings = np.vstack(batches)
+    stages["embed"] = summarize(timings, items=repeat * len(all_texts))
+
+    timings = []
+    for _ in range(repeat):
+        index, elapsed = timed(build_faiss_index_from_embeddings, embeddings)
+        timings.append(elapsed)
+    stages["index_build"] = summarize(timings, items=repeat * len(all_texts))
+
+    timings = []
+    for _ in range(repeat):
+        for _, query in queries:
+            _, elapsed = timed(search_topk, query, model, index, all_texts)
+            timings.append(elapsed)
+    stages["search_topk"] = summarize(timings)
+
+    ids = np.arange(len(all_texts))
+    timings = []
+    for _ in range(repeat):
+        bm25, elapsed = timed(BM25Index().add, ids.tolist(), all_texts)
+        timings.append(elapsed)
+    stages["bm25_build"] = summarize(timings, items=repeat * len(all_texts))
+
+    policy_ids = {name: ids[np.array(sources) == name] for name in set(sources)}
+    timings = []
+    for _ in range(repeat):
+        for policy_filename, query in queries:
+            _, elapsed = timed(bm25.search, query, policy_ids[policy_filename])
+            timings.append(elapsed)
+    stages["bm25_search"] = summarize(timings)
+
+    chunks_data = {"ids": ids.tolist(), "texts": all_texts, "metadata": [{"source": name} for name in sources]}
+    global_model.model = model
+    chunks = ChunksData(chunks_data, to_storage(prepare_embeddings(embeddings)), bm25)
+    global_index.set_snapshot(IndexSnapshot(index, chunks))
+
+    timings = []
+    for _ in range(repeat):
+        for policy_filename, query in queries:
+            _, elapsed = timed(search_topk_ids, query, model, index, chunks.ids_for_source(policy_filename))
+            timings.append(elapsed)
+    stages["search_topk_ids"] = summarize(timings)
+
+    # Hybrid search plus context selection, and how much clause text the prompt ends up with
+    timings, context_chars = [], []
+    for _ in range(repeat):
+        for policy_filename, query in queries:
+            parsed_query = decision_engine.parse_query_with_regex(query)
+            (_, passages), elapsed = timed(
+                decision_engine.retrieve_clauses, parsed_query, model, index, chunks,
+                chunks.ids_for_source(policy_filename))
+            timings.append(elapsed)
+            context_chars.append(sum(len(passage["text"]) for passage in passages))
+    stages["retrieve_context"] = summarize(timings)
+
+    timings = []
+    for _ in range(repeat):
+        for policy_filename, query in queries:
+            decision_engine.decision_cache.clear()
+            decision, elapsed = timed(decision_engine.get_decision_for_document_and_query, policy_filename, query)
+            if "error" in decision:
+                raise RuntimeError(f"End-to-end query failed for {policy_filename}: {decision['error']}")
+            timings.append(elapsed)
+    stages["end_to_end"] = summarize(timings)
+
+    return {
+        "documents": len(doc_files),
+        "characters": sum(len(text) for text in texts.values()),
+        "chunks": len(all_texts),
+        "queries": len(queries),
+        "mean_context_chars": float(np.mean(context_chars)),
+        "stages": stages,
+    }
+
+def benchmark_llm_client(endpoint, num_requests, concurrency):
+    """
+    Sends the same prompts to an HTTP LLM endpoint (e.g. fake_llm_server.py) directly and through
+    ResilientLLMClient with hedging, and compares latency percentiles and failures.
+    """
+    prompts = [f"Benchmark prompt {i}" for i in range(num_requests)]
+
+    async def run(client):
+        semaphore = asyncio.Semaphore(concurrency)
+        timings, errors = [], 0
+
+        async def send(prompt):
+            nonlocal errors
+            async with semaphore:
+                started = time.perf_counter()
+                try:
+                    # The same overall budget the resilient client gets
+                    await asyncio.wait_for(client.generate_content_async(prompt), LLM_DEADLINE_SECONDS)
+                except Exception:
+                    errors += 1
+                    return
+                timings.append(time.perf_counter() - started)
+
+        await asyncio.gather(*(send(prompt) for prompt in prompts))
+        return {**summarize(timings), "errors": errors}
+
+    return {
+        "direct": asyncio.run(run(HTTPLLMBackend(endpoint))),
+        "resilient": asyncio.run(run(ResilientLLMClient(HTTPLLMBackend(endpoint), hedging=True))),
+    }
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run_benchmarks(args):
+    # Every LLM call goes to the deterministic stub and nothing is served from the decision cache
+    decision_engine.client = StubLLMClient(latency=args.llm_latency_ms / 1000)
+    decision_engine.decision_cache = DecisionCache(max_entries=0, ttl_seconds=0)
+
+    results = {
+        "environment": {
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "git_commit": git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+        },
+        "params": {
+            "model": args.model,
+            "max_chunk_size": MAX_CHUNK_SIZE,
+            "overlap": OVERLAP,
+            "repeat": args.repeat,
+            "queries": args.queries,
+            "llm_latency_ms": args.llm_latency_ms,
+            "synthetic_documents": args.synthetic_documents,
+            "synthetic_pages": args.synthetic_pages,
+            "seed": args.seed,
+        },
+        "corpora": {},
+    }
+
+    if args.corpus != "none":
+        model = load_encoder(args.model)
+
+    if args.corpus in ("documents", "all"):
+        doc_files = find_document_files(DOCUMENTS_DIR)
+        print(f"Benchmarking {len(doc_files)} bundled documents...")
+        decision_engine.DOCUMENTS_DIR = DOCUMENTS_DIR
+        results["corpora"]["documents"] = benchmark_corpus(doc_files, model, args.queries, args.repeat, args.seed)
+
+    if args.corpus in ("synthetic", "all"):
+        with tempfile.TemporaryDirectory() as corpus_dir:
+            doc_files = generate_synthetic_corpus(corpus_dir, args.synthetic_documents, args.synthetic_pages, args.seed)
+            print(f"Benchmarking {len(doc_files)} synthetic documents of {args.synthetic_pages} pages...")
+            decision_engine.DOCUMENTS_DIR = corpus_dir
+            results["corpora"]["synthetic"] = benchmark_corpus(doc_files, model, args.queries, args.repeat, args.seed)
+
+    if args.llm_endpoint:
+        print(f"Benchmarking the LLM client against {args.llm_endpoint}...")
+        results["llm_client"] = benchmark_llm_client(args.llm_endpoint, args.llm_requests, args.llm_concurrency)
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    print_results(results)
+    print(f"\nResults written to {args.output}")
+
+def print_results(results):
+    for corpus, corpus_results in results["corpora"].items():
+        print(f"\n--- {corpus}: {corpus_results['documents']} documents, {corpus_results['chunks']} chunks ---")
+        for stage, stats in corpus_results["stages"].items():
+            print(f"{stage:<16} mean {stats['mean_ms']:9.2f} ms  p95 {stats['p95_ms']:9.2f} ms  {stats['items_per_second']:10.1f} items/s")
+        if "mean_context_chars" in corpus_results:
+            print(f"{'context':<16} {corpus_results['mean_context_chars']:.0f} characters of clauses per prompt on average")
+    if "llm_client" in results:
+        print("\n--- LLM client ---")
+        for mode, stats in results["llm_client"].items():
+            print(f"{mode:<16} p50 {stats['p50_ms']:9.2f} ms  p95 {stats['p95_ms']:9.2f} ms  p99 {stats['p99_ms']:9.2f} ms  {stats['errors']} errors")
+
+def compare_results(baseline_path, candidate_path):
+    """Prints the change in mean latency per stage between two result files."""
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = json.load(f)
+    with open(candidate_path, "r", encoding="utf-8") as f:
+        candidate = json.load(f)
+    if baseline.get("params") != candidate.get("params"):
+        print("Warning: the two runs used different parameters.")
+
+    for corpus, corpus_results in candidate["corpora"].items():
+        if corpus not in baseline["corpora"]:
+            continue
+        print(f"\n--- {corpus} ---")
+        for stage, stats in corpus_results["stages"].items():
+            before = baseline["corpora"][corpus]["stages"].get(stage)
+            if not before:
+                continue
+            change = (stats["mean_ms"] / before["mean_ms"] - 1) if before["mean_ms"] else 0.0
+            print(f"{stage:<16} {before['mean_ms']:9.2f} ms -> {stats['mean_ms']:9.2f} ms  ({change:+.1%})")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Times each stage of the retrieval pipeline with an offline LLM stand-in.")
+    parser.add_argument("--corpus", choices=["documents", "synthetic", "all", "none"], default="all")
+    parser.add_argument("--model", default=SENTENCE_TRANSFORMER_MODEL)
+    parser.add_argument("--repeat", type=int, default=1, help="Run every stage this many times.")
+    parser.add_argument("--queries", type=int, default=50, help="Queries per corpus for the search and end-to-end stages.")
+    parser.add_argument("--llm-latency-ms", type=float, default=0.0, help="Simulated LLM round trip.")
+    parser.add_argument("--synthetic-documents", type=int, default=20)
+    parser.add_argument("--synthetic-pages", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--llm-endpoint", help="Also compare direct and resilient calls to this HTTP LLM endpoint, e.g. fake_llm_server.py.")
+    parser.add_argument("--llm-requests", type=int, default=200)
+    parser.add_argument("--llm-concurrency", type=int, default=8)
+    parser.add_argument("--output", default="bench_results.json")
+    parser.add_argument("--compare", nargs=2, metavar=("BASELINE", "CANDIDATE"), help="Compare two result files instead of running.")
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        compare_results(*args.compare)
+    else:
+        run_benchmarks(args)
+
+if __name__ == "__main__":
+    sys.exit(main())
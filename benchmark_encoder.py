@@ -0,0 +1,86 @@
+import os
+import sys
+import json
+import time
+import argparse
+
+from core.config import DOCUMENTS_DIR, SENTENCE_TRANSFORMER_MODEL, MAX_CHUNK_SIZE, OVERLAP
+from core.indexing import _index_paths, current_index_dir
+from core.ingestion import find_document_files
+from utils.file_ops import extract_text_from_document
+from utils.chunking import recursive_chunk_text
+from utils.text_store import TextStore
+from utils.encoder import ENCODER_BACKENDS, MIN_EQUIVALENT_COSINE, load_encoder, compare_encoders, measure_throughput
+
+REFERENCE = "torch"
+
+def load_texts(index_dir=None, documents_dir=DOCUMENTS_DIR):
+    """The saved chunk texts, or the documents chunked afresh when nothing has been indexed yet."""
+    _, _, _, _, texts_path = _index_paths(index_dir or current_index_dir())
+    if os.path.exists(texts_path):
+        return list(TextStore(texts_path))
+    texts = []
+    for doc_file in find_document_files(documents_dir):
+        texts.extend(recursive_chunk_text(extract_text_from_document(str(doc_file)), MAX_CHUNK_SIZE, OVERLAP))
+    return texts
+
+def load_queries(path="test_cases.json"):
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return [case["query"] for case in json.load(f)]
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description=f"Compares the encoder backends selectable under [MODEL] in config.ini on throughput and query latency, "
+                    f"and checks each one's embeddings against the {REFERENCE} model (cosine >= {MIN_EQUIVALENT_COSINE}).")
+    parser.add_argument("--backends", nargs="+", choices=ENCODER_BACKENDS, default=list(ENCODER_BACKENDS))
+    parser.add_argument("--model", default=SENTENCE_TRANSFORMER_MODEL)
+    parser.add_argument("--texts", type=int, default=2000, help="Encode at most this many chunk texts.")
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--test-cases", default="test_cases.json")
+    parser.add_argument("--output", default="bench_encoder_results.json")
+    args = parser.parse_args(argv)
+
+    texts = load_texts()[:args.texts]
+    if not texts:
+        print("No chunk texts found; index or add some documents first.")
+        return 1
+    queries = load_queries(args.test_cases)
+
+    print(f"Loading the {REFERENCE} reference model...")
+    started = time.perf_counter()
+    reference = load_encoder(args.model, REFERENCE)
+    reference_load_seconds = time.perf_counter() - started
+    results = []
+    for backend in args.backends:
+        print(f"Benchmarking {backend} on {len(texts)} texts...")
+        started = time.perf_counter()
+        try:
+            model = reference if backend == REFERENCE else load_encoder(args.model, backend)
+        except Exception as e:
+            # The ONNX backends need optional packages; report them as unavailable rather than stopping
+            print(f"  {backend} unavailable: {e}")
+            results.append({"backend": backend, "error": str(e)})
+            continue
+        load_seconds = reference_load_seconds if backend == REFERENCE else time.perf_counter() - started
+        result = {"backend": backend, "load_seconds": load_seconds}
+        result.update(measure_throughput(model, texts, args.batch_size, queries))
+        result.update(compare_encoders(reference, model, texts, args.batch_size))
+        results.append(result)
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump({"model": args.model, "batch_size": args.batch_size, "results": results}, f, indent=2)
+
+    print(f"\n{'backend':<11} {'load s':>7} {'texts/s':>9} {'q p50 ms':>9} {'q p95 ms':>9} {'mean cos':>9} {'min cos':>8} {'equivalent':>10}")
+    for result in results:
+        if "error" in result:
+            print(f"{result['backend']:<11} unavailable")
+            continue
+        print(f"{result['backend']:<11} {result['load_seconds']:7.1f} {result['texts_per_second']:9.1f} {result['query_p50_ms']:9.2f} "
+              f"{result['query_p95_ms']:9.2f} {result['mean_cosine']:9.4f} {result['min_cosine']:8.4f} {str(result['equivalent']):>10}")
+    print(f"\nResults written to {args.output}")
+    return 0 if all(result.get("equivalent", True) for result in results) else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
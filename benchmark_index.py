@@ -0,0 +1,158 @@
+import os
+import sys
+import json
+import time
+import argparse
+
+import faiss
+import numpy as np
+
+from core.indexing import _index_paths, current_index_dir
+from utils.semantic_search import (
+    EMBEDDING_DTYPES, build_faiss_index_from_embeddings, configure_search, index_settings, search_ids_by_vector, from_storage,
+)
+
+# Index settings to compare: build-time settings, each with the query-time knobs to sweep
+DEFAULT_GRID = [
+    ({"type": "flat"}, [{}]),
+    ({"type": "hnsw", "hnsw_m": 16}, [{"hnsw_ef_search": ef} for ef in (32, 64, 128)]),
+    ({"type": "hnsw", "hnsw_m": 32}, [{"hnsw_ef_search": ef} for ef in (32, 64, 128)]),
+    ({"type": "ivf_flat"}, [{"ivf_nprobe": nprobe} for nprobe in (4, 16, 64)]),
+    ({"type": "ivf_pq", "pq_m": 16}, [{"ivf_nprobe": nprobe} for nprobe in (16, 64)]),
+    ({"type": "ivf_pq", "pq_m": 48}, [{"ivf_nprobe": nprobe} for nprobe in (16, 64)]),
+]
+
+def load_stored_vectors(index_dir=None):
+    """Returns the saved embeddings and the source document of each row."""
+    _, chunks_path, embeddings_path, _, _ = _index_paths(index_dir or current_index_dir())
+    with open(chunks_path, "r", encoding="utf-8") as f:
+        chunks_data = json.load(f)
+    vectors = from_storage(np.load(embeddings_path))
+    return vectors, [meta["source"] for meta in chunks_data["metadata"]]
+
+def synthetic_vectors(num_vectors, dim=384, num_documents=None, seed=0):
+    """
+    Clustered unit vectors standing in for chunk embeddings: each synthetic document's
+    chunks scatter around a document centre, so neighbours are mostly within a document.
+    """
+    rng = np.random.default_rng(seed)
+    num_documents = num_documents or max(1, num_vectors // 150)
+    centres = rng.standard_normal((num_documents, dim)).astype("float32")
+    doc_of_row = rng.integers(0, num_documents, num_vectors)
+    vectors = centres[doc_of_row] + 0.8 * rng.standard_normal((num_vectors, dim)).astype("float32")
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors, [f"doc_{doc}" for doc in doc_of_row]
+
+def make_queries(vectors, num_queries, seed=0):
+    """Perturbed copies of random stored vectors, so every query has genuine near neighbours."""
+    rng = np.random.default_rng(seed + 1)
+    rows = rng.choice(len(vectors), size=min(num_queries, len(vectors)), replace=False)
+    queries = vectors[rows] + 0.05 * rng.standard_normal((len(rows), vectors.shape[1])).astype("float32")
+    return np.ascontiguousarray(queries, dtype="float32"), rows
+
+def recall_at_k(found, truth, k):
+    hits = [len(set(f[:k]) & set(t[:k])) / min(k, len(t)) for f, t in zip(found, truth) if len(t)]
+    return float(np.mean(hits)) if hits else 0.0
+
+def benchmark_setting(index, settings, queries, truth, filters, k):
+    configure_search(index, settings)
+    latencies, found = [], []
+    for q in queries:
+        started = time.perf_counter()
+        _, ids = index.search(q.reshape(1, -1), k)
+        latencies.append(time.perf_counter() - started)
+        found.append([int(i) for i in ids[0] if i != -1])
+
+    started = time.perf_counter()
+    index.search(queries, k)
+    batch_seconds = time.perf_counter() - started
+
+    result = {
+        f"recall_at_{k}": recall_at_k(found, truth, k),
+        "p50_ms": float(np.percentile(latencies, 50) * 1000),
+        "p95_ms": float(np.percentile(latencies, 95) * 1000),
+        "batch_queries_per_second": len(queries) / batch_seconds if batch_seconds else 0.0,
+    }
+    if filters:
+        # Policy-restricted search through the index alone, without the exact small-candidate path
+        filtered = [search_ids_by_vector(q, index, candidate_ids, k) for q, (candidate_ids, _) in zip(queries, filters)]
+        result[f"filtered_recall_at_{k}"] = recall_at_k(filtered, [t for _, t in filters], k)
+    return result
+
+def run(vectors, sources, num_queries, k, grid, seed=0, dtype=None):
+    queries, query_rows = make_queries(vectors, num_queries, seed)
+    exact = faiss.IndexFlatL2(vectors.shape[1])
+    exact.add(vectors)
+    _, truth = exact.search(queries, k)
+    truth = [list(row) for row in truth]
+
+    filters = None
+    if sources is not None:
+        # Restrict each query to the document its source vector came from, like a /query on one policy
+        rows_by_source = {}
+        for row, source in enumerate(sources):
+            rows_by_source.setdefault(source, []).append(row)
+        filters = []
+        for q, row in zip(queries, query_rows):
+            candidate_ids = np.array(rows_by_source[sources[row]], dtype="int64")
+            distances = ((vectors[candidate_ids] - q) ** 2).sum(axis=1)
+            filters.append((candidate_ids, [int(candidate_ids[i]) for i in np.argsort(distances)[:k]]))
+
+    results = []
+    for build_overrides, query_overrides in grid:
+        if dtype:
+            build_overrides = {**build_overrides, "dtype": dtype}
+        settings = index_settings(**build_overrides)
+        started = time.perf_counter()
+        index = build_faiss_index_from_embeddings(vectors, settings=settings)
+        build_seconds = time.perf_counter() - started
+        memory_bytes = len(faiss.serialize_index(index))
+        for overrides in query_overrides:
+            setting = {**build_overrides, **overrides}
+            print(f"Measuring {setting}...")
+            results.append({
+                "setting": setting,
+                "build_seconds": build_seconds,
+                "memory_mb": memory_bytes / (1024 * 1024),
+                **benchmark_setting(index, {**settings, **overrides}, queries, truth, filters, k),
+            })
+    return results
+
+def print_results(results, k):
+    print(f"\n{'setting':<52} {'recall@' + str(k):>9} {'filtered':>9} {'p50 ms':>8} {'p95 ms':>8} {'MB':>9} {'build s':>8}")
+    for result in results:
+        setting = ", ".join(f"{key}={value}" for key, value in result["setting"].items())
+        filtered = result.get(f"filtered_recall_at_{k}")
+        print(f"{setting:<52} {result[f'recall_at_{k}']:9.3f} {'' if filtered is None else f'{filtered:9.3f}':>9} "
+              f"{result['p50_ms']:8.3f} {result['p95_ms']:8.3f} {result['memory_mb']:9.1f} {result['build_seconds']:8.1f}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compares FAISS index types on recall@k against exact search, query latency and memory.")
+    parser.add_argument("--synthetic", type=int, default=0, help="Benchmark this many synthetic vectors instead of the saved index.")
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--types", nargs="+", choices=["flat", "hnsw", "ivf_flat", "ivf_pq"], help="Only benchmark these index types.")
+    parser.add_argument("--dtype", choices=EMBEDDING_DTYPES, help="Vector precision in the index (default: [INDEX] EMBEDDING_DTYPE).")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="bench_index_results.json")
+    args = parser.parse_args(argv)
+
+    if args.synthetic:
+        vectors, sources = synthetic_vectors(args.synthetic, args.dim, seed=args.seed)
+    else:
+        if not os.path.exists(_index_paths(current_index_dir())[2]):
+            print("No saved embeddings found. Run preprocess.py first, or pass --synthetic N.")
+            return 1
+        vectors, sources = load_stored_vectors()
+    grid = [entry for entry in DEFAULT_GRID if not args.types or entry[0]["type"] in args.types]
+
+    print(f"Benchmarking {len(vectors)} vectors of dimension {vectors.shape[1]}...")
+    results = run(vectors, sources, args.queries, args.k, grid, args.seed, args.dtype)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump({"vectors": len(vectors), "dim": int(vectors.shape[1]), "k": args.k, "results": results}, f, indent=2)
+    print_results(results, args.k)
+    print(f"\nResults written to {args.output}")
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,139 @@
+import re
+import sys
+import json
+import random
+import argparse
+
+import faiss
+import numpy as np
+
+from core.config import DOCUMENTS_DIR, SENTENCE_TRANSFORMER_MODEL, MAX_CHUNK_SIZE, OVERLAP
+from core.ingestion import find_document_files
+from utils.file_ops import extract_text_from_document
+from utils.chunking import recursive_chunk_text
+from utils.encoder import load_encoder
+from utils.semantic_search import (
+    build_faiss_index_from_embeddings, index_settings, prepare_embeddings, search_ids_by_vector, to_storage,
+)
+
+# Storage variants to compare: (label, dtype, normalize). Results are compared against "float32"
+VARIANTS = [
+    ("float32-l2", "float32", False),
+    ("float32", "float32", True),
+    ("float16", "float16", True),
+    ("int8", "int8", True),
+]
+REFERENCE = "float32"
+
+def load_test_cases(path="test_cases.json"):
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def encode_corpus(doc_files, model):
+    """Extracts, chunks and encodes the documents; returns the chunk texts, their sources and float32 vectors."""
+    texts, sources = [], []
+    for doc_file in doc_files:
+        for chunk in recursive_chunk_text(extract_text_from_document(str(doc_file)), MAX_CHUNK_SIZE, OVERLAP):
+            texts.append(chunk)
+            sources.append(doc_file.name)
+    return texts, sources, np.asarray(model.encode(texts), dtype="float32")
+
+def sample_chunk_queries(texts, sources, num_queries, seed=0):
+    """Looks up chunks by their opening sentence, like a user quoting a clause."""
+    rng = random.Random(seed)
+    rows = rng.sample(range(len(texts)), min(num_queries, len(texts)))
+    return [(sources[row], re.split(r"(?<=[.!?])\s", texts[row].strip(), maxsplit=1)[0][:300], None) for row in rows]
+
+def keyword_coverage(texts, keywords):
+    """Share of the expected justification keywords found in the retrieved chunks."""
+    if not keywords:
+        return None
+    retrieved = " ".join(texts).lower()
+    return sum(keyword.lower() in retrieved for keyword in keywords) / len(keywords)
+
+def overlap_at_k(found, reference, k):
+    scores = [len(set(f[:k]) & set(r[:k])) / min(k, len(r)) for f, r in zip(found, reference) if len(r)]
+    return float(np.mean(scores)) if scores else 0.0
+
+def evaluate(texts, sources, vectors, queries, q_vecs, k):
+    """
+    Retrieves the top k chunks of each query's document under every storage variant, both
+    through the index (filtered search) and from the stored vectors (the exact small-policy path).
+    """
+    rows_by_source = {}
+    for row, source in enumerate(sources):
+        rows_by_source.setdefault(source, []).append(row)
+
+    found = {}
+    results = []
+    for label, dtype, normalize in VARIANTS:
+        settings = index_settings(type="flat", dtype=dtype, normalize=normalize)
+        index = build_faiss_index_from_embeddings(vectors, settings=settings)
+        stored = to_storage(prepare_embeddings(vectors, settings), dtype)
+        from_index, from_store = [], []
+        for (document, _, _), q_vec in zip(queries, q_vecs):
+            candidate_ids = np.array(rows_by_source.get(document, []), dtype="int64")
+            from_index.append(search_ids_by_vector(q_vec, index, candidate_ids, k))
+            from_store.append(search_ids_by_vector(q_vec, index, candidate_ids, k, candidate_vectors=stored[candidate_ids]))
+        found[label] = (from_index, from_store)
+        coverage = [keyword_coverage([texts[i] for i in ids], keywords) for ids, (_, _, keywords) in zip(from_store, queries)]
+        coverage = [c for c in coverage if c is not None]
+        results.append({
+            "variant": label,
+            "store_bytes_per_vector": stored.nbytes / len(stored),
+            "index_bytes_per_vector": len(faiss.serialize_index(index)) / len(stored),
+            "keyword_coverage": float(np.mean(coverage)) if coverage else None,
+        })
+
+    reference = found[REFERENCE][1]
+    for result in results:
+        from_index, from_store = found[result["variant"]]
+        result[f"index_overlap_at_{k}"] = overlap_at_k(from_index, reference, k)
+        result[f"store_overlap_at_{k}"] = overlap_at_k(from_store, reference, k)
+        result["top1_agreement"] = float(np.mean([bool(f) and bool(r) and f[0] == r[0] for f, r in zip(from_store, reference)]))
+    return results
+
+def print_results(results, k):
+    print(f"\n{'variant':<12} {'store B/vec':>11} {'index B/vec':>11} {'index@' + str(k):>9} {'store@' + str(k):>9} {'top1':>6} {'keywords':>9}")
+    for result in results:
+        keywords = result["keyword_coverage"]
+        print(f"{result['variant']:<12} {result['store_bytes_per_vector']:11.0f} {result['index_bytes_per_vector']:11.0f} "
+              f"{result[f'index_overlap_at_{k}']:9.3f} {result[f'store_overlap_at_{k}']:9.3f} {result['top1_agreement']:6.3f} "
+              f"{'' if keywords is None else f'{keywords:9.3f}':>9}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description=f"Measures how float16 and int8 embedding storage change retrieval against {REFERENCE}, "
+                    "on the test_cases.json queries plus clause lookups sampled from the documents.")
+    parser.add_argument("--test-cases", default="test_cases.json")
+    parser.add_argument("--documents-dir", default=DOCUMENTS_DIR)
+    parser.add_argument("--model", default=SENTENCE_TRANSFORMER_MODEL)
+    parser.add_argument("--queries", type=int, default=200, help="Sampled clause queries added to the test cases.")
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="bench_quantization_results.json")
+    args = parser.parse_args(argv)
+
+    doc_files = find_document_files(args.documents_dir)
+    if not doc_files:
+        print(f"No documents found in {args.documents_dir}.")
+        return 1
+    model = load_encoder(args.model)
+    print(f"Encoding {len(doc_files)} documents...")
+    texts, sources, vectors = encode_corpus(doc_files, model)
+
+    indexed = set(sources)
+    queries = [(case["document"], case["query"], case.get("expected_justification_keywords"))
+               for case in load_test_cases(args.test_cases) if case["document"] in indexed]
+    queries += sample_chunk_queries(texts, sources, args.queries, args.seed)
+    q_vecs = np.asarray(model.encode([query for _, query, _ in queries]), dtype="float32")
+
+    print(f"Comparing storage variants on {len(queries)} queries over {len(texts)} chunks...")
+    results = evaluate(texts, sources, vectors, queries, q_vecs, args.k)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump({"chunks": len(texts), "queries": len(queries), "k": args.k, "results": results}, f, indent=2)
+    print_results(results, args.k)
+    print(f"\nResults written to {args.output}")
+
+if __name__ == "__main__":
+    sys.exit(main())
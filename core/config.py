@@ -1,10 +1,15 @@
 import os
+import configparser
 from dotenv import load_dotenv
 
 load_dotenv()
 
-DOCUMENTS_DIR = "documents/"
-INDEX_DIR = "faiss_index"
+# Settings shared with preprocess.py; values below are the fallbacks when config.ini omits them
+config = configparser.ConfigParser()
+config.read("config.ini")
+
+DOCUMENTS_DIR = config.get("PATHS", "DOCUMENTS_DIR", fallback="documents/")
+INDEX_DIR = config.get("PATHS", "INDEX_DIR", fallback="faiss_index")
 PROMPT_PATH = "prompts/decision_prompt.txt"
 
 # OAuth2 and JWT settings
@@ -15,6 +20,97 @@ SECRET_KEY = os.getenv("SECRET_KEY")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
-SENTENCE_TRANSFORMER_MODEL = 'all-MiniLM-L6-v2'
-MAX_CHUNK_SIZE = 1024
-OVERLAP = 100
+SENTENCE_TRANSFORMER_MODEL = config.get("MODEL", "SENTENCE_TRANSFORMER_MODEL", fallback="all-MiniLM-L6-v2")
+# Encoder runtime (torch, torch_int8, onnx or onnx_int8); see utils/encoder.py and benchmark_encoder.py
+ENCODER_BACKEND = config.get("MODEL", "ENCODER_BACKEND", fallback="torch").lower()
+ENCODER_ONNX_QUANTIZATION = config.get("MODEL", "ONNX_QUANTIZATION", fallback="avx2").lower()
+ENCODER_CACHE_DIR = config.get("MODEL", "ENCODER_CACHE_DIR", fallback="encoder_cache")
+MAX_CHUNK_SIZE = config.getint("CHUNKING", "MAX_CHUNK_SIZE", fallback=1024)
+OVERLAP = config.getint("CHUNKING", "OVERLAP", fallback=100)
+
+# Vector index type and tuning; see utils/semantic_search.py and benchmark_index.py
+INDEX_TYPE = config.get("INDEX", "TYPE", fallback="flat").lower()
+HNSW_M = config.getint("INDEX", "HNSW_M", fallback=32)
+HNSW_EF_CONSTRUCTION = config.getint("INDEX", "HNSW_EF_CONSTRUCTION", fallback=200)
+HNSW_EF_SEARCH = config.getint("INDEX", "HNSW_EF_SEARCH", fallback=64)
+IVF_NLIST = config.getint("INDEX", "IVF_NLIST", fallback=0)
+IVF_NPROBE = config.getint("INDEX", "IVF_NPROBE", fallback=16)
+PQ_M = config.getint("INDEX", "PQ_M", fallback=16)
+PQ_NBITS = config.getint("INDEX", "PQ_NBITS", fallback=8)
+EXACT_SEARCH_MAX_CANDIDATES = config.getint("INDEX", "EXACT_SEARCH_MAX_CANDIDATES", fallback=4096)
+# Published index versions kept on disk; workers still reading an older one keep it mapped
+INDEX_KEEP_SNAPSHOTS = max(1, config.getint("INDEX", "KEEP_SNAPSHOTS", fallback=3))
+
+# Embedding storage precision (float32, float16 or int8), in embeddings.npy and the index.
+# int8 codes assume unit-length vectors, so it always normalizes.
+EMBEDDING_DTYPE = config.get("INDEX", "EMBEDDING_DTYPE", fallback="float32").lower()
+NORMALIZE_EMBEDDINGS = config.getboolean("INDEX", "NORMALIZE_EMBEDDINGS", fallback=True) or EMBEDDING_DTYPE == "int8"
+
+# BM25 lexical search over the chunk texts, fused with the FAISS results by reciprocal rank
+BM25_ENABLED = config.getboolean("BM25", "ENABLED", fallback=True)
+BM25_K1 = config.getfloat("BM25", "K1", fallback=1.2)
+BM25_B = config.getfloat("BM25", "B", fallback=0.75)
+BM25_CANDIDATES = config.getint("BM25", "CANDIDATES", fallback=20)
+BM25_RRF_K = config.getint("BM25", "RRF_K", fallback=60)
+
+# Context sent to the LLM: retrieved candidates are diversified (MMR), merged and cut to a token budget
+CONTEXT_CANDIDATES = config.getint("CONTEXT", "CANDIDATES", fallback=12)
+CONTEXT_MAX_CHUNKS = config.getint("CONTEXT", "MAX_CHUNKS", fallback=6)
+CONTEXT_MAX_TOKENS = config.getint("CONTEXT", "MAX_TOKENS", fallback=1000)
+CONTEXT_MMR_LAMBDA = config.getfloat("CONTEXT", "MMR_LAMBDA", fallback=0.7)
+
+# Worker processes for document extraction and chunking; 0 uses one per CPU core, 1 runs serially
+INGEST_WORKERS = config.getint("INGESTION", "WORKERS", fallback=0)
+
+# Background upload jobs in the API server: jobs processed at once per server worker, the cap on jobs
+# waiting or in progress, how long a finished job waits for others to share its index publish, and
+# how long job status is kept. Job status is kept beside the index, so any server worker can report it.
+INGESTION_JOB_WORKERS = max(1, config.getint("INGESTION", "JOB_WORKERS", fallback=2))
+INGESTION_MAX_PENDING_JOBS = config.getint("INGESTION", "MAX_PENDING_JOBS", fallback=100)
+INGESTION_PUBLISH_MAX_WAIT_SECONDS = config.getfloat("INGESTION", "PUBLISH_MAX_WAIT_SECONDS", fallback=2)
+INGESTION_JOB_RETENTION_SECONDS = config.getint("INGESTION", "JOB_RETENTION_SECONDS", fallback=86400)
+INGESTION_JOBS_DIR = os.path.join(INDEX_DIR, "jobs")
+
+# Compressed cache of extracted document text, kept beside the index; 0 disables it
+EXTRACTION_CACHE_DIR = os.path.join(INDEX_DIR, "extraction_cache")
+EXTRACTION_CACHE_MAX_MB = config.getint("EXTRACTION_CACHE", "MAX_SIZE_MB", fallback=512)
+
+# Server worker processes, which share the saved index through memory-mapped files, and how often
+# each one checks whether another has published a new version
+SERVER_WORKERS = config.getint("SERVER", "WORKERS", fallback=1)
+INDEX_CHECK_SECONDS = config.getfloat("SERVER", "INDEX_CHECK_SECONDS", fallback=1)
+
+# Async query path: threads for query encoding/search, and the cap on concurrent LLM calls
+QUERY_CPU_WORKERS = config.getint("SERVER", "QUERY_CPU_WORKERS", fallback=4)
+LLM_MAX_CONCURRENCY = config.getint("SERVER", "LLM_MAX_CONCURRENCY", fallback=8)
+MAX_BATCH_ITEMS = config.getint("SERVER", "MAX_BATCH_ITEMS", fallback=64)
+
+# LLM decision cache: in-process LRU plus an optional on-disk tier beside the index
+DECISION_CACHE_MAX_ENTRIES = config.getint("DECISION_CACHE", "MAX_ENTRIES", fallback=1024)
+DECISION_CACHE_TTL_SECONDS = config.getint("DECISION_CACHE", "TTL_SECONDS", fallback=86400)
+DECISION_CACHE_DISK_ENABLED = config.getboolean("DECISION_CACHE", "DISK_ENABLED", fallback=False)
+DECISION_CACHE_DISK_MAX_MB = config.getint("DECISION_CACHE", "DISK_MAX_SIZE_MB", fallback=256)
+DECISION_CACHE_DIR = os.path.join(INDEX_DIR, "decision_cache")
+
+# Query embedding micro-batching: wait up to MAX_WAIT_MS or MAX_BATCH_SIZE queries, then encode them together
+EMBEDDING_BATCH_MAX_SIZE = config.getint("EMBEDDING_BATCHER", "MAX_BATCH_SIZE", fallback=32)
+EMBEDDING_BATCH_MAX_WAIT_MS = config.getfloat("EMBEDDING_BATCHER", "MAX_WAIT_MS", fallback=2)
+
+# Prometheus metrics are always on; per-request stage traces are opt-in
+METRICS_TRACE_REQUESTS = config.getboolean("METRICS", "TRACE_REQUESTS", fallback=False)
+METRICS_TRACE_LOG_FILE = config.get("METRICS", "TRACE_LOG_FILE", fallback="")
+# Where server workers share their metrics when `python -m app.main` starts several
+METRICS_MULTIPROC_DIR = config.get("METRICS", "MULTIPROC_DIR", fallback="prometheus_multiproc")
+
+# LLM backend (gemini, http or stub) with a per-request deadline, retries and optional hedging
+LLM_BACKEND = config.get("LLM", "BACKEND", fallback="gemini")
+LLM_MODEL = config.get("LLM", "MODEL", fallback="models/gemini-2.5-flash")
+LLM_HTTP_ENDPOINT = config.get("LLM", "HTTP_ENDPOINT", fallback="http://127.0.0.1:8010/generate")
+LLM_DEADLINE_SECONDS = config.getfloat("LLM", "DEADLINE_SECONDS", fallback=60)
+LLM_ATTEMPT_TIMEOUT_SECONDS = config.getfloat("LLM", "ATTEMPT_TIMEOUT_SECONDS", fallback=30)
+LLM_MAX_RETRIES = config.getint("LLM", "MAX_RETRIES", fallback=2)
+LLM_BACKOFF_BASE_SECONDS = config.getfloat("LLM", "BACKOFF_BASE_SECONDS", fallback=0.5)
+LLM_BACKOFF_MAX_SECONDS = config.getfloat("LLM", "BACKOFF_MAX_SECONDS", fallback=8)
+LLM_HEDGING_ENABLED = config.getboolean("LLM", "HEDGING_ENABLED", fallback=False)
+LLM_HEDGE_DELAY_SECONDS = config.getfloat("LLM", "HEDGE_DELAY_SECONDS", fallback=10)
+LLM_HEDGE_MIN_DELAY_SECONDS = config.getfloat("LLM", "HEDGE_MIN_DELAY_SECONDS", fallback=0.5)
@@ -1,14 +1,30 @@
 import os
+import json
+import time
 import pickle
-from pathlib import Path
+import shutil
+import threading
+from contextlib import contextmanager
 import faiss
-from sentence_transformers import SentenceTransformer
+import numpy as np
+from filelock import FileLock
 
-from utils.semantic_search import build_faiss_index_from_embeddings
-from utils.file_ops import extract_text_from_document
-from utils.chunking import recursive_chunk_text
+from utils.semantic_search import (
+    build_faiss_index_from_embeddings, built_index_type, configure_search, index_type_of, supports_remove, prepare_embeddings, to_storage, from_storage,
+)
+from utils.bm25 import BM25Index
+from utils.text_store import TextStore
+from utils.encoder import load_encoder
 
-from core.config import DOCUMENTS_DIR, INDEX_DIR, SENTENCE_TRANSFORMER_MODEL, MAX_CHUNK_SIZE, OVERLAP
+from core.config import (
+    INDEX_DIR, INDEX_TYPE, BM25_ENABLED, INDEX_CHECK_SECONDS, INDEX_KEEP_SNAPSHOTS,
+)
+
+# Each published version of the index lives in INDEX_DIR/snapshots/<generation>;
+# the CURRENT file names the generation readers should open
+SNAPSHOTS_DIRNAME = "snapshots"
+CURRENT_FILENAME = "CURRENT"
+WRITE_LOCK_FILENAME = "write.lock"
 
 class GlobalModel:
     def __init__(self):
@@ -16,52 +32,482 @@ class GlobalModel:
 
     def set_model(self, model_name: str):
         if self.model is None:
-            self.model = SentenceTransformer(model_name)
+            self.model = load_encoder(model_name)
 
-class GlobalFaissIndex:
-    def __init__(self):
-        self.index = None
+class ChunksData:
+    """
+    The chunk texts, metadata, stored embeddings and BM25 index of one index version,
+    with lookups by chunk id and by source document. `directory` is the snapshot the
+    data was loaded from, where a saved BM25 index may be found.
+    """
+    def __init__(self, chunks_data=None, embeddings=None, bm25=None, directory=None):
+        self.data = chunks_data if chunks_data is not None else {"ids": [], "texts": [], "metadata": []}
+        self.embeddings = embeddings
+        self.directory = directory
+        self._bm25 = bm25
+        self._source_ids = None
+        self._id_rows = None
+
+    def bm25_index(self):
+        """
+        The BM25 index over the chunk texts, or None with [BM25] disabled. It is read from
+        the snapshot if the saved one covers these chunks, and otherwise built on first use.
+        """
+        if not BM25_ENABLED:
+            return None
+        if self._bm25 is None:
+            saved = BM25Index.load(_index_paths(self.directory)[3]) if self.directory else None
+            if saved is None or not saved.matches(self.data["ids"]):
+                saved = BM25Index().add(self.data["ids"], self.data["texts"])
+            self._bm25 = saved
+        return self._bm25
+
+    def ids_for_source(self, source):
+        """Returns the chunk ids belonging to `source`, building the lookup map on first use."""
+        if self._source_ids is None:
+            source_ids = {}
+            for chunk_id, metadata in zip(self.data["ids"], self.data["metadata"]):
+                source_ids.setdefault(metadata["source"], []).append(chunk_id)
+            self._source_ids = {name: np.array(ids, dtype="int64") for name, ids in source_ids.items()}
+        return self._source_ids.get(source, np.empty(0, dtype="int64"))
+
+    def _rows(self):
+        if self._id_rows is None:
+            self._id_rows = {chunk_id: row for row, chunk_id in enumerate(self.data["ids"])}
+        return self._id_rows
+
+    def texts_for_ids(self, chunk_ids):
+        """Maps stable chunk ids back to their texts."""
+        rows = self._rows()
+        return [self.data["texts"][rows[int(chunk_id)]] for chunk_id in chunk_ids]
 
-    def set_index(self, faiss_index):
-        self.index = faiss_index
+    def metadata_for_ids(self, chunk_ids):
+        """Maps stable chunk ids to their metadata (source, pages and document offsets)."""
+        rows = self._rows()
+        return [self.data["metadata"][rows[int(chunk_id)]] for chunk_id in chunk_ids]
 
-class GlobalChunksData:
+    def vectors_for_ids(self, chunk_ids):
+        """
+        The stored embeddings of `chunk_ids`, row for row, or None without an embedding store.
+        They keep their EMBEDDING_DTYPE encoding; see utils.semantic_search.from_storage.
+        """
+        if self.embeddings is None:
+            return None
+        rows = self._rows()
+        return self.embeddings[np.array([rows[int(chunk_id)] for chunk_id in chunk_ids], dtype="int64")]
+
+    def next_id(self):
+        # Ids are never reused, so anything keyed on a chunk id stays valid
+        return self.data.get("next_id", max(self.data["ids"], default=-1) + 1)
+
+class IndexSnapshot:
+    """
+    One version of the index: a FAISS index and the chunk data it was built from. A snapshot
+    is never changed once in use; writers build the next one aside (see IndexWriter) and swap
+    it in. Queries take the current snapshot once and use it throughout, so they always see
+    an index and chunk list that match, even if a new version goes live meanwhile.
+    """
+    def __init__(self, index=None, chunks=None, generation=None, directory=None, migrated=False, mapped=False):
+        self.index = index
+        self.chunks = chunks if chunks is not None else ChunksData()
+        # The published generation it was loaded from; None for data built in memory (benchmarks)
+        self.generation = generation
+        self.directory = directory
+        # Loaded from an older on-disk layout or index type and converted in memory; publishing persists it
+        self.migrated = migrated
+        # The index views the memory-mapped file in `directory`, so it must not be cloned or changed
+        self.mapped = mapped
+
+class GlobalIndex:
     def __init__(self):
-        self.data = {"texts": [], "metadata": []}
+        self.snapshot = IndexSnapshot()
 
-    def set_data(self, chunks_data):
-        self.data = chunks_data
+    def set_snapshot(self, snapshot):
+        self.snapshot = snapshot
 
 global_model = GlobalModel()
-global_faiss_index = GlobalFaissIndex()
-global_all_chunks_data = GlobalChunksData()
+global_index = GlobalIndex()
 
-def load_global_index_and_chunks():
-    index_path = os.path.join(INDEX_DIR, "faiss_index.bin")
-    chunks_path = os.path.join(INDEX_DIR, "chunks.pkl")
+def _index_paths(index_dir=INDEX_DIR):
+    return (
+        os.path.join(index_dir, "index.faiss"),
+        os.path.join(index_dir, "chunks.json"),
+        os.path.join(index_dir, "embeddings.npy"),
+        os.path.join(index_dir, "bm25"),
+        os.path.join(index_dir, "texts.bin"),
+    )
 
-    global_index = None
-    all_chunks_data = {"texts": [], "metadata": []}
+def _legacy_index_paths(index_dir=INDEX_DIR):
+    # Pickled index and chunks written by older versions
+    return (
+        os.path.join(index_dir, "faiss_index.bin"),
+        os.path.join(index_dir, "chunks.pkl"),
+    )
+
+def _snapshot_dir(generation, index_dir=INDEX_DIR):
+    return os.path.join(index_dir, SNAPSHOTS_DIRNAME, f"{generation:08d}")
+
+def read_generation(index_dir=INDEX_DIR):
+    """The generation of the published snapshot, from the CURRENT pointer; 0 before the first publish."""
+    try:
+        with open(os.path.join(index_dir, CURRENT_FILENAME), "r", encoding="utf-8") as f:
+            return int(f.read())
+    except (FileNotFoundError, ValueError):
+        return 0
 
-    if os.path.exists(index_path) and os.path.exists(chunks_path):
+def current_index_dir(index_dir=INDEX_DIR):
+    """The directory holding the published index files (INDEX_DIR itself for indexes saved before snapshots)."""
+    generation = read_generation(index_dir)
+    return _snapshot_dir(generation, index_dir) if generation else index_dir
+
+def _read_index_mmap(index_path):
+    """
+    Opens a native FAISS index memory-mapped, so cold start doesn't copy vectors onto the heap
+    and processes on one host share their pages. IO_FLAG_MMAP_IFC maps the codes of flat, SQ,
+    HNSW and IVF indexes; IO_FLAG_MMAP alone only maps IVF lists and reads the others whole.
+    """
+    for flags in (faiss.IO_FLAG_MMAP_IFC, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY):
         try:
-            with open(index_path, "rb") as f:
-                global_index = pickle.load(f)
-            with open(chunks_path, "rb") as f:
-                all_chunks_data = pickle.load(f)
-        except Exception as e:
-            print(f"Error loading existing index or chunks: {e}")
+            return faiss.read_index(index_path, flags)
+        except RuntimeError:
+            pass
+    # Not every index type can be mapped; fall back to a regular read
+    return faiss.read_index(index_path)
+
+def _load_legacy_index_and_chunks(index_dir):
+    legacy_index_path, legacy_chunks_path = _legacy_index_paths(index_dir)
+    with open(legacy_index_path, "rb") as f:
+        global_index = pickle.load(f)
+    with open(legacy_chunks_path, "rb") as f:
+        all_chunks_data = pickle.load(f)
     return global_index, all_chunks_data
 
-def save_global_index_and_chunks(index, chunks_data):
-    index_path = os.path.join(INDEX_DIR, "faiss_index.bin")
-    chunks_path = os.path.join(INDEX_DIR, "chunks.pkl")
-    
-    os.makedirs(INDEX_DIR, exist_ok=True) # Ensure directory exists
+def load_global_index_and_chunks(index_dir=INDEX_DIR):
+    """
+    Loads the FAISS index, chunk data and embedding store saved in `index_dir`.
+    The index, embeddings and chunk texts are memory-mapped, so processes on one host share their pages.
+    Returns (index, chunks_data, embeddings, migrated), where `migrated` means the index was
+    converted in memory from an older format or another [INDEX] TYPE.
+    """
+    index_path, chunks_path, embeddings_path, _, texts_path = _index_paths(index_dir)
+    legacy_index_path, legacy_chunks_path = _legacy_index_paths(index_dir)
+
+    global_index = None
+    all_chunks_data = {"ids": [], "texts": [], "metadata": []}
+    embeddings = None
+
+    try:
+        if os.path.exists(index_path) and os.path.exists(chunks_path):
+            global_index = _read_index_mmap(index_path)
+            with open(chunks_path, "r", encoding="utf-8") as f:
+                all_chunks_data = json.load(f)
+            if "texts" not in all_chunks_data:
+                # Older versions kept the texts in chunks.json
+                all_chunks_data["texts"] = TextStore(texts_path)
+        elif os.path.exists(legacy_index_path) and os.path.exists(legacy_chunks_path):
+            print("Migrating pickled index to the native format...")
+            global_index, all_chunks_data = _load_legacy_index_and_chunks(index_dir)
+        else:
+            return global_index, all_chunks_data, embeddings, False
+        if os.path.exists(embeddings_path):
+            embeddings = np.load(embeddings_path, mmap_mode="r")
+    except Exception as e:
+        print(f"Error loading existing index or chunks: {e}")
+        return None, {"ids": [], "texts": [], "metadata": []}, None, False
+
+    if "ids" not in all_chunks_data:
+        # Written before stable chunk ids: rows are positional
+        all_chunks_data["ids"] = list(range(len(all_chunks_data["texts"])))
+    if embeddings is None and global_index is not None and global_index.ntotal:
+        # No embedding store yet; a flat index still holds the exact vectors
+        embeddings = global_index.reconstruct_batch(np.array(all_chunks_data["ids"], dtype="int64"))
+    if global_index is not None and embeddings is not None and (
+            not isinstance(global_index, faiss.IndexIDMap2)
+            or index_type_of(global_index) != built_index_type(global_index.d, global_index.ntotal)):
+        # Older index format or a different [INDEX] TYPE: rebuild from the stored vectors, nothing is re-encoded.
+        # The saved files are left alone; the next reconcile publishes the rebuilt index.
+        print(f"Rebuilding the FAISS index as '{INDEX_TYPE}'...")
+        global_index = build_faiss_index_from_embeddings(embeddings, all_chunks_data["ids"])
+        return global_index, all_chunks_data, embeddings, True
+    if global_index is not None:
+        configure_search(global_index)
+    return global_index, all_chunks_data, embeddings, False
 
-    with open(index_path, "wb") as f:
-        pickle.dump(index, f)
-    with open(chunks_path, "wb") as f:
-        pickle.dump(chunks_data, f)
+def load_snapshot(index_dir=INDEX_DIR):
+    """Opens the published snapshot named by the CURRENT pointer."""
+    while True:
+        generation = read_generation(index_dir)
+        directory = _snapshot_dir(generation, index_dir) if generation else index_dir
+        index, chunks_data, embeddings, migrated = load_global_index_and_chunks(directory)
+        # Snapshots are deleted INDEX_KEEP_SNAPSHOTS publishes later; if that many went live
+        # while this one was being read, its files may be incomplete, so read the new one instead
+        if read_generation(index_dir) - generation < INDEX_KEEP_SNAPSHOTS:
+            break
+    mapped = index is not None and not migrated and os.path.exists(_index_paths(directory)[0])
+    # Files saved directly in INDEX_DIR by older versions are moved into a snapshot on the next publish
+    migrated = migrated or (not generation and index is not None)
+    chunks = ChunksData(chunks_data, embeddings, directory=directory)
+    return IndexSnapshot(index, chunks, generation, directory, migrated, mapped)
+
+def _write_index(index, index_path):
+    faiss.write_index(index, index_path + ".tmp")
+    os.replace(index_path + ".tmp", index_path)
+
+def save_global_index_and_chunks(index, chunks_data, embeddings=None, index_dir=INDEX_DIR, bm25=None):
+    index_path, chunks_path, embeddings_path, bm25_path, texts_path = _index_paths(index_dir)
+
+    os.makedirs(index_dir, exist_ok=True) # Ensure directory exists
+
+    _write_index(index, index_path)
+    TextStore.write(texts_path, chunks_data["texts"])
+    with open(chunks_path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump({key: value for key, value in chunks_data.items() if key != "texts"}, f)
+    os.replace(chunks_path + ".tmp", chunks_path)
+    if embeddings is not None:
+        with open(embeddings_path + ".tmp", "wb") as f:
+            np.save(f, np.asarray(embeddings))  # kept in its EMBEDDING_DTYPE encoding
+        os.replace(embeddings_path + ".tmp", embeddings_path)
+    if bm25 is not None:
+        bm25.save(bm25_path)
     print(f"FAISS index saved to {index_path}")
     print(f"Chunks data saved to {chunks_path}")
+
+def _remove_path(path):
+    # Best effort: on Windows, files another process still has mapped can't be deleted yet
+    try:
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        elif os.path.exists(path):
+            os.remove(path)
+    except OSError:
+        pass
+
+def _remove_old_snapshots(generation, index_dir=INDEX_DIR):
+    """
+    Deletes all but the last INDEX_KEEP_SNAPSHOTS snapshots, and index files saved outside
+    snapshots by older versions. Workers still serving a deleted snapshot keep its mapped
+    pages until they load a newer one.
+    """
+    snapshots_dir = os.path.join(index_dir, SNAPSHOTS_DIRNAME)
+    for name in os.listdir(snapshots_dir):
+        if name.isdigit() and int(name) <= generation - INDEX_KEEP_SNAPSHOTS:
+            _remove_path(os.path.join(snapshots_dir, name))
+    unversioned = _index_paths(index_dir) + _legacy_index_paths(index_dir) + (
+        os.path.join(index_dir, "bm25.npz"), os.path.join(index_dir, "generation"),
+    )
+    for path in unversioned:
+        _remove_path(path)
+
+def publish_snapshot(snapshot, index_dir=INDEX_DIR):
+    """
+    Saves `snapshot` as a new generation and makes it current. The files go to a fresh
+    snapshot directory that no reader has opened, and the CURRENT pointer is then replaced
+    in one atomic rename, so readers open either the previous version or this one, never
+    a mix. An index without chunks is saved as an empty directory. Returns the generation.
+    """
+    generation = read_generation(index_dir) + 1
+    snapshot_dir = _snapshot_dir(generation, index_dir)
+    # A writer that failed before publishing may have left a partial directory behind
+    _remove_path(snapshot_dir)
+    os.makedirs(snapshot_dir)
+    chunks = snapshot.chunks
+    if chunks.data["ids"]:
+        save_global_index_and_chunks(snapshot.index, chunks.data, chunks.embeddings, snapshot_dir, chunks.bm25_index())
+
+    current_path = os.path.join(index_dir, CURRENT_FILENAME)
+    with open(current_path + ".tmp", "w", encoding="utf-8") as f:
+        f.write(str(generation))
+    os.replace(current_path + ".tmp", current_path)
+    _remove_old_snapshots(generation, index_dir)
+    return generation
+
+def reload_global_index():
+    """Makes the published snapshot the one this process serves."""
+    global_index.set_snapshot(load_snapshot())
+
+_last_generation_check = 0.0
+_refresh_lock = threading.Lock()
+
+def refresh_global_index():
+    """
+    Picks up a snapshot published by another process, e.g. an upload handled by another
+    worker. Cheap enough to call on every query: the CURRENT pointer is read at most every
+    INDEX_CHECK_SECONDS, and data built in memory (benchmarks) is left alone. Published
+    snapshots never change, so opening one needs no lock. Returns True if a newer one was loaded.
+    """
+    global _last_generation_check
+    if global_index.snapshot.generation is None:
+        return False
+    now = time.monotonic()
+    if now - _last_generation_check < INDEX_CHECK_SECONDS:
+        return False
+    _last_generation_check = now
+    if read_generation() == global_index.snapshot.generation:
+        return False
+    if not _refresh_lock.acquire(blocking=False):
+        # Another query thread is already loading it
+        return False
+    try:
+        reload_global_index()
+    finally:
+        _refresh_lock.release()
+    return True
+
+def index_write_lock(index_dir=INDEX_DIR):
+    """Cross-process lock held by the index writer."""
+    os.makedirs(index_dir, exist_ok=True)
+    return FileLock(os.path.join(index_dir, WRITE_LOCK_FILENAME))
+
+_writer_lock = threading.Lock()
+
+@contextmanager
+def index_writer():
+    """
+    Yields the IndexWriter for one change to the index. Writers run one at a time, across
+    threads and across worker processes (and preprocess.py), and each starts from the latest
+    published snapshot, so concurrent uploads can't overwrite each other. Queries see nothing
+    until the writer publishes; a change abandoned by an exception is simply dropped.
+    """
+    with _writer_lock, index_write_lock():
+        if global_index.snapshot.generation != read_generation():
+            reload_global_index()
+        yield IndexWriter(global_index.snapshot)
+
+class IndexWriter:
+    """
+    Builds the next version of the index from the published snapshot. Changes go to a
+    private copy of the FAISS index and new chunk data, so queries keep using the published
+    snapshot until publish() swaps in the new one.
+    """
+    def __init__(self, snapshot):
+        self.base = snapshot
+        # The working version, replaced after every change
+        self.snapshot = snapshot
+        self._owns_index = False
+
+    @property
+    def chunks(self):
+        return self.snapshot.chunks
+
+    def _working_index(self):
+        """The FAISS index to change in place, copied from the published one before the first change."""
+        index = self.snapshot.index
+        if index is None or self._owns_index:
+            return index
+        if self.base.mapped:
+            # A clone would still view the mapped file and abort on the first change; read a private copy
+            index = faiss.read_index(_index_paths(self.base.directory)[0])
+        else:
+            index = faiss.clone_index(index)
+        self._owns_index = True
+        return index
+
+    def _update(self, index, chunks_data, embeddings, bm25):
+        self.snapshot = IndexSnapshot(index, ChunksData(chunks_data, embeddings, bm25))
+        self._owns_index = True
+
+    def reset(self):
+        """Empties the working index, e.g. before re-indexing with new parameters."""
+        self._update(None, {"ids": [], "texts": [], "metadata": [], "next_id": self.chunks.next_id()}, None, None)
+
+    def add_document_chunks(self, source, texts, embeddings=None, metadata=None):
+        """
+        Adds one document's chunks under fresh chunk ids.
+        Only these chunks are encoded; existing vectors are left untouched.
+        `metadata` optionally holds extra per-chunk fields such as page numbers.
+        """
+        return self.add_documents([(source, texts, embeddings, metadata)])[0]
+
+    def add_documents(self, documents):
+        """
+        Adds several documents' chunks at once, given as (source, texts, embeddings, metadata)
+        tuples like the arguments of add_document_chunks. The chunk data, stored embeddings and
+        BM25 index are copied once for the whole batch rather than once per document.
+        Returns the new chunk ids of each document.
+        """
+        chunks = self.chunks
+        data = chunks.data
+        first_id = chunks.next_id()
+        new_ids, new_texts, new_metadata, new_embeddings = [], [], [], []
+        for source, texts, embeddings, metadata in documents:
+            if embeddings is None:
+                embeddings = global_model.model.encode(texts)
+            ids = list(range(first_id + len(new_texts), first_id + len(new_texts) + len(texts)))
+            new_ids.append(ids)
+            new_texts.extend(texts)
+            new_metadata.extend({"source": source, **(meta or {})} for meta in (metadata or [None] * len(texts)))
+            new_embeddings.append(prepare_embeddings(embeddings))
+        if not new_texts:
+            return new_ids
+        all_new_ids = [chunk_id for ids in new_ids for chunk_id in ids]
+        embeddings = new_embeddings[0] if len(new_embeddings) == 1 else np.vstack(new_embeddings)
+
+        index = self._working_index()
+        if index is None:
+            index = build_faiss_index_from_embeddings(embeddings, all_new_ids)
+        else:
+            index.add_with_ids(embeddings, np.array(all_new_ids, dtype="int64"))
+
+        bm25 = chunks.bm25_index()
+        stored = chunks.embeddings
+        new_stored = to_storage(embeddings)
+        if stored is None or len(stored) == 0:
+            all_embeddings = new_stored
+        else:
+            if stored.dtype != new_stored.dtype:
+                stored = to_storage(from_storage(stored))
+            all_embeddings = np.vstack([stored, new_stored])
+
+        self._update(index, {
+            "ids": data["ids"] + all_new_ids,
+            "texts": list(data["texts"]) + new_texts,
+            "metadata": data["metadata"] + new_metadata,
+            "next_id": first_id + len(new_texts),
+        }, all_embeddings, bm25.add(all_new_ids, new_texts) if bm25 is not None else None)
+        return new_ids
+
+    def remove_document_chunks(self, source):
+        """Removes a document's vectors from the index by id, without re-encoding anything."""
+        return self.remove_documents([source])
+
+    def remove_documents(self, sources):
+        """Removes several documents' chunks at once, copying the chunk data once. Returns the number of chunks removed."""
+        chunks = self.chunks
+        sources = set(sources)
+        removed_ids = [chunks.ids_for_source(source) for source in sources]
+        removed_ids = np.concatenate(removed_ids) if removed_ids else np.empty(0, dtype="int64")
+        if len(removed_ids) == 0:
+            return 0
+
+        data = chunks.data
+        bm25 = chunks.bm25_index()
+        keep = [meta["source"] not in sources for meta in data["metadata"]]
+        stored = chunks.embeddings
+        kept_ids = [chunk_id for chunk_id, k in zip(data["ids"], keep) if k]
+        kept_embeddings = stored[np.array(keep, dtype=bool)] if stored is not None else None
+
+        index = self.snapshot.index
+        if index is not None and supports_remove(index):
+            index = self._working_index()
+            index.remove_ids(removed_ids)
+        elif index is not None:
+            index = build_faiss_index_from_embeddings(kept_embeddings, kept_ids) if kept_ids else None
+
+        self._update(index, {
+            "ids": kept_ids,
+            "texts": [text for text, k in zip(data["texts"], keep) if k],
+            "metadata": [meta for meta, k in zip(data["metadata"], keep) if k],
+            "next_id": chunks.next_id(),
+        }, kept_embeddings, bm25.remove(removed_ids) if bm25 is not None else None)
+        return len(removed_ids)
+
+    def publish(self):
+        """
+        Saves the working version as a new snapshot and makes it live: in this process right
+        away, and in other workers at their next check. Returns the new generation.
+        """
+        generation = publish_snapshot(self.snapshot)
+        reload_global_index()
+        self.base = self.snapshot = global_index.snapshot
+        self._owns_index = False
+        return generation
@@ -0,0 +1,165 @@
+import os
+import logging
+import multiprocessing
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+
+from core.config import DOCUMENTS_DIR, SENTENCE_TRANSFORMER_MODEL, MAX_CHUNK_SIZE, OVERLAP, INGEST_WORKERS, EXTRACTION_CACHE_DIR, EXTRACTION_CACHE_MAX_MB
+from core.indexing import global_model, index_writer
+from core.manifest import load_manifest, save_manifest, build_manifest, diff_documents, index_params, file_sha256
+
+from utils.file_ops import iter_document_pages, EXTRACTOR_VERSION
+from utils.chunking import iter_chunks_from_pages
+from utils.extraction_cache import ExtractionCache
+
+logger = logging.getLogger(__name__)
+
+SUPPORTED_EXTENSIONS = ["*.pdf", "*.docx", "*.txt"]
+
+extraction_cache = ExtractionCache(EXTRACTION_CACHE_DIR, EXTRACTION_CACHE_MAX_MB * 1024 * 1024, EXTRACTOR_VERSION)
+
+def find_document_files(documents_dir=DOCUMENTS_DIR):
+    documents_path = Path(documents_dir)
+    doc_files = []
+    for ext in SUPPORTED_EXTENSIONS:
+        doc_files.extend(documents_path.glob(ext))
+    return sorted(doc_files)
+
+def iter_pages_cached(file_path, file_hash=None):
+    """
+    Like iter_document_pages, but reuses pages extracted earlier from identical content.
+    Re-chunking with new settings therefore doesn't parse every PDF again.
+    """
+    if EXTRACTION_CACHE_MAX_MB <= 0:
+        return iter_document_pages(file_path)
+    if file_hash is None:
+        file_hash = file_sha256(file_path)
+    cached_pages = extraction_cache.get_pages(file_hash, extract=lambda: iter_document_pages(file_path))
+    if cached_pages is not None:
+        return cached_pages
+    return extraction_cache.cache_pages(file_hash, iter_document_pages(file_path))
+
+def extract_and_chunk(file_path, file_hash=None, max_chunk_size=MAX_CHUNK_SIZE, overlap=OVERLAP):
+    """
+    Streams a document page by page into the chunker.
+    Returns a list of (chunk, metadata) pairs, where metadata holds the pages each chunk covers.
+    """
+    pages = iter_pages_cached(file_path, file_hash)
+    return list(iter_chunks_from_pages(pages, max_chunk_size=max_chunk_size, overlap=overlap))
+
+def _extract_and_chunk(file_path, file_hash, max_chunk_size, overlap):
+    """Extracts and chunks one file, returning (chunks, error) so one bad file can't fail a whole batch."""
+    try:
+        return extract_and_chunk(file_path, file_hash, max_chunk_size, overlap), None
+    except Exception as e:
+        return [], str(e)
+
+def iter_extracted_chunks(doc_files, workers=INGEST_WORKERS, file_hashes=None):
+    """
+    Extracts and chunks documents, yielding (doc_file, chunks, error) in input order,
+    with chunks as (text, metadata) pairs.
+    `file_hashes` maps file names to already known content hashes for the extraction cache.
+    With more than one worker the CPU-bound parsing runs in a process pool, and
+    earlier files can be embedded while later ones are still being parsed.
+    """
+    workers = workers or os.cpu_count() or 1
+    file_hashes = file_hashes or {}
+    if workers == 1 or len(doc_files) <= 1:
+        for doc_file in doc_files:
+            yield (doc_file, *_extract_and_chunk(str(doc_file), file_hashes.get(doc_file.name), MAX_CHUNK_SIZE, OVERLAP))
+        return
+
+    # Spawned rather than forked: this also runs in the server's warm-up thread, after the model and
+    # executor threads exist, and a forked child could inherit a lock held by one of them
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=min(workers, len(doc_files)), mp_context=context) as executor:
+        futures = [
+            executor.submit(_extract_and_chunk, str(doc_file), file_hashes.get(doc_file.name), MAX_CHUNK_SIZE, OVERLAP)
+            for doc_file in doc_files
+        ]
+        for doc_file, future in zip(doc_files, futures):
+            try:
+                chunks, error = future.result()
+            except Exception as e:
+                # e.g. the worker process died while parsing this file
+                chunks, error = [], str(e)
+            yield doc_file, chunks, error
+
+def reconcile_index_with_documents(documents_dir=DOCUMENTS_DIR):
+    """
+    Brings the global index in line with the documents directory.
+    Documents are compared against the index manifest by size, mtime and content hash,
+    and only added, changed or removed ones are touched. Returns the names in each group, plus those that failed.
+    Runs under the index write lock, so server workers starting together reconcile one at
+    a time: the first does the work and the others load what it published.
+    """
+    with index_writer() as writer:
+        return _reconcile_index_with_documents(writer, documents_dir)
+
+def _reconcile_index_with_documents(writer, documents_dir):
+    indexed_sources = {metadata["source"] for metadata in writer.chunks.data["metadata"]}
+    manifest = load_manifest()
+    if manifest is None or manifest.get("params") != index_params() or writer.snapshot.index is None:
+        # Nothing trustworthy to diff against; every document is re-indexed
+        if writer.chunks.data["ids"]:
+            logger.info("Index parameters changed or manifest missing; re-indexing all documents.")
+        writer.reset()
+        manifest = None
+
+    doc_files = find_document_files(documents_dir)
+    added, changed, removed, documents = diff_documents(manifest, doc_files)
+    removed = sorted(set(removed) | (indexed_sources - set(documents)))
+
+    # Documents missing from the manifest may still have chunks in the index
+    stale = [name for name in removed + changed + added if len(writer.chunks.ids_for_source(name))]
+    for name in stale:
+        logger.info(f"Removed stale chunks of {name} from the index.")
+    writer.remove_documents(stale)
+
+    failed = []
+    encoded = []  # (source, texts, embeddings, metadata), added to the index in one step
+    to_process = [doc_file for doc_file in doc_files if doc_file.name in added or doc_file.name in changed]
+    file_hashes = {name: fingerprint["sha256"] for name, fingerprint in documents.items()}
+    for doc_file, chunks, error in iter_extracted_chunks(to_process, file_hashes=file_hashes):
+        logger.info(f"Processing {doc_file.name}...")
+        if error:
+            logger.error(f"Error processing {doc_file.name}: {error}")
+        elif not chunks:
+            logger.warning(f"Could not extract text from {doc_file.name}.")
+        else:
+            texts = [text for text, _ in chunks]
+            try:
+                global_model.set_model(SENTENCE_TRANSFORMER_MODEL)
+                encoded.append((doc_file.name, texts, global_model.model.encode(texts), [meta for _, meta in chunks]))
+                continue
+            except Exception as e:
+                logger.error(f"Error indexing {doc_file.name}: {e}")
+        # Leave it out of the manifest so it is retried next time
+        documents.pop(doc_file.name)
+        failed.append(doc_file.name)
+
+    try:
+        writer.add_documents(encoded)
+    except Exception as e:
+        logger.error(f"Error adding {len(encoded)} document(s) to the index: {e}")
+        for name, _, _, _ in encoded:
+            documents.pop(name)
+            failed.append(name)
+
+    # A new document that failed to index leaves the index as it was, unless it was reset above.
+    # An index converted from an older layout or type is published so the conversion is kept.
+    index_changed = bool(set(added) - set(failed) or changed or removed or (manifest is None and indexed_sources)
+                         or writer.base.migrated)
+    if index_changed:
+        if not writer.chunks.data["texts"]:
+            logger.info("No documents left to index.")
+        writer.publish()
+    if index_changed or manifest is None or manifest["documents"] != documents:
+        save_manifest(build_manifest(documents))
+
+    return {
+        "added": [name for name in added if name not in failed],
+        "changed": [name for name in changed if name not in failed],
+        "removed": removed,
+        "failed": failed,
+    }
@@ -0,0 +1,299 @@
+import os
+import re
+import json
+import time
+import uuid
+import queue
+import logging
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from core.config import (
+    MAX_CHUNK_SIZE, OVERLAP, INGESTION_JOB_WORKERS, INGESTION_MAX_PENDING_JOBS, INGESTION_PUBLISH_MAX_WAIT_SECONDS,
+    INGESTION_JOB_RETENTION_SECONDS, INGESTION_JOBS_DIR,
+)
+from core.indexing import global_model, index_writer
+from core.ingestion import extract_and_chunk
+from core.manifest import update_manifest_document
+from utils.metrics import stage, INGESTED_CHUNKS, INGESTION_JOBS, INGESTION_JOBS_PENDING, INGESTION_JOBS_PER_PUBLISH
+
+logger = logging.getLogger(__name__)
+
+# A job moves through "queued", "extracting", "embedding" and "publishing", then ends in one of these
+FINISHED_STATUSES = ("succeeded", "failed")
+
+_JOB_ID = re.compile(r"[0-9a-f]{32}")
+
+class IngestionJob:
+    """One uploaded document on its way into the index."""
+    def __init__(self, filename, path):
+        self.id = uuid.uuid4().hex
+        self.seq = None  # submission order, set by the queue
+        self.filename = filename
+        self.path = path
+        self.status = "queued"
+        self.error = None
+        self.chunks = None
+        self.generation = None
+        self.created_at = self.updated_at = time.time()
+        # Filled in by the job's stages and dropped once it is published
+        self.texts = self.metadata = self.embeddings = None
+
+    def to_dict(self):
+        return {
+            "job_id": self.id,
+            "filename": self.filename,
+            "status": self.status,
+            "error": self.error,
+            "chunks": self.chunks,
+            "generation": self.generation,
+            "created_at": self.created_at,
+            "updated_at": self.updated_at,
+        }
+
+def _job_path(job_id, jobs_dir=INGESTION_JOBS_DIR):
+    return os.path.join(jobs_dir, f"{job_id}.json")
+
+def save_job(job, jobs_dir=INGESTION_JOBS_DIR):
+    """Records a job's status in the jobs directory, where every server worker can read it."""
+    os.makedirs(jobs_dir, exist_ok=True)
+    path = _job_path(job.id, jobs_dir)
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(job.to_dict(), f)
+    os.replace(path + ".tmp", path)
+
+def load_job(job_id, jobs_dir=INGESTION_JOBS_DIR):
+    """The status of a job as a dict, or None for an unknown or expired job id."""
+    if not _JOB_ID.fullmatch(job_id):
+        return None
+    try:
+        with open(_job_path(job_id, jobs_dir), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+def list_jobs(limit=50, jobs_dir=INGESTION_JOBS_DIR):
+    """The most recent jobs, newest first."""
+    try:
+        names = os.listdir(jobs_dir)
+    except FileNotFoundError:
+        return []
+    jobs = [load_job(name[:-len(".json")], jobs_dir) for name in names if name.endswith(".json")]
+    jobs = sorted((job for job in jobs if job is not None), key=lambda job: job["created_at"], reverse=True)
+    return jobs[:limit]
+
+def prune_jobs(max_age_seconds=INGESTION_JOB_RETENTION_SECONDS, jobs_dir=INGESTION_JOBS_DIR):
+    """Forgets finished jobs last updated more than `max_age_seconds` ago."""
+    cutoff = time.time() - max_age_seconds
+    for job in list_jobs(limit=None, jobs_dir=jobs_dir):
+        if job["status"] in FINISHED_STATUSES and job["updated_at"] < cutoff:
+            try:
+                os.remove(_job_path(job["job_id"], jobs_dir))
+            except OSError:
+                pass
+
+class IngestionQueue:
+    """
+    Processes uploaded documents in the background. Up to `workers` jobs are extracted,
+    chunked and embedded at once, with extraction and chunking in worker processes so they
+    don't hold up query threads. Embedded jobs are handed to a single publisher, which waits up
+    to `publish_max_wait` seconds for the other jobs in progress and then applies them all
+    in one index writer, so a burst of uploads is published as one new index version.
+    Queries keep using the current index until then.
+    """
+    def __init__(self, workers=INGESTION_JOB_WORKERS, max_pending=INGESTION_MAX_PENDING_JOBS,
+                 publish_max_wait=INGESTION_PUBLISH_MAX_WAIT_SECONDS):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.publish_max_wait = publish_max_wait
+        self._queue = queue.Queue()
+        self._ready = []  # embedded jobs waiting to be published
+        self._unfinished = {}  # seq -> filename of jobs submitted and not yet embedded or failed
+        self._next_seq = 0
+        self._condition = threading.Condition()
+        self._threads = []
+        self._thread_lock = threading.Lock()
+        self._pool = None
+        self._pool_lock = threading.Lock()
+
+    def full(self):
+        """True when MAX_PENDING_JOBS jobs are waiting or in progress; uploads should be refused."""
+        with self._condition:
+            return len(self._unfinished) + len(self._ready) >= self.max_pending
+
+    def submit(self, filename, path):
+        """Queues the document saved at `path` and returns its job, which is recorded as queued."""
+        self._ensure_threads()
+        job = IngestionJob(filename, path)
+        save_job(job)
+        with self._condition:
+            job.seq, self._next_seq = self._next_seq, self._next_seq + 1
+            self._unfinished[job.seq] = filename
+            self._update_pending_gauge()
+        self._queue.put(job)
+        return job
+
+    def shutdown(self):
+        """Stops the extraction processes; queued jobs are dropped and picked up by the next reconcile."""
+        with self._pool_lock:
+            if self._pool is not None:
+                self._pool.shutdown(wait=False, cancel_futures=True)
+                self._pool = None
+
+    def _ensure_threads(self):
+        if self._threads:
+            return
+        with self._thread_lock:
+            if not self._threads:
+                threads = [threading.Thread(target=self._run_publisher, name="ingestion-publisher", daemon=True)]
+                threads += [
+                    threading.Thread(target=self._run_worker, name=f"ingestion-{i}", daemon=True) for i in range(self.workers)
+                ]
+                for thread in threads:
+                    thread.start()
+                self._threads = threads
+
+    def _update_pending_gauge(self):
+        INGESTION_JOBS_PENDING.set(len(self._unfinished) + len(self._ready))
+
+    def _set_status(self, job, status):
+        job.status, job.updated_at = status, time.time()
+        save_job(job)
+
+    def _finish(self, job, error=None):
+        job.status = "failed" if error else "succeeded"
+        job.error = str(error) if error else None
+        job.updated_at = time.time()
+        job.texts = job.metadata = job.embeddings = None
+        save_job(job)
+        INGESTION_JOBS.labels(job.status).inc()
+
+    def _extract_chunks(self, job):
+        with self._pool_lock:
+            if self._pool is None:
+                # Spawned rather than forked: the server's threads and model must not be copied mid-use
+                self._pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"))
+            pool = self._pool
+        try:
+            # Pages stream into the chunker inside the worker process; only the chunks come back
+            return pool.submit(extract_and_chunk, job.path, None, MAX_CHUNK_SIZE, OVERLAP).result()
+        except BrokenProcessPool:
+            # e.g. a parser crashed its process; start a fresh pool for the next job
+            with self._pool_lock:
+                if self._pool is pool:
+                    self._pool = None
+            raise
+
+    def _run_worker(self):
+        while True:
+            job = self._queue.get()
+            try:
+                self._process(job)
+            except Exception as e:
+                logger.error(f"Upload job {job.id} ({job.filename}) failed: {e}")
+                self._finish(job, e)
+                with self._condition:
+                    del self._unfinished[job.seq]
+                    self._update_pending_gauge()
+                    self._condition.notify_all()
+            else:
+                with self._condition:
+                    del self._unfinished[job.seq]
+                    self._ready.append(job)
+                    self._update_pending_gauge()
+                    self._condition.notify_all()
+
+    def _process(self, job):
+        self._set_status(job, "extracting")
+        with stage("extract"):
+            chunks = self._extract_chunks(job)
+        if not chunks:
+            raise ValueError("Could not extract text from document.")
+
+        self._set_status(job, "embedding")
+        job.texts = [text for text, _ in chunks]
+        job.metadata = [meta for _, meta in chunks]
+        with stage("embed"):
+            job.embeddings = global_model.model.encode(job.texts)
+        # Waits for the publisher from here on
+        self._set_status(job, "publishing")
+
+    def _publishable(self):
+        """
+        Ready jobs that can be published, in submission order. A job waits while an earlier
+        job for the same file is still in progress, so a re-upload can't be overwritten by
+        the upload it replaces.
+        """
+        earliest = {}
+        for seq, filename in self._unfinished.items():
+            earliest[filename] = min(seq, earliest.get(filename, seq))
+        return sorted(
+            (job for job in self._ready if earliest.get(job.filename, job.seq) >= job.seq), key=lambda job: job.seq)
+
+    def _run_publisher(self):
+        while True:
+            with self._condition:
+                while not self._publishable():
+                    self._condition.wait()
+                deadline = time.monotonic() + self.publish_max_wait
+                while self._unfinished:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._condition.wait(remaining)
+                batch = self._publishable()
+                self._ready = [job for job in self._ready if job not in batch]
+            self._publish(batch)
+            with self._condition:
+                self._update_pending_gauge()
+            prune_jobs()
+
+    def _publish(self, batch):
+        """
+        Applies the embedded jobs in one step and publishes them as one index version. Of several
+        uploads of the same file, the last one submitted wins. Jobs whose document was deleted
+        meanwhile are skipped; the delete removes its chunks.
+        """
+        INGESTION_JOBS_PER_PUBLISH.observe(len(batch))
+        try:
+            with index_writer() as writer:
+                latest, superseded = {}, []
+                with stage("index_update"):
+                    for job in batch:
+                        if not os.path.exists(job.path):
+                            self._finish(job, "The document was deleted before it was published.")
+                            continue
+                        # A later upload of the same file in this batch replaces it
+                        if job.filename in latest:
+                            superseded.append(latest[job.filename])
+                        latest[job.filename] = job
+                    applied = list(latest.values())
+                    if not applied:
+                        return
+                    # Re-uploading a file replaces its previous chunks
+                    writer.remove_documents([job.filename for job in applied])
+                    writer.add_documents([(job.filename, job.texts, job.embeddings, job.metadata) for job in applied])
+                with stage("index_save"):
+                    generation = writer.publish()
+                    for job in superseded:
+                        job.generation = generation
+                        self._finish(job)
+                    for job in applied:
+                        try:
+                            update_manifest_document(job.filename, job.path)
+                        except OSError as e:
+                            # Deleted since it was applied; the delete removes its chunks once it gets the lock
+                            self._finish(job, f"The document was deleted while it was published: {e}")
+                            continue
+                        INGESTED_CHUNKS.inc(len(job.texts))
+                        job.chunks, job.generation = len(job.texts), generation
+                        self._finish(job)
+        except Exception as e:
+            logger.error(f"Publishing {len(batch)} upload job(s) failed: {e}")
+            for job in batch:
+                if job.status not in FINISHED_STATUSES:
+                    self._finish(job, e)
+
+ingestion_queue = IngestionQueue()
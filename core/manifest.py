@@ -0,0 +1,111 @@
+import os
+import json
+import hashlib
+
+from core.config import (
+    INDEX_DIR, SENTENCE_TRANSFORMER_MODEL, ENCODER_BACKEND, ENCODER_ONNX_QUANTIZATION, MAX_CHUNK_SIZE, OVERLAP,
+    EMBEDDING_DTYPE, NORMALIZE_EMBEDDINGS,
+)
+from utils.chunking import CHUNKER_VERSION
+
+MANIFEST_FILENAME = "manifest.json"
+
+def index_params():
+    """The settings that shape chunks and vectors; if any of them change, every document is stale."""
+    return {
+        "model": SENTENCE_TRANSFORMER_MODEL,
+        "encoder_backend": ENCODER_BACKEND,
+        # Only the int8 ONNX export depends on it
+        "encoder_onnx_quantization": ENCODER_ONNX_QUANTIZATION if ENCODER_BACKEND == "onnx_int8" else None,
+        "max_chunk_size": MAX_CHUNK_SIZE,
+        "overlap": OVERLAP,
+        "chunker_version": CHUNKER_VERSION,
+        "embedding_dtype": EMBEDDING_DTYPE,
+        "normalize_embeddings": NORMALIZE_EMBEDDINGS,
+    }
+
+def file_sha256(path, block_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def load_manifest(index_dir=INDEX_DIR):
+    """Returns the manifest written with the last saved index, or None if there isn't one."""
+    manifest_path = os.path.join(index_dir, MANIFEST_FILENAME)
+    if not os.path.exists(manifest_path):
+        return None
+    try:
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"Error loading index manifest: {e}")
+        return None
+
+def save_manifest(manifest, index_dir=INDEX_DIR):
+    manifest_path = os.path.join(index_dir, MANIFEST_FILENAME)
+    os.makedirs(index_dir, exist_ok=True)
+    with open(manifest_path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(manifest_path + ".tmp", manifest_path)
+
+def fingerprint(path, previous=None):
+    """
+    Records size, mtime and content hash for `path`.
+    The hash is only recomputed when size or mtime differ from `previous`.
+    """
+    stat = os.stat(path)
+    if previous and previous.get("size") == stat.st_size and previous.get("mtime") == stat.st_mtime:
+        return dict(previous)
+    return {"size": stat.st_size, "mtime": stat.st_mtime, "sha256": file_sha256(path)}
+
+def diff_documents(manifest, doc_files):
+    """
+    Compares the documents on disk against the manifest.
+    Returns (added, changed, removed, documents): lists of file names plus the
+    fingerprints to record for every file currently on disk. A file whose mtime
+    moved but whose content hash did not is treated as unchanged.
+    """
+    previous_documents = manifest["documents"] if manifest and manifest.get("params") == index_params() else {}
+    added, changed = [], []
+    documents = {}
+    for doc_file in doc_files:
+        previous = previous_documents.get(doc_file.name)
+        current = fingerprint(doc_file, previous)
+        documents[doc_file.name] = current
+        if previous is None:
+            added.append(doc_file.name)
+        elif previous["sha256"] != current["sha256"]:
+            changed.append(doc_file.name)
+    removed = [name for name in previous_documents if name not in documents]
+    return added, changed, removed, documents
+
+def build_manifest(documents):
+    return {"params": index_params(), "documents": documents}
+
+def update_manifest_document(name, path=None, index_dir=INDEX_DIR):
+    """Records (or, with no `path`, forgets) a single document after an upload or delete."""
+    manifest = load_manifest(index_dir)
+    if manifest is None or manifest.get("params") != index_params():
+        manifest = build_manifest({})
+    if path is None:
+        manifest["documents"].pop(name, None)
+    else:
+        manifest["documents"][name] = fingerprint(path)
+    save_manifest(manifest, index_dir)
+
+_cached_manifest = (None, None)  # (manifest mtime, manifest)
+
+def document_sha256(name, index_dir=INDEX_DIR):
+    """Content hash of an indexed document, read from the manifest and cached until it changes."""
+    global _cached_manifest
+    try:
+        mtime = os.stat(os.path.join(index_dir, MANIFEST_FILENAME)).st_mtime_ns
+    except FileNotFoundError:
+        return None
+    if _cached_manifest[0] != mtime:
+        _cached_manifest = (mtime, load_manifest(index_dir))
+    manifest = _cached_manifest[1]
+    entry = manifest["documents"].get(name) if manifest else None
+    return entry["sha256"] if entry else None
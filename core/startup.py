@@ -0,0 +1,74 @@
+import time
+import logging
+import threading
+
+from core.config import SENTENCE_TRANSFORMER_MODEL
+from core.indexing import global_model, global_index
+from core.ingestion import reconcile_index_with_documents
+from utils.llm_client import client
+from utils.metrics import stage, READY
+
+logger = logging.getLogger(__name__)
+
+class StartupState:
+    """Progress of the background warm-up, as reported by the readiness probe."""
+    def __init__(self):
+        self.status = "starting"  # then "ready" or "failed"
+        self.error = None
+        self.started_at = time.time()
+        self.ready_at = None
+        self._lock = threading.Lock()
+
+    @property
+    def ready(self):
+        return self.status == "ready"
+
+    def set_ready(self):
+        with self._lock:
+            self.status, self.ready_at = "ready", time.time()
+        READY.set(1)
+
+    def set_failed(self, error):
+        with self._lock:
+            self.status, self.error = "failed", str(error)
+        READY.set(0)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "status": self.status,
+                "error": self.error,
+                "seconds_to_ready": self.ready_at - self.started_at if self.ready_at else None,
+            }
+
+startup_state = StartupState()
+
+def warm_up():
+    """
+    Loads the embedding model and brings the index in line with the documents directory,
+    then touches everything the first query would otherwise load lazily. Runs once, off the
+    event loop, so the server accepts connections (and answers probes) while it works.
+    """
+    try:
+        with stage("warm_up"):
+            print("Loading SentenceTransformer model...")
+            global_model.set_model(SENTENCE_TRANSFORMER_MODEL)
+
+            print("Loading global FAISS index and reconciling it with the documents directory...")
+            # Only documents added, changed or removed since the last saved manifest are processed
+            changes = reconcile_index_with_documents()
+            if changes["added"] or changes["changed"] or changes["removed"]:
+                print(f"Index updated: {len(changes['added'])} added, {len(changes['changed'])} changed, {len(changes['removed'])} removed.")
+            elif global_index.snapshot.index is None:
+                print("No existing index or documents found. Starting fresh.")
+
+            # Built or loaded on first use otherwise: the BM25 index, the model's first forward pass and the LLM SDK
+            global_index.snapshot.chunks.bm25_index()
+            global_model.model.encode(["warm-up"])
+            _ = client.backend
+    except Exception as e:
+        logger.exception("Startup warm-up failed.")
+        startup_state.set_failed(e)
+        return
+    startup_state.set_ready()
+    print("Ready to serve queries.")
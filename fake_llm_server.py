@@ -0,0 +1,58 @@
+import random
+import asyncio
+import argparse
+from typing import Optional
+
+from fastapi import FastAPI, HTTPException
+from pydantic import BaseModel
+
+from utils.stub_llm import StubLLMClient
+
+class GenerateRequest(BaseModel):
+    prompt: str
+    generation_config: Optional[dict] = None
+
+def create_app(latency_ms=300, jitter_ms=100, slow_rate=0.0, slow_ms=5000, error_rate=0.0, stall_rate=0.0, seed=None):
+    """
+    A local stand-in for the LLM API, for exercising timeouts, retries and hedging.
+    POST /generate answers {"prompt": ...} with the stub's deterministic decision after
+    `latency_ms` ± `jitter_ms`. A `slow_rate` share of requests take `slow_ms` instead,
+    an `error_rate` share fail with 503 and a `stall_rate` share never answer.
+    """
+    app = FastAPI()
+    rng = random.Random(seed)
+    stub = StubLLMClient()
+
+    @app.post("/generate")
+    async def generate(request: GenerateRequest):
+        roll = rng.random()
+        if roll < stall_rate:
+            await asyncio.sleep(3600)
+        if roll < stall_rate + error_rate:
+            raise HTTPException(status_code=503, detail="Injected upstream error.")
+        if roll < stall_rate + error_rate + slow_rate:
+            delay = slow_ms
+        else:
+            delay = max(latency_ms + rng.uniform(-jitter_ms, jitter_ms), 0)
+        await asyncio.sleep(delay / 1000)
+        return {"text": stub.generate_content(request.prompt).text}
+
+    return app
+
+if __name__ == "__main__":
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Fake LLM server with injectable latency and errors. Use it with [LLM] BACKEND = http.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8010)
+    parser.add_argument("--latency-ms", type=float, default=300)
+    parser.add_argument("--jitter-ms", type=float, default=100)
+    parser.add_argument("--slow-rate", type=float, default=0.0, help="Share of requests that take --slow-ms.")
+    parser.add_argument("--slow-ms", type=float, default=5000)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of requests that fail with 503.")
+    parser.add_argument("--stall-rate", type=float, default=0.0, help="Share of requests that never answer.")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    app = create_app(args.latency_ms, args.jitter_ms, args.slow_rate, args.slow_ms, args.error_rate, args.stall_rate, args.seed)
+    uvicorn.run(app, host=args.host, port=args.port)
@@ -309,8 +309,21 @@ export default function JurisAIApp() {
         throw new Error(errorData.detail || 'Failed to upload document.');
       }
 
+      // The document is indexed in the background; wait for its job to finish
       const data = await response.json();
-      alert(data.message);
+      let job = data;
+      while (job.status !== 'succeeded' && job.status !== 'failed') {
+        await new Promise(resolve => setTimeout(resolve, 1000));
+        const jobResponse = await fetch(`http://localhost:8000/jobs/${data.job_id}`);
+        if (!jobResponse.ok) {
+          throw new Error('Failed to check the upload status.');
+        }
+        job = await jobResponse.json();
+      }
+      if (job.status === 'failed') {
+        throw new Error(job.error || 'Failed to process document.');
+      }
+      alert(`Document ${job.filename} uploaded and processed successfully.`);
 
       // Refresh document list
       const res = await fetch('http://localhost:8000/documents', {
@@ -1,5 +1,9 @@
+from typing import List
 from pydantic import BaseModel
 
 class QueryRequest(BaseModel):
     policy_filename: str
     user_query: str
+
+class BatchQueryRequest(BaseModel):
+    items: List[QueryRequest]
@@ -1,5 +1,5 @@
 import json
-from utils.decision_engine import get_decision_for_document_and_query
+from utils.decision_engine import get_decision_for_document_and_query, decision_cache
 
 policy_filename = "EDLHLGA23009V012223.pdf"
 user_query = "28F, 2nd trimester pregnancy, Mumbai, pre-hospitalization maternity cover, 6-month policy"
@@ -10,6 +10,7 @@ print(f"Running query '{user_query}' for document '{policy_filename}' {num_runs}
 
 for i in range(num_runs):
     print(f"Run {i+1}/{num_runs}...")
+    decision_cache.clear()  # measure the model, not the decision cache
     decision_output = get_decision_for_document_and_query(policy_filename, user_query)
     results.append(decision_output.get("decision")) # Only store the 'decision' field
 
@@ -0,0 +1,66 @@
+import os
+
+import faiss
+import numpy as np
+import pytest
+
+from core.indexing import (
+    ChunksData, IndexSnapshot, IndexWriter, _index_paths, _read_index_mmap, load_snapshot, publish_snapshot,
+)
+from utils.semantic_search import build_faiss_index_from_embeddings, index_settings
+
+def _mapped_files():
+    with open("/proc/self/maps", "r", encoding="utf-8") as f:
+        return {line.split(maxsplit=5)[5].strip() for line in f if len(line.split(maxsplit=5)) == 6}
+
+def _vectors(count=2000, dim=64, seed=0):
+    return np.random.default_rng(seed).random((count, dim), dtype="float32")
+
+@pytest.mark.skipif(not os.path.exists("/proc/self/maps"), reason="needs /proc to list mapped files")
+@pytest.mark.parametrize("index_type,dtype", [("flat", "float32"), ("flat", "int8"), ("hnsw", "float32"), ("ivf_flat", "float32")])
+def test_read_index_mmap_maps_the_file(tmp_path, index_type, dtype):
+    vectors = _vectors()
+    index = build_faiss_index_from_embeddings(vectors, list(range(len(vectors))), settings=index_settings(type=index_type, dtype=dtype))
+    index_path = str(tmp_path / "index.faiss")
+    faiss.write_index(index, index_path)
+
+    mapped = _read_index_mmap(index_path)
+
+    assert os.path.realpath(index_path) in _mapped_files()
+    assert mapped.ntotal == len(vectors)
+    _, ids = mapped.search(vectors[:3], 1)
+    assert ids[:, 0].tolist() == [0, 1, 2]
+
+def test_writer_changes_a_private_copy_of_a_mapped_snapshot(tmp_path):
+    vectors = _vectors(count=100)
+    ids = list(range(len(vectors)))
+    chunks_data = {
+        "ids": ids, "texts": [f"chunk {i}" for i in ids], "metadata": [{"source": "a.txt"} for _ in ids], "next_id": len(ids),
+    }
+    index = build_faiss_index_from_embeddings(vectors, ids)
+    publish_snapshot(IndexSnapshot(index, ChunksData(chunks_data, vectors)), str(tmp_path))
+    snapshot = load_snapshot(str(tmp_path))
+    assert snapshot.mapped
+    assert os.path.exists(_index_paths(snapshot.directory)[0])
+
+    writer = IndexWriter(snapshot)
+    writer.add_document_chunks("b.txt", ["new chunk"], _vectors(count=1, seed=1))
+    writer.remove_document_chunks("a.txt")
+
+    assert writer.snapshot.index.ntotal == 1
+    assert snapshot.index.ntotal == len(vectors)
+
+def test_writer_adds_and_removes_documents_in_one_batch():
+    writer = IndexWriter(IndexSnapshot(None, ChunksData()))
+    first, second = writer.add_documents([
+        ("a.txt", ["a one", "a two"], _vectors(count=2, seed=1), None),
+        ("b.txt", ["b one"], _vectors(count=1, seed=2), [{"page_start": 3}]),
+    ])
+
+    assert first == [0, 1] and second == [2]
+    assert writer.snapshot.index.ntotal == 3
+    assert writer.chunks.texts_for_ids(writer.chunks.ids_for_source("a.txt")) == ["a one", "a two"]
+    assert writer.chunks.metadata_for_ids(second) == [{"source": "b.txt", "page_start": 3}]
+
+    assert writer.remove_documents(["a.txt", "b.txt"]) == 3
+    assert writer.snapshot.index.ntotal == 0
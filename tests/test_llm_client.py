@@ -0,0 +1,77 @@
+import time
+import asyncio
+
+import pytest
+
+from utils.llm_client import ResilientLLMClient, LLMError, LLMDeadlineExceeded
+from utils.stub_llm import StubLLMClient
+
+class UpstreamError(Exception):
+    """Carries an HTTP status in `code`, like google.api_core errors."""
+    def __init__(self, code):
+        super().__init__(f"upstream answered {code}")
+        self.code = code
+
+def _client(stub, **kwargs):
+    settings = dict(deadline=5.0, attempt_timeout=5.0, max_retries=2, backoff_base=0.01, backoff_max=0.05,
+                    hedging=False, hedge_delay=0.05, hedge_min_delay=0.01)
+    settings.update(kwargs)
+    return ResilientLLMClient(stub, **settings)
+
+def _generate(client, mode):
+    if mode == "sync":
+        return client.generate_content("prompt").text
+    return asyncio.run(client.generate_content_async("prompt")).text
+
+def _stream(client):
+    async def collect():
+        stream = await client.generate_content_async("prompt", stream=True)
+        return "".join([chunk.text async for chunk in stream])
+    return asyncio.run(collect())
+
+@pytest.mark.parametrize("mode", ["sync", "async"])
+def test_retryable_error_is_retried(mode):
+    stub = StubLLMClient(faults=[UpstreamError(503)])
+
+    assert _generate(_client(stub), mode) == StubLLMClient().generate_content("prompt").text
+    assert stub.calls == 2
+
+@pytest.mark.parametrize("mode", ["sync", "async"])
+def test_non_retryable_error_is_raised_at_once(mode):
+    stub = StubLLMClient(faults=[UpstreamError(400)])
+
+    with pytest.raises(LLMError, match="after 1 attempt"):
+        _generate(_client(stub), mode)
+    assert stub.calls == 1
+
+@pytest.mark.parametrize("mode", ["sync", "async"])
+def test_slow_primary_is_hedged_and_first_answer_wins(mode):
+    stub = StubLLMClient(faults=[2.0])
+
+    started = time.monotonic()
+    text = _generate(_client(stub, hedging=True), mode)
+
+    assert text == StubLLMClient().generate_content("prompt").text
+    assert stub.calls == 2
+    assert time.monotonic() - started < 1.0
+
+@pytest.mark.parametrize("mode", ["sync", "async"])
+def test_deadline_cuts_off_a_stalled_call(mode):
+    stub = StubLLMClient(faults=[5.0])
+
+    started = time.monotonic()
+    with pytest.raises(LLMDeadlineExceeded):
+        _generate(_client(stub, deadline=0.3), mode)
+    assert time.monotonic() - started < 1.0
+
+def test_stream_is_read_to_the_end():
+    assert _stream(_client(StubLLMClient())) == StubLLMClient().generate_content("prompt").text
+
+def test_deadline_cuts_off_a_stalled_stream():
+    # Spread over its pieces, the stub's latency makes each piece slower than the whole deadline
+    stub = StubLLMClient(latency=30.0)
+
+    started = time.monotonic()
+    with pytest.raises(LLMDeadlineExceeded):
+        _stream(_client(stub, deadline=0.3))
+    assert time.monotonic() - started < 1.0
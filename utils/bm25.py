@@ -0,0 +1,153 @@
+import os
+import re
+from collections import Counter
+
+import numpy as np
+
+from utils.text_store import TextStore
+
+# Bump when tokenize() changes; saved indexes from another version are rebuilt from the chunk texts
+TOKENIZER_VERSION = 1
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+STOPWORDS = frozenset(
+    "a an and any are as at be been by for from has have if in into is it its not of on or such that the their "
+    "then there these this to under was were which will with".split()
+)
+MAX_TF = np.iinfo(np.uint16).max
+
+def tokenize(text):
+    """Lower-cased alphanumeric terms without stopwords; "pre-existing" becomes "pre", "existing"."""
+    return [token for token in TOKEN_PATTERN.findall(text.lower()) if token not in STOPWORDS]
+
+class BM25Index:
+    """
+    Okapi BM25 over chunk texts, with postings held in flat arrays: the chunks containing
+    term t are postings[offsets[t]:offsets[t + 1]], with their term counts at the same
+    positions in tfs. Instances are never modified; add and remove return a new index,
+    so a search running alongside an upload sees either the old postings or the new ones.
+    """
+    def __init__(self, terms=(), offsets=None, postings=None, tfs=None, doc_ids=None, doc_lengths=None):
+        self.terms = list(terms)
+        self.term_ids = {term: term_id for term_id, term in enumerate(self.terms)}
+        self.offsets = np.zeros(len(self.terms) + 1, dtype=np.int64) if offsets is None else offsets
+        self.postings = np.empty(0, dtype=np.int32) if postings is None else postings
+        self.tfs = np.empty(0, dtype=np.uint16) if tfs is None else tfs
+        # Sorted, so a chunk's length is found with searchsorted
+        self.doc_ids = np.empty(0, dtype=np.int32) if doc_ids is None else doc_ids
+        self.doc_lengths = np.empty(0, dtype=np.int32) if doc_lengths is None else doc_lengths
+        self.avg_length = float(self.doc_lengths.mean()) if len(self.doc_lengths) else 0.0
+
+    def __len__(self):
+        return len(self.doc_ids)
+
+    def matches(self, chunk_ids):
+        """Whether this index covers exactly `chunk_ids`."""
+        return np.array_equal(self.doc_ids, np.sort(np.asarray(chunk_ids, dtype=np.int64)))
+
+    def _term_column(self):
+        # The term id of every posting, i.e. the postings expanded back to (term, chunk) pairs
+        return np.repeat(np.arange(len(self.terms), dtype=np.int64), np.diff(self.offsets))
+
+    def _with_postings(self, terms, term_column, postings, tfs, doc_ids, doc_lengths):
+        order = np.argsort(term_column, kind="stable")
+        offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(term_column, minlength=len(terms)), out=offsets[1:])
+        doc_order = np.argsort(doc_ids, kind="stable")
+        return BM25Index(terms, offsets, postings[order], tfs[order], doc_ids[doc_order], doc_lengths[doc_order])
+
+    def add(self, chunk_ids, texts):
+        """Returns a new index that also covers `texts`, keyed by `chunk_ids`."""
+        terms = list(self.terms)
+        term_ids = dict(self.term_ids)
+        new_terms, new_postings, new_tfs, new_lengths = [], [], [], []
+        for chunk_id, text in zip(chunk_ids, texts):
+            tokens = tokenize(text)
+            new_lengths.append(len(tokens))
+            for term, count in Counter(tokens).items():
+                term_id = term_ids.get(term)
+                if term_id is None:
+                    term_id = term_ids[term] = len(terms)
+                    terms.append(term)
+                new_terms.append(term_id)
+                new_postings.append(chunk_id)
+                new_tfs.append(min(count, MAX_TF))
+
+        return self._with_postings(
+            terms,
+            np.concatenate([self._term_column(), np.array(new_terms, dtype=np.int64)]),
+            np.concatenate([self.postings, np.array(new_postings, dtype=np.int32)]),
+            np.concatenate([self.tfs, np.array(new_tfs, dtype=np.uint16)]),
+            np.concatenate([self.doc_ids, np.array(list(chunk_ids), dtype=np.int32)]),
+            np.concatenate([self.doc_lengths, np.array(new_lengths, dtype=np.int32)]),
+        )
+
+    def remove(self, chunk_ids):
+        """Returns a new index without `chunk_ids`. Nothing is re-tokenized."""
+        removed = np.asarray(chunk_ids, dtype=np.int32)
+        keep = ~np.isin(self.postings, removed)
+        keep_docs = ~np.isin(self.doc_ids, removed)
+        return self._with_postings(
+            self.terms, self._term_column()[keep], self.postings[keep], self.tfs[keep],
+            self.doc_ids[keep_docs], self.doc_lengths[keep_docs],
+        )
+
+    def search(self, query, candidate_ids=None, k=20, k1=1.2, b=0.75):
+        """Returns up to `k` chunk ids ranked by BM25 score, optionally restricted to `candidate_ids`."""
+        term_ids = {self.term_ids[term] for term in tokenize(query) if term in self.term_ids}
+        if not term_ids or not len(self.doc_ids):
+            return []
+        num_docs = len(self.doc_ids)
+        matched_ids, matched_scores = [], []
+        for term_id in term_ids:
+            start, end = self.offsets[term_id], self.offsets[term_id + 1]
+            if start == end:
+                continue
+            ids = self.postings[start:end]
+            tfs = self.tfs[start:end].astype(np.float32)
+            if candidate_ids is not None:
+                in_candidates = np.isin(ids, candidate_ids)
+                ids, tfs = ids[in_candidates], tfs[in_candidates]
+            # Document frequency and average length are corpus-wide, so scores agree across policies
+            idf = np.log(1 + (num_docs - (end - start) + 0.5) / ((end - start) + 0.5))
+            lengths = self.doc_lengths[np.searchsorted(self.doc_ids, ids)]
+            matched_ids.append(ids)
+            matched_scores.append(idf * tfs * (k1 + 1) / (tfs + k1 * (1 - b + b * lengths / self.avg_length)))
+
+        ids = np.concatenate(matched_ids) if matched_ids else np.empty(0, dtype=np.int32)
+        if not len(ids):
+            return []
+        unique_ids, positions = np.unique(ids, return_inverse=True)
+        scores = np.bincount(positions, weights=np.concatenate(matched_scores))
+        top = np.argsort(-scores, kind="stable")[:k]
+        return [int(unique_ids[i]) for i in top]
+
+    def save(self, path):
+        """
+        Writes the index as a directory of .npy files, which load() memory-maps so that
+        processes serving the same index share the postings. Files are replaced, not rewritten.
+        """
+        os.makedirs(path, exist_ok=True)
+        arrays = {
+            "offsets": self.offsets, "postings": self.postings, "tfs": self.tfs,
+            "doc_ids": self.doc_ids, "doc_lengths": self.doc_lengths,
+            "version": np.array(TOKENIZER_VERSION),
+        }
+        TextStore.write(os.path.join(path, "terms.bin"), self.terms)
+        for name, array in arrays.items():
+            with open(os.path.join(path, name + ".npy.tmp"), "wb") as f:
+                np.save(f, np.asarray(array))
+            os.replace(os.path.join(path, name + ".npy.tmp"), os.path.join(path, name + ".npy"))
+
+    @classmethod
+    def load(cls, path):
+        """Maps an index written by save(), or returns None if it is missing or from another tokenizer version."""
+        if not os.path.exists(os.path.join(path, "version.npy")):
+            return None
+        if int(np.load(os.path.join(path, "version.npy"))) != TOKENIZER_VERSION:
+            return None
+        arrays = {
+            name: np.load(os.path.join(path, name + ".npy"), mmap_mode="r")
+            for name in ("offsets", "postings", "tfs", "doc_ids", "doc_lengths")
+        }
+        return cls(TextStore(os.path.join(path, "terms.bin")), **arrays)
@@ -1,33 +1,111 @@
-import re
+from bisect import bisect_right
+
+# Bump whenever chunk boundaries change, so existing indexes are rebuilt
+CHUNKER_VERSION = 3
+
+# Tried in order: a piece that is still too long is split again at the next separator
+SEPARATORS = ["\n\n", "\n", ". ", "? ", "! ", " "]
+
+def _split_spans(text, start, end, max_size, level=0):
+    """
+    Yields contiguous (start, end) pieces covering text[start:end], each at most `max_size` long.
+    Pieces are cut after the coarsest separator that applies; text with no separator left is cut hard.
+    """
+    if end - start <= max_size:
+        yield start, end
+        return
+    if level == len(SEPARATORS):
+        for piece_start in range(start, end, max_size):
+            yield piece_start, min(piece_start + max_size, end)
+        return
+
+    separator = SEPARATORS[level]
+    pos = start
+    while pos < end:
+        found = text.find(separator, pos, end)
+        piece_end = end if found == -1 else found + len(separator)
+        yield from _split_spans(text, pos, piece_end, max_size, level + 1)
+        pos = piece_end
+
+def _trim(text, start, end):
+    while start < end and text[start].isspace():
+        start += 1
+    while end > start and text[end - 1].isspace():
+        end -= 1
+    return start, end
+
+def chunk_spans(text, max_chunk_size=1024, overlap=100):
+    """
+    Splits text into chunks of at most `max_chunk_size` characters in a single pass.
+    Returns (start, end) offsets into `text`; consecutive chunks share up to `overlap`
+    characters. Nothing is copied, so slicing text[start:end] is left to the caller.
+    """
+    spans = []
+    chunk_start = chunk_end = None
+    for piece_start, piece_end in _split_spans(text, 0, len(text), max_chunk_size):
+        if chunk_start is None:
+            chunk_start, chunk_end = piece_start, piece_end
+        elif piece_end - chunk_start <= max_chunk_size:
+            chunk_end = piece_end
+        else:
+            spans.append(_trim(text, chunk_start, chunk_end))
+            # Start the next chunk `overlap` characters back, on a word boundary, as long as the piece still fits
+            next_start = max(chunk_end - overlap, piece_end - max_chunk_size, chunk_start + 1)
+            space = text.find(" ", next_start, chunk_end)
+            if space != -1:
+                next_start = space + 1
+            chunk_start, chunk_end = next_start, piece_end
+    if chunk_start is not None:
+        spans.append(_trim(text, chunk_start, chunk_end))
+    return [(start, end) for start, end in spans if start < end]
 
 def recursive_chunk_text(text, max_chunk_size=1024, overlap=100):
     """
     Recursively splits text into chunks of a specified size, with overlap.
     Tries to split based on newlines and sentences.
     """
-    chunks = []
-    if len(text) <= max_chunk_size:
-        return [text]
-
-    # Try splitting by double newline, then single newline
-    for separator in ["\n\n", "\n", ". ", "? ", "! ", " "]:
-        splits = text.split(separator)
-        if len(splits) > 1:
-            break
-
-    current_chunk = ""
-    for i, split in enumerate(splits):
-        if len(current_chunk) + len(split) + len(separator) > max_chunk_size:
-            chunks.append(current_chunk.strip())
-            # Add overlap
-            current_chunk = current_chunk[-overlap:] + split + separator
-        else:
-            current_chunk += split + separator
+    return [text[start:end] for start, end in chunk_spans(text, max_chunk_size, overlap)]
 
-    if current_chunk:
-        chunks.append(current_chunk.strip())
+def iter_chunks_from_pages(pages, max_chunk_size=1024, overlap=100):
+    """
+    Chunks a stream of (page_number, text) pairs as it arrives.
+    Yields (chunk, metadata) where metadata holds the first and last page the chunk
+    covers and its start/end offsets in the document text (pages joined by newlines).
+    Only the unfinished tail of the text seen so far is kept in memory.
+    """
+    buffer = ""
+    buffer_offset = 0  # document offset of buffer[0]
+    page_offsets = []  # document offset where each page starts
+    page_numbers = []
 
-    return chunks
+    def emit(spans):
+        for start, end in spans:
+            doc_start, doc_end = buffer_offset + start, buffer_offset + end
+            yield buffer[start:end], {
+                "page_start": page_numbers[bisect_right(page_offsets, doc_start) - 1],
+                "page_end": page_numbers[bisect_right(page_offsets, doc_end - 1) - 1],
+                "start": doc_start,
+                "end": doc_end,
+            }
+
+    for page_number, page_text in pages:
+        page_offsets.append(buffer_offset + len(buffer))
+        page_numbers.append(page_number)
+        buffer += page_text + "\n"
+        if len(buffer) < 2 * max_chunk_size:
+            continue
+
+        # The last chunk may continue on the next page, so it stays buffered
+        spans = chunk_spans(buffer, max_chunk_size, overlap)
+        if len(spans) < 2:
+            continue
+        yield from emit(spans[:-1])
+        cut = spans[-1][0]
+        buffer = buffer[cut:]
+        buffer_offset += cut
+
+    if page_numbers:
+        yield from emit(chunk_spans(buffer, max_chunk_size, overlap))
 
 def simple_chunk_text(text, max_words=300):
     words = text.split()
@@ -0,0 +1,92 @@
+import numpy as np
+
+from utils.semantic_search import from_storage, normalize_vectors
+
+# Rough characters per LLM token for English policy text; used to size the context without a tokenizer
+CHARS_PER_TOKEN = 4
+
+def estimate_tokens(text):
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+def mmr_order(vectors, mmr_lambda=0.7):
+    """
+    Orders candidates by maximal marginal relevance. Candidates arrive best first, so relevance
+    is their retrieval rank (which already reflects both dense and BM25 evidence); redundancy
+    is the highest cosine similarity to any candidate picked so far.
+    Returns candidate positions, most useful first.
+    """
+    n = len(vectors)
+    if n <= 1:
+        return list(range(n))
+    relevance = 1.0 - np.arange(n, dtype=np.float32) / (n - 1)
+    unit = normalize_vectors(vectors)
+    similarity = unit @ unit.T
+
+    order = [0]
+    picked = np.zeros(n, dtype=bool)
+    picked[0] = True
+    max_similarity = similarity[0].copy()
+    for _ in range(n - 1):
+        scores = mmr_lambda * relevance - (1 - mmr_lambda) * max_similarity
+        scores[picked] = -np.inf
+        best = int(np.argmax(scores))
+        order.append(best)
+        picked[best] = True
+        np.maximum(max_similarity, similarity[best], out=max_similarity)
+    return order
+
+def merge_passages(chunks):
+    """
+    Joins chunks that overlap or follow each other in the same document into one passage, in
+    document order, dropping the text repeated by the chunk overlap. `chunks` holds
+    (chunk_id, text, metadata) triples; chunks without start/end offsets (indexed by older
+    versions) are kept as they are. Returns passages as {"chunk_ids": [...], "text": ...}.
+    """
+    def position(chunk):
+        chunk_id, _, metadata = chunk
+        return metadata["source"], metadata.get("start", -1), chunk_id
+
+    passages = []
+    last = None
+    for chunk_id, text, metadata in sorted(chunks, key=position):
+        start, end = metadata.get("start"), metadata.get("end")
+        same_document = last is not None and last["source"] == metadata["source"] and start is not None and last["end"] is not None
+        if same_document and start < last["end"]:
+            # Overlapping neighbours: keep only the part not already in the passage
+            if end > last["end"]:
+                last["text"] += text[last["end"] - start:]
+                last["end"] = end
+            last["chunk_ids"].append(chunk_id)
+        elif same_document and chunk_id == last["chunk_ids"][-1] + 1:
+            last["text"] += "\n" + text
+            last["end"] = end
+            last["chunk_ids"].append(chunk_id)
+        else:
+            last = {"source": metadata["source"], "end": end, "chunk_ids": [chunk_id], "text": text}
+            passages.append(last)
+    return [{"chunk_ids": passage["chunk_ids"], "text": passage["text"]} for passage in passages]
+
+def build_context(candidate_ids, chunks_data, max_tokens, max_chunks, mmr_lambda=0.7):
+    """
+    Picks the retrieved chunks to show the LLM. Candidates (best first) are taken in MMR order
+    while the merged passages stay within `max_tokens` and at most `max_chunks` chunks are used;
+    the best candidate is always included. Returns the passages, in document order.
+    """
+    candidate_ids = [int(chunk_id) for chunk_id in candidate_ids]
+    if not candidate_ids:
+        return []
+    texts = chunks_data.texts_for_ids(candidate_ids)
+    metadata = chunks_data.metadata_for_ids(candidate_ids)
+    vectors = chunks_data.vectors_for_ids(candidate_ids)
+    order = mmr_order(from_storage(vectors), mmr_lambda) if vectors is not None else range(len(candidate_ids))
+
+    selected, passages = [], []
+    for position in order:
+        if len(selected) >= max_chunks:
+            break
+        trial = merge_passages(selected + [(candidate_ids[position], texts[position], metadata[position])])
+        if selected and sum(estimate_tokens(passage["text"]) for passage in trial) > max_tokens:
+            continue
+        selected.append((candidate_ids[position], texts[position], metadata[position]))
+        passages = trial
+    return passages
@@ -0,0 +1,158 @@
+import os
+import copy
+import json
+import time
+import hashlib
+import logging
+import threading
+from pathlib import Path
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+def normalize_query(query):
+    return " ".join(query.lower().split())
+
+def decision_cache_key(policy_hash, query, chunk_ids, prompt_text):
+    """
+    Hashes everything a decision depends on: the policy file, the normalized query,
+    the retrieved chunk ids and the prompt template. Changing any of them gives a new key.
+    """
+    payload = json.dumps({
+        "policy": policy_hash,
+        "query": normalize_query(query),
+        "chunks": [int(chunk_id) for chunk_id in chunk_ids],
+        "prompt": hashlib.sha256(prompt_text.encode("utf-8")).hexdigest(),
+    }, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+class DecisionCache:
+    """
+    Two-tier cache of parsed LLM decisions: an in-process LRU and an optional directory of JSON files.
+    Entries expire after `ttl_seconds`; each tier evicts least recently used entries when full.
+    The directory's size is tracked as entries are written, and it is only scanned when that
+    total goes over `disk_max_bytes` or every DISK_SCAN_SECONDS, which also picks up what
+    other processes wrote and removes expired entries. A scan evicts down to DISK_LOW_WATER
+    of the budget, so a full cache isn't scanned again on the very next write.
+    """
+    DISK_SCAN_SECONDS = 60
+    DISK_LOW_WATER = 0.9
+
+    def __init__(self, max_entries, ttl_seconds, disk_dir=None, disk_max_bytes=0):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.disk_dir = Path(disk_dir) if disk_dir else None
+        self.disk_max_bytes = disk_max_bytes
+        self._entries = OrderedDict()  # key -> (created, value)
+        self._lock = threading.Lock()
+        self._disk_lock = threading.Lock()
+        self._disk_bytes = None  # running total since the last scan; None until the first one
+        self._disk_scanned_at = 0.0
+
+    def _expired(self, created):
+        return self.ttl_seconds > 0 and time.time() - created > self.ttl_seconds
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if not self._expired(entry[0]):
+                    self._entries.move_to_end(key)
+                    return copy.deepcopy(entry[1])
+                del self._entries[key]
+
+        entry = self._disk_get(key)
+        if entry is None:
+            return None
+        self._memory_put(key, *entry)
+        return copy.deepcopy(entry[1])
+
+    def put(self, key, value):
+        created = time.time()
+        self._memory_put(key, created, copy.deepcopy(value))
+        self._disk_put(key, created, value)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def _memory_put(self, key, created, value):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (created, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _disk_path(self, key):
+        return self.disk_dir / f"{key}.json"
+
+    def _disk_get(self, key):
+        if self.disk_dir is None:
+            return None
+        path = self._disk_path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                entry = json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError):
+            path.unlink(missing_ok=True)
+            return None
+        if self._expired(entry["created"]):
+            path.unlink(missing_ok=True)
+            return None
+        try:
+            os.utime(path)  # mark as recently used
+        except FileNotFoundError:
+            pass
+        return entry["created"], entry["value"]
+
+    def _disk_put(self, key, created, value):
+        if self.disk_dir is None:
+            return
+        path = self._disk_path(key)
+        tmp_path = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        try:
+            self.disk_dir.mkdir(parents=True, exist_ok=True)
+            data = json.dumps({"created": created, "value": value}).encode("utf-8")
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            size = len(data)
+            try:
+                size -= path.stat().st_size  # overwriting an existing entry
+            except FileNotFoundError:
+                pass
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"Could not write decision cache entry: {e}")
+            tmp_path.unlink(missing_ok=True)
+            return
+
+        with self._disk_lock:
+            if self._disk_bytes is not None:
+                self._disk_bytes += size
+            if (self._disk_bytes is None or self._disk_bytes > self.disk_max_bytes
+                    or time.monotonic() - self._disk_scanned_at > self.DISK_SCAN_SECONDS):
+                self._disk_bytes = self._disk_evict()
+                self._disk_scanned_at = time.monotonic()
+
+    def _disk_evict(self):
+        """Deletes expired and least recently used entries until the directory fits; returns its size."""
+        entries = []
+        for path in self.disk_dir.glob("*.json"):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+
+        total = sum(size for _, size, _ in entries)
+        limit = self.disk_max_bytes if total <= self.disk_max_bytes else self.disk_max_bytes * self.DISK_LOW_WATER
+        for mtime, size, path in sorted(entries):
+            if total <= limit and not self._expired(mtime):
+                break
+            path.unlink(missing_ok=True)
+            total -= size
+        return total
@@ -2,18 +2,73 @@ import os
 import pickle
 import re
 import json
+import time
+import asyncio
+import functools
+import contextvars
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
 from fastapi import HTTPException
 
-from core.config import DOCUMENTS_DIR, PROMPT_PATH
-from core.indexing import global_model, global_faiss_index, global_all_chunks_data
+from core.config import (
+    DOCUMENTS_DIR, PROMPT_PATH, SENTENCE_TRANSFORMER_MODEL, EXACT_SEARCH_MAX_CANDIDATES, QUERY_CPU_WORKERS, LLM_MAX_CONCURRENCY,
+    DECISION_CACHE_MAX_ENTRIES, DECISION_CACHE_TTL_SECONDS, DECISION_CACHE_DISK_ENABLED, DECISION_CACHE_DISK_MAX_MB, DECISION_CACHE_DIR,
+    EMBEDDING_BATCH_MAX_SIZE, EMBEDDING_BATCH_MAX_WAIT_MS, BM25_K1, BM25_B, BM25_CANDIDATES, BM25_RRF_K,
+    CONTEXT_CANDIDATES, CONTEXT_MAX_CHUNKS, CONTEXT_MAX_TOKENS, CONTEXT_MMR_LAMBDA,
+)
+from core.indexing import global_model, global_index, reload_global_index, refresh_global_index
+from core.manifest import document_sha256
 
-from utils.semantic_search import search_topk, build_faiss_index_from_embeddings
-from utils.gemini_client import client
+from utils.semantic_search import search_ids_by_vector, reciprocal_rank_fusion
+from utils.embedding_batcher import EmbeddingBatcher
+from utils.context_builder import build_context
+from utils.llm_client import client, LLMError
+from utils.decision_cache import DecisionCache, decision_cache_key
+from utils.metrics import stage, annotate_trace, record_decision_cache, register_batcher_metrics, STAGE_SECONDS, CHUNKS_SCANNED, PROMPT_CHARS
+
+GENERATION_CONFIG = {"temperature": 0.1}
+
+# Query encoding and FAISS search run here, off the event loop
+cpu_executor = ThreadPoolExecutor(max_workers=QUERY_CPU_WORKERS, thread_name_prefix="query-cpu")
+
+def run_on_cpu_executor(func, *args):
+    """
+    Runs `func(*args)` on the CPU executor and returns an awaitable for its result.
+    It runs in a copy of the caller's context, so its stages land in the request trace.
+    """
+    call = functools.partial(contextvars.copy_context().run, func, *args)
+    return asyncio.get_running_loop().run_in_executor(cpu_executor, call)
+
+# Query embeddings from concurrent requests are encoded together in one forward pass
+embedding_batcher = EmbeddingBatcher(lambda: global_model.model, EMBEDDING_BATCH_MAX_SIZE, EMBEDDING_BATCH_MAX_WAIT_MS)
+register_batcher_metrics(embedding_batcher)
+
+decision_cache = DecisionCache(
+    DECISION_CACHE_MAX_ENTRIES,
+    DECISION_CACHE_TTL_SECONDS,
+    disk_dir=DECISION_CACHE_DIR if DECISION_CACHE_DISK_ENABLED else None,
+    disk_max_bytes=DECISION_CACHE_DISK_MAX_MB * 1024 * 1024,
+)
+
+_llm_semaphore = None
+
+def get_llm_semaphore():
+    """Caps in-flight LLM calls across all requests. Created on first use so it binds to the server's event loop."""
+    global _llm_semaphore
+    if _llm_semaphore is None:
+        _llm_semaphore = asyncio.Semaphore(LLM_MAX_CONCURRENCY)
+    return _llm_semaphore
+
+_cached_prompt = (None, None)  # (prompt file mtime, prompt text)
 
 def read_prompt():
-    with open(PROMPT_PATH, "r") as f:
-        return f.read()
+    """The decision prompt template, read from disk only when the file has changed."""
+    global _cached_prompt
+    mtime = os.stat(PROMPT_PATH).st_mtime_ns
+    if _cached_prompt[0] != mtime:
+        with open(PROMPT_PATH, "r") as f:
+            _cached_prompt = (mtime, f.read())
+    return _cached_prompt[1]
 
 def parse_query_with_regex(query: str) -> dict:
     """
@@ -37,14 +92,57 @@ def parse_query_with_regex(query: str) -> dict:
     }
     return {"raw_query": query, "structured": structured_query}
 
-def run_decision_engine(parsed_query, model, doc_index, doc_chunks):
-    """Runs the decision engine using a document-specific FAISS index."""
-    top_clauses = search_topk(parsed_query["raw_query"], model, doc_index, doc_chunks)
-    
-    clause_context = "\n".join(top_clauses)
+def search_policy(q_vec, query, index, chunks_data, doc_ids, k=5):
+    """
+    Searches one policy's chunks. A policy is usually small enough to scan its stored vectors exactly.
+    With BM25 enabled, the dense and lexical rankings are merged by reciprocal rank, so clauses
+    that share the query's exact terms surface even when their embeddings rank them lower.
+    """
+    vectors = chunks_data.vectors_for_ids(doc_ids) if len(doc_ids) <= EXACT_SEARCH_MAX_CANDIDATES else None
+    bm25 = chunks_data.bm25_index()
+    if bm25 is None:
+        return search_ids_by_vector(q_vec, index, doc_ids, k, candidate_vectors=vectors)
+    dense_ids = search_ids_by_vector(q_vec, index, doc_ids, max(k, BM25_CANDIDATES), candidate_vectors=vectors)
+    with stage("bm25"):
+        lexical_ids = bm25.search(query, doc_ids, max(k, BM25_CANDIDATES), BM25_K1, BM25_B)
+    return reciprocal_rank_fusion([dense_ids, lexical_ids], BM25_RRF_K)[:k]
+
+def select_context(candidate_ids, chunks_data):
+    """
+    Chooses which retrieved chunks the LLM sees, within the [CONTEXT] budget.
+    Returns (chunk_ids, passages): the ids in prompt order and the merged passages.
+    """
+    with stage("context"):
+        passages = build_context(candidate_ids, chunks_data, CONTEXT_MAX_TOKENS, CONTEXT_MAX_CHUNKS, CONTEXT_MMR_LAMBDA)
+    return [chunk_id for passage in passages for chunk_id in passage["chunk_ids"]], passages
+
+def retrieve_clauses(parsed_query, model, index, chunks_data, doc_ids):
+    """
+    Finds the document's most relevant clauses for the query. CPU-bound: encodes the query and searches FAISS.
+    Returns (chunk_ids, passages), see select_context.
+    """
+    CHUNKS_SCANNED.observe(len(doc_ids))
+    with stage("encode"):
+        q_vec = model.encode([parsed_query["raw_query"]])
+    with stage("search"):
+        candidate_ids = search_policy(q_vec, parsed_query["raw_query"], index, chunks_data, doc_ids, CONTEXT_CANDIDATES)
+    return select_context(candidate_ids, chunks_data)
+
+async def retrieve_clauses_async(parsed_query, index, chunks_data, doc_ids):
+    """Async retrieval: the query goes through the embedding batcher, the FAISS search runs on the CPU executor."""
+    CHUNKS_SCANNED.observe(len(doc_ids))
+    with stage("encode"):
+        q_vec = await embedding_batcher.encode_async([parsed_query["raw_query"]])
+    with stage("search"):
+        candidate_ids = await run_on_cpu_executor(
+            search_policy, q_vec, parsed_query["raw_query"], index, chunks_data, doc_ids, CONTEXT_CANDIDATES)
+    return select_context(candidate_ids, chunks_data)
+
+def build_reasoning_prompt(parsed_query, passages):
+    clause_context = "\n\n".join(passage["text"] for passage in passages)
     structured_query_str = json.dumps(parsed_query["structured"], indent=2)
 
-    reasoning_prompt = f"""
+    prompt = f"""
 {read_prompt()}
 
 User Query (structured): {structured_query_str}
@@ -53,44 +151,241 @@ User Query (raw): {parsed_query["raw_query"]}
 Relevant Clauses:
 {clause_context}
 """
-    response = client.generate_content(reasoning_prompt, generation_config={"temperature": 0.1})
+    PROMPT_CHARS.observe(len(prompt))
+    return prompt
+
+def clean_llm_output(text):
     # Clean up the response to ensure it's valid JSON
-    cleaned_response = response.text.strip().replace("```json", "").replace("```", "")
-    return cleaned_response
+    return text.strip().replace("```json", "").replace("```", "")
 
-from core.indexing import load_global_index_and_chunks
+def run_decision_engine(parsed_query, passages):
+    """Asks the LLM for a decision on the retrieved clauses and returns its cleaned-up JSON text."""
+    reasoning_prompt = build_reasoning_prompt(parsed_query, passages)
+    with stage("llm"):
+        response = client.generate_content(reasoning_prompt, generation_config=GENERATION_CONFIG)
+    return clean_llm_output(response.text)
 
-def get_decision_for_document_and_query(policy_filename: str, user_query: str):
+async def run_decision_engine_async(parsed_query, passages):
+    """Async counterpart of run_decision_engine; the number of concurrent LLM calls is capped."""
+    reasoning_prompt = build_reasoning_prompt(parsed_query, passages)
+    async with get_llm_semaphore():
+        with stage("llm"):
+            response = await client.generate_content_async(reasoning_prompt, generation_config=GENERATION_CONFIG)
+    return clean_llm_output(response.text)
+
+def get_decision_cache_key(policy_filename, parsed_query, top_ids):
+    # New chunk ids are assigned whenever a policy is re-indexed, so the key also tracks the index
+    return decision_cache_key(document_sha256(policy_filename), parsed_query["raw_query"], top_ids, read_prompt())
+
+def lookup_decision(cache_key):
+    """Returns the cached decision for `cache_key`, or None, and counts the hit or miss."""
+    cached_decision = decision_cache.get(cache_key)
+    record_decision_cache(cached_decision is not None)
+    return cached_decision
+
+def cache_decision(cache_key, decision):
+    # Unparseable LLM output is not cached, so the next request tries again
+    if "error" not in decision:
+        decision_cache.put(cache_key, decision)
+    return decision
+
+async def cache_decision_async(cache_key, decision):
+    """cache_decision for the async pipeline: the cache's disk write runs in a thread, off the event loop."""
+    return await asyncio.to_thread(cache_decision, cache_key, decision)
+
+def parse_decision(decision_json_str):
+    try:
+        decision_dict = json.loads(decision_json_str)
+        return decision_dict
+    except json.JSONDecodeError:
+        return {"error": "Could not parse the output as JSON.", "raw_output": decision_json_str}
+
+def ensure_index_loaded():
+    """
+    Loads the model and index on first use, and picks up index versions published by
+    other worker processes. Returns an error dict if either is unavailable.
+    """
     if not global_model.model:
-        global_model.set_model('all-MiniLM-L6-v2')
+        global_model.set_model(SENTENCE_TRANSFORMER_MODEL)
     
-    if not global_faiss_index.index or not global_all_chunks_data.data["texts"]:
-        loaded_index, loaded_chunks_data = load_global_index_and_chunks()
-        global_faiss_index.set_index(loaded_index)
-        global_all_chunks_data.set_data(loaded_chunks_data)
+    snapshot = global_index.snapshot
+    if not snapshot.index or not snapshot.chunks.data["texts"]:
+        reload_global_index()
+    else:
+        refresh_global_index()
 
     if not global_model.model:
         return {"error": "SentenceTransformer model not loaded."}
-    if not global_faiss_index.index:
+    if not global_index.snapshot.index:
         return {"error": "FAISS index not loaded or built. Run preprocess.py."}
+    return None
 
+def resolve_policy(policy_filename: str, chunks_data):
+    """Returns (doc_ids, None) for a policy indexed in `chunks_data`, or (None, error dict)."""
     if not Path(DOCUMENTS_DIR, policy_filename).exists():
-        return {"error": f"Document '{policy_filename}' not found in '{DOCUMENTS_DIR}' directory."}
+        return None, {"error": f"Document '{policy_filename}' not found in '{DOCUMENTS_DIR}' directory."}
 
-    doc_chunks = [chunk for i, chunk in enumerate(global_all_chunks_data.data["texts"]) if global_all_chunks_data.data["metadata"][i]["source"] == policy_filename]
+    doc_ids = chunks_data.ids_for_source(policy_filename)
     
-    if not doc_chunks:
-        return {"error": f"No chunks found for document '{policy_filename}'. Did you run preprocess.py or upload it?"}
+    if len(doc_ids) == 0:
+        return None, {"error": f"No chunks found for document '{policy_filename}'. Did you run preprocess.py or upload it?"}
+    return doc_ids, None
 
-    doc_embeddings = global_model.model.encode(doc_chunks)
-    doc_index = build_faiss_index_from_embeddings(doc_embeddings)
+def prepare_query(policy_filename: str, user_query: str):
+    """
+    Makes sure the model and index are loaded and the policy is indexed.
+    Returns (parsed_query, doc_ids, snapshot), or an error dict as the first element. The
+    query should search `snapshot` throughout, as a newer index version may go live meanwhile.
+    """
+    error = ensure_index_loaded()
+    if error:
+        return error, None, None
+    snapshot = global_index.snapshot
+    doc_ids, error = resolve_policy(policy_filename, snapshot.chunks)
+    if error:
+        return error, None, None
+    return parse_query_with_regex(user_query), doc_ids, snapshot
+
+def get_decision_for_document_and_query(policy_filename: str, user_query: str):
+    with stage("prepare"):
+        parsed_query, doc_ids, snapshot = prepare_query(policy_filename, user_query)
+    if "error" in parsed_query:
+        return parsed_query
+
+    top_ids, passages = retrieve_clauses(parsed_query, global_model.model, snapshot.index, snapshot.chunks, doc_ids)
+    cache_key = get_decision_cache_key(policy_filename, parsed_query, top_ids)
+    cached_decision = lookup_decision(cache_key)
+    if cached_decision is not None:
+        return cached_decision
 
-    parsed_query = parse_query_with_regex(user_query)
-    decision_json_str = run_decision_engine(parsed_query, global_model.model, doc_index, doc_chunks)
-    
     try:
-        decision_dict = json.loads(decision_json_str)
-        return decision_dict
-    except json.JSONDecodeError:
-        return {"error": "Could not parse the output as JSON.", "raw_output": decision_json_str}
+        decision_json_str = run_decision_engine(parsed_query, passages)
+    except LLMError as e:
+        return {"error": f"Error getting decision: {e}"}
+    return cache_decision(cache_key, parse_decision(decision_json_str))
+
+async def get_decision_for_document_and_query_async(policy_filename: str, user_query: str):
+    """
+    Async version of get_decision_for_document_and_query for the API server.
+    Blocking work (loading on first use, FAISS search) runs on the bounded CPU executor
+    and the query is encoded by the shared embedding batcher.
+    """
+    annotate_trace(policy=policy_filename)
+    with stage("prepare"):
+        parsed_query, doc_ids, snapshot = await run_on_cpu_executor(prepare_query, policy_filename, user_query)
+    if "error" in parsed_query:
+        return parsed_query
+
+    top_ids, passages = await retrieve_clauses_async(parsed_query, snapshot.index, snapshot.chunks, doc_ids)
+    return await _decide_async(policy_filename, parsed_query, top_ids, passages)
+
+async def _decide_async(policy_filename, parsed_query, top_ids, passages):
+    cache_key = get_decision_cache_key(policy_filename, parsed_query, top_ids)
+    cached_decision = lookup_decision(cache_key)
+    if cached_decision is not None:
+        return cached_decision
+    try:
+        decision_json_str = await run_decision_engine_async(parsed_query, passages)
+    except LLMError as e:
+        return {"error": f"Error getting decision: {e}"}
+    return await cache_decision_async(cache_key, parse_decision(decision_json_str))
+
+def _retrieve_batch(items, doc_ids_by_policy, snapshot):
+    """Encodes every query in one forward pass, then runs each policy-restricted search in `snapshot`."""
+    with stage("encode"):
+        q_vecs = global_model.model.encode([parsed_query["raw_query"] for _, _, parsed_query in items])
+    index, chunks_data = snapshot.index, snapshot.chunks
+    retrieved = []
+    for (_, policy_filename, parsed_query), q_vec in zip(items, q_vecs):
+        CHUNKS_SCANNED.observe(len(doc_ids_by_policy[policy_filename]))
+        with stage("search"):
+            candidate_ids = search_policy(
+                q_vec, parsed_query["raw_query"], index, chunks_data, doc_ids_by_policy[policy_filename], CONTEXT_CANDIDATES)
+        retrieved.append(select_context(candidate_ids, chunks_data))
+    return retrieved
+
+async def get_decisions_for_batch_async(pairs):
+    """
+    Answers many (policy_filename, user_query) pairs at once.
+    Pairs are grouped by policy so each policy is resolved once, all queries are
+    embedded in a single pass, and the LLM calls fan out under the shared concurrency cap.
+    Returns one result per pair, in order: a decision dict or an error dict.
+    """
+    annotate_trace(batch_size=len(pairs))
+    with stage("prepare"):
+        error = await run_on_cpu_executor(ensure_index_loaded)
+    if error:
+        return [dict(error) for _ in pairs]
+
+    snapshot = global_index.snapshot
+    results = [None] * len(pairs)
+    doc_ids_by_policy = {}
+    items = []  # (position, policy_filename, parsed_query)
+    for position, (policy_filename, user_query) in enumerate(pairs):
+        if policy_filename not in doc_ids_by_policy:
+            doc_ids_by_policy[policy_filename] = resolve_policy(policy_filename, snapshot.chunks)
+        doc_ids, error = doc_ids_by_policy[policy_filename]
+        if error:
+            results[position] = dict(error)
+        else:
+            items.append((position, policy_filename, parse_query_with_regex(user_query)))
+    doc_ids_by_policy = {name: doc_ids for name, (doc_ids, _) in doc_ids_by_policy.items()}
+
+    if items:
+        with stage("retrieve"):
+            retrieved = await run_on_cpu_executor(_retrieve_batch, items, doc_ids_by_policy, snapshot)
+        decisions = await asyncio.gather(
+            *[_decide_async(policy_filename, parsed_query, top_ids, passages)
+              for (_, policy_filename, parsed_query), (top_ids, passages) in zip(items, retrieved)],
+            return_exceptions=True,
+        )
+        for (position, _, _), decision in zip(items, decisions):
+            results[position] = {"error": f"Error getting decision: {decision}"} if isinstance(decision, Exception) else decision
+    return results
+
+def get_decisions_for_batch(pairs):
+    """Synchronous wrapper around get_decisions_for_batch_async, for scripts and batch jobs."""
+    return asyncio.run(get_decisions_for_batch_async(pairs))
+
+async def stream_decision_for_document_and_query(policy_filename: str, user_query: str):
+    """
+    Streaming version of get_decision_for_document_and_query_async.
+    Yields (event, data) pairs: "retrieval" with the parsed query and clauses as soon as
+    they are found, "token" for each piece of LLM output, then "decision" with the parsed
+    result. Failures are reported as a single "error" event.
+    """
+    annotate_trace(policy=policy_filename)
+    with stage("prepare"):
+        parsed_query, doc_ids, snapshot = await run_on_cpu_executor(prepare_query, policy_filename, user_query)
+    if "error" in parsed_query:
+        yield "error", parsed_query
+        return
+
+    top_ids, passages = await retrieve_clauses_async(parsed_query, snapshot.index, snapshot.chunks, doc_ids)
+    yield "retrieval", {
+        "parsed_query": parsed_query,
+        "clauses": [{"chunk_ids": [int(chunk_id) for chunk_id in passage["chunk_ids"]], "text": passage["text"]} for passage in passages],
+    }
+
+    cache_key = get_decision_cache_key(policy_filename, parsed_query, top_ids)
+    cached_decision = lookup_decision(cache_key)
+    if cached_decision is not None:
+        yield "decision", cached_decision
+        return
+
+    reasoning_prompt = build_reasoning_prompt(parsed_query, passages)
+    pieces = []
+    try:
+        async with get_llm_semaphore():
+            started = time.perf_counter()
+            response = await client.generate_content_async(reasoning_prompt, generation_config=GENERATION_CONFIG, stream=True)
+            async for chunk in response:
+                if not pieces:
+                    STAGE_SECONDS.labels("llm_first_token").observe(time.perf_counter() - started)
+                pieces.append(chunk.text)
+                yield "token", {"text": chunk.text}
+    except Exception as e:
+        yield "error", {"error": f"Error getting decision: {e}"}
+        return
 
+    yield "decision", await cache_decision_async(cache_key, parse_decision(clean_llm_output("".join(pieces))))
@@ -0,0 +1,112 @@
+import time
+import queue
+import asyncio
+import threading
+from concurrent.futures import Future
+
+import numpy as np
+
+class _EncodeRequest:
+    __slots__ = ("texts", "future", "enqueued_at")
+
+    def __init__(self, texts):
+        self.texts = texts
+        self.future = Future()
+        self.enqueued_at = time.perf_counter()
+
+class EmbeddingBatcher:
+    """
+    Coalesces concurrent encode calls into one forward pass.
+    Requests are collected for up to `max_wait_ms` or until `max_batch_size` texts are
+    queued, encoded together on a background thread, and the vectors are routed back
+    to each caller. `encode` has the same shape as SentenceTransformer.encode for a
+    list of texts, so the batcher can stand in for the model when searching.
+    """
+    def __init__(self, get_model, max_batch_size=32, max_wait_ms=2):
+        self._get_model = get_model
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self._queue = queue.Queue()
+        self._thread = None
+        self._thread_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            "batches": 0,
+            "texts": 0,
+            "max_batch_size": 0,
+            "queue_wait_seconds_total": 0.0,
+            "queue_wait_seconds_max": 0.0,
+        }
+
+    def submit(self, texts):
+        """Queues texts for encoding and returns a concurrent.futures.Future for their vectors."""
+        self._ensure_thread()
+        request = _EncodeRequest(list(texts))
+        self._queue.put(request)
+        return request.future
+
+    def encode(self, texts, **kwargs):
+        return self.submit(texts).result()
+
+    async def encode_async(self, texts):
+        return await asyncio.wrap_future(self.submit(texts))
+
+    def stats(self):
+        """Returns counters for batch sizes and time spent waiting in the queue."""
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats["mean_batch_size"] = stats["texts"] / stats["batches"] if stats["batches"] else 0.0
+        stats["mean_queue_wait_seconds"] = stats["queue_wait_seconds_total"] / stats["texts"] if stats["texts"] else 0.0
+        return stats
+
+    def _ensure_thread(self):
+        if self._thread is not None:
+            return
+        with self._thread_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="embedding-batcher", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            size = len(batch[0].texts)
+            deadline = time.perf_counter() + self.max_wait
+            while size < self.max_batch_size:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                try:
+                    request = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                batch.append(request)
+                size += len(request.texts)
+            self._encode_batch(batch)
+
+    def _encode_batch(self, batch):
+        # Skip callers that gave up (e.g. a cancelled request) while queued
+        batch = [request for request in batch if request.future.set_running_or_notify_cancel()]
+        if not batch:
+            return
+        started = time.perf_counter()
+        texts = [text for request in batch for text in request.texts]
+        try:
+            vectors = np.asarray(self._get_model().encode(texts))
+        except Exception as e:
+            for request in batch:
+                request.future.set_exception(e)
+            return
+
+        waits = [started - request.enqueued_at for request in batch]
+        with self._stats_lock:
+            self._stats["batches"] += 1
+            self._stats["texts"] += len(texts)
+            self._stats["max_batch_size"] = max(self._stats["max_batch_size"], len(texts))
+            self._stats["queue_wait_seconds_total"] += sum(wait * len(request.texts) for wait, request in zip(waits, batch))
+            self._stats["queue_wait_seconds_max"] = max(self._stats["queue_wait_seconds_max"], max(waits))
+
+        offset = 0
+        for request in batch:
+            request.future.set_result(vectors[offset:offset + len(request.texts)])
+            offset += len(request.texts)
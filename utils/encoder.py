@@ -0,0 +1,92 @@
+import os
+import re
+import time
+import warnings
+
+import numpy as np
+
+from core.config import SENTENCE_TRANSFORMER_MODEL, ENCODER_BACKEND, ENCODER_ONNX_QUANTIZATION, ENCODER_CACHE_DIR
+
+# torch: the reference PyTorch model. torch_int8: its Linear layers quantized to int8 at load time.
+# onnx / onnx_int8: ONNX Runtime, exported on first use (needs `pip install sentence-transformers[onnx]`).
+ENCODER_BACKENDS = ("torch", "torch_int8", "onnx", "onnx_int8")
+
+# A candidate backend must keep every embedding at least this close (cosine) to the reference model
+MIN_EQUIVALENT_COSINE = 0.98
+
+def load_encoder(model_name=SENTENCE_TRANSFORMER_MODEL, backend=ENCODER_BACKEND):
+    """
+    Creates the sentence embedding model for `backend`. Every backend returns a SentenceTransformer,
+    so callers (and the embedding batcher) use encode() the same way whichever one is configured.
+    """
+    if backend not in ENCODER_BACKENDS:
+        raise ValueError(f"Unknown encoder backend '{backend}'. Expected one of {', '.join(ENCODER_BACKENDS)}.")
+    # Imported here: sentence_transformers pulls in torch, which takes seconds to import
+    from sentence_transformers import SentenceTransformer
+
+    if backend == "torch":
+        return SentenceTransformer(model_name)
+    if backend == "torch_int8":
+        import torch
+
+        model = SentenceTransformer(model_name, device="cpu")
+        with warnings.catch_warnings():
+            # Eager-mode dynamic quantization is deprecated in favour of torchao, but still the simplest CPU speed-up
+            warnings.simplefilter("ignore")
+            torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+        return model
+    if backend == "onnx":
+        return SentenceTransformer(model_name, backend="onnx")
+    return SentenceTransformer(_quantized_onnx_dir(model_name), backend="onnx", model_kwargs={"file_name": _quantized_onnx_file()})
+
+def _quantized_onnx_file():
+    return f"onnx/model_qint8_{ENCODER_ONNX_QUANTIZATION}.onnx"
+
+def _quantized_onnx_dir(model_name):
+    """
+    A local copy of `model_name` holding its int8 ONNX export, created once under ENCODER_CACHE_DIR.
+    Quantization is tuned for the instruction set in [MODEL] ONNX_QUANTIZATION (avx2, avx512, avx512_vnni or arm64).
+    """
+    from sentence_transformers import SentenceTransformer, export_dynamic_quantized_onnx_model
+
+    model_dir = os.path.join(ENCODER_CACHE_DIR, re.sub(r"[^\w.-]+", "_", model_name))
+    if not os.path.exists(os.path.join(model_dir, _quantized_onnx_file())):
+        print(f"Exporting an int8 ONNX encoder for {model_name} to {model_dir}...")
+        model = SentenceTransformer(model_name, backend="onnx")
+        model.save(model_dir)
+        export_dynamic_quantized_onnx_model(model, ENCODER_ONNX_QUANTIZATION, model_dir)
+    return model_dir
+
+def compare_encoders(reference, candidate, texts, batch_size=64):
+    """
+    Equivalence check: cosine similarity between the two models' embeddings of each text.
+    Returns the mean, minimum and 1st percentile, and whether the minimum clears MIN_EQUIVALENT_COSINE.
+    """
+    expected = np.asarray(reference.encode(texts, batch_size=batch_size, normalize_embeddings=True), dtype="float32")
+    actual = np.asarray(candidate.encode(texts, batch_size=batch_size, normalize_embeddings=True), dtype="float32")
+    cosine = (expected * actual).sum(axis=1)
+    return {
+        "texts": len(texts),
+        "mean_cosine": float(cosine.mean()),
+        "min_cosine": float(cosine.min()),
+        "p1_cosine": float(np.percentile(cosine, 1)),
+        "equivalent": bool(cosine.min() >= MIN_EQUIVALENT_COSINE),
+    }
+
+def measure_throughput(model, texts, batch_size=64, queries=None):
+    """Bulk encoding rate (texts per second, as in ingestion) and single-query latency percentiles (as in /query)."""
+    model.encode(texts[:batch_size], batch_size=batch_size)  # warm-up
+    started = time.perf_counter()
+    model.encode(texts, batch_size=batch_size)
+    bulk_seconds = time.perf_counter() - started
+
+    latencies = []
+    for query in queries or texts[:100]:
+        started = time.perf_counter()
+        model.encode([query])
+        latencies.append(time.perf_counter() - started)
+    return {
+        "texts_per_second": len(texts) / bulk_seconds if bulk_seconds else 0.0,
+        "query_p50_ms": float(np.percentile(latencies, 50) * 1000),
+        "query_p95_ms": float(np.percentile(latencies, 95) * 1000),
+    }
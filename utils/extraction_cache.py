@@ -0,0 +1,121 @@
+import os
+import time
+import gzip
+import zlib
+import logging
+import threading
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+# Pages are stored in one text stream separated by form feeds, as pdfminer emits them
+PAGE_BREAK = "\x0c"
+
+class ExtractionCache:
+    """
+    Gzip-compressed extracted text on disk, keyed by file content hash and extractor version.
+    Least recently used entries are evicted once the cache grows past `max_bytes`.
+    Safe to share between processes: entries are written to a temporary file and renamed into place.
+    Each process adds up what it writes and scans the directory only once that passes `max_bytes`,
+    or after SCAN_SECONDS to account for the other processes' writes.
+    """
+    SCAN_SECONDS = 60
+    # Eviction frees a little more than needed, so the following writes don't each trigger a scan
+    LOW_WATER = 0.9
+
+    def __init__(self, cache_dir, max_bytes, extractor_version):
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = max_bytes
+        self.extractor_version = extractor_version
+        self._lock = threading.Lock()
+        self._bytes = None  # estimated size of the cache; None until the first scan
+        self._scanned_at = 0.0
+
+    def _entry_path(self, file_hash):
+        return self.cache_dir / f"{file_hash}.v{self.extractor_version}.txt.gz"
+
+    def get_pages(self, file_hash, extract=None):
+        """
+        Returns an iterator of cached (page_number, text) pairs, or None on a cache miss.
+        `extract` is called for a fresh stream of pages if the entry turns out to be unreadable;
+        the pages not yet passed on are taken from it, and it replaces the bad entry.
+        """
+        path = self._entry_path(file_hash)
+        try:
+            os.utime(path)  # mark as recently used
+        except FileNotFoundError:
+            return None
+        return self._read_pages(path, file_hash, extract)
+
+    def _read_pages(self, path, file_hash, extract):
+        page_number = 1
+        try:
+            with gzip.open(path, "rt", encoding="utf-8") as f:
+                pending = ""
+                for block in iter(lambda: f.read(1 << 16), ""):
+                    pending += block
+                    *pages, pending = pending.split(PAGE_BREAK)
+                    for page in pages:
+                        yield page_number, page
+                        page_number += 1
+                yield page_number, pending
+            return
+        except (OSError, EOFError, zlib.error, UnicodeDecodeError) as e:
+            logger.warning(f"Discarding unreadable extraction cache entry {path.name}: {e}")
+            path.unlink(missing_ok=True)
+            if extract is None:
+                raise
+        # Pages up to the bad block were already passed on; the fresh extraction is cached in full
+        for fresh_page_number, text in self.cache_pages(file_hash, extract()):
+            if fresh_page_number >= page_number:
+                yield fresh_page_number, text
+
+    def cache_pages(self, file_hash, pages):
+        """
+        Passes (page_number, text) pairs through while writing them to the cache.
+        Form feeds inside a page become newlines, so the pages passed on match what a later read returns.
+        The entry is only published once the whole stream has been consumed.
+        """
+        path = self._entry_path(file_hash)
+        tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        try:
+            with gzip.open(tmp_path, "wt", encoding="utf-8", compresslevel=6) as f:
+                for i, (page_number, text) in enumerate(pages):
+                    if i:
+                        f.write(PAGE_BREAK)
+                    text = text.replace(PAGE_BREAK, "\n")
+                    f.write(text)
+                    yield page_number, text
+            size = tmp_path.stat().st_size
+            os.replace(tmp_path, path)
+        finally:
+            tmp_path.unlink(missing_ok=True)
+        self._added(size)
+
+    def _added(self, size):
+        with self._lock:
+            if self._bytes is not None:
+                self._bytes += size
+            if self._bytes is None or self._bytes > self.max_bytes or time.monotonic() - self._scanned_at > self.SCAN_SECONDS:
+                self._bytes = self.evict()
+                self._scanned_at = time.monotonic()
+
+    def evict(self):
+        """Deletes least recently used entries until the cache fits in `max_bytes`; returns its size."""
+        entries = []
+        for path in self.cache_dir.glob("*.txt.gz"):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue  # removed by another process
+            entries.append((stat.st_mtime, stat.st_size, path))
+
+        total = sum(size for _, size, _ in entries)
+        limit = self.max_bytes if total <= self.max_bytes else self.max_bytes * self.LOW_WATER
+        for _, size, path in sorted(entries):
+            if total <= limit:
+                break
+            path.unlink(missing_ok=True)
+            total -= size
+        return total
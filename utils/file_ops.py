@@ -1,14 +1,11 @@
-import docx
 import logging
 from pathlib import Path
 from io import StringIO
 
-# For PDFMiner.six
-from pdfminer.high_level import extract_text as pdfminer_extract_text
-from pdfminer.pdfpage import PDFPage
-from pdfminer.pdfinterp import PDFResourceManager, PDFPageInterpreter
-from pdfminer.converter import TextConverter
-from pdfminer.layout import LAParams
+# pdfminer.six and python-docx are imported where they are used, so importing this module stays cheap
+
+# Bump whenever extraction output changes, so cached texts are not reused
+EXTRACTOR_VERSION = 2
 
 # Configure logging for this module
 logger = logging.getLogger(__name__)
@@ -19,6 +16,8 @@ logger.addHandler(handler)
 
 def extract_text_from_pdf(path):
     """Extracts text from a PDF file using pdfminer.six."""
+    from pdfminer.high_level import extract_text as pdfminer_extract_text
+
     try:
         # Using pdfminer.high_level.extract_text for simplicity and robustness
         text = pdfminer_extract_text(path)
@@ -31,6 +30,8 @@ def extract_text_from_pdf(path):
 
 def extract_text_from_docx(path):
     """Extracts text from a DOCX file."""
+    import docx
+
     try:
         doc = docx.Document(path)
         text = "\n".join([para.text for para in doc.paragraphs])
@@ -71,4 +72,45 @@ def extract_text_from_document(file_path):
         return extract_text_from_txt(file_path)
     else:
         logger.warning(f"Unsupported file type for extraction: {path.suffix} for file {file_path}")
-        return ""
\ No newline at end of file
+        return ""
+
+def iter_pdf_pages(path):
+    """
+    Yields (page_number, text) for a PDF one page at a time, so the whole
+    document is never held in memory. Unlike extract_text_from_pdf, errors are raised.
+    """
+    from pdfminer.pdfpage import PDFPage
+    from pdfminer.pdfinterp import PDFResourceManager, PDFPageInterpreter
+    from pdfminer.converter import TextConverter
+    from pdfminer.layout import LAParams
+
+    resource_manager = PDFResourceManager()
+    laparams = LAParams()
+    with open(path, 'rb') as f:
+        for page_number, page in enumerate(PDFPage.get_pages(f), start=1):
+            output = StringIO()
+            device = TextConverter(resource_manager, output, laparams=laparams)
+            try:
+                PDFPageInterpreter(resource_manager, device).process_page(page)
+            finally:
+                device.close()
+            # TextConverter ends every page with a form feed
+            yield page_number, output.getvalue().rstrip('\x0c')
+
+def iter_document_pages(file_path):
+    """
+    Yields (page_number, text) pairs for a document.
+    PDFs are streamed page by page; DOCX and TXT files have no pages and come back as page 1.
+    """
+    path = Path(file_path)
+    if not path.exists():
+        raise FileNotFoundError(f"File not found: {file_path}")
+
+    if path.suffix.lower() == '.pdf':
+        yield from iter_pdf_pages(file_path)
+    elif path.suffix.lower() == '.docx':
+        yield 1, extract_text_from_docx(file_path)
+    elif path.suffix.lower() == '.txt':
+        yield 1, extract_text_from_txt(file_path)
+    else:
+        raise ValueError(f"Unsupported file type for extraction: {path.suffix} for file {file_path}")
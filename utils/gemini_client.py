@@ -7,4 +7,5 @@ API_KEY = os.getenv("GEMINI_API_KEY")
 
 genai.configure(api_key=API_KEY)
 
-client = genai.GenerativeModel('models/gemini-2.5-flash')
\ No newline at end of file
+def create_gemini_model(model_name='models/gemini-2.5-flash'):
+    return genai.GenerativeModel(model_name)
@@ -0,0 +1,317 @@
+import time
+import random
+import asyncio
+import threading
+from collections import deque
+from concurrent.futures import Future, FIRST_COMPLETED, wait
+
+import httpx
+import numpy as np
+
+from core.config import (
+    LLM_BACKEND, LLM_MODEL, LLM_HTTP_ENDPOINT, LLM_DEADLINE_SECONDS, LLM_ATTEMPT_TIMEOUT_SECONDS, LLM_MAX_RETRIES,
+    LLM_BACKOFF_BASE_SECONDS, LLM_BACKOFF_MAX_SECONDS, LLM_HEDGING_ENABLED, LLM_HEDGE_DELAY_SECONDS, LLM_HEDGE_MIN_DELAY_SECONDS,
+)
+from utils.metrics import LLM_ATTEMPTS, LLM_HEDGES
+
+# Rate limiting, timeouts and server-side failures are worth another attempt; bad requests are not
+RETRYABLE_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+
+# Latencies needed before the hedge delay follows the observed p95
+MIN_LATENCY_SAMPLES = 20
+
+class LLMError(Exception):
+    """An LLM request failed after all retries, or its deadline passed."""
+
+class LLMTimeout(LLMError):
+    """A single attempt took longer than its timeout."""
+
+class LLMDeadlineExceeded(LLMError):
+    """The request's overall time budget ran out."""
+
+def is_retryable(exc):
+    if isinstance(exc, LLMTimeout):
+        return True
+    if isinstance(exc, LLMError):
+        return False
+    # google.api_core errors carry the HTTP status in `code`, httpx errors on their response
+    status = getattr(exc, "code", None)
+    if status is None:
+        status = getattr(getattr(exc, "response", None), "status_code", None)
+    if isinstance(status, int):
+        return status in RETRYABLE_STATUS_CODES
+    return isinstance(exc, (ConnectionError, TimeoutError, httpx.TransportError))
+
+class LLMResponse:
+    def __init__(self, text):
+        self.text = text
+
+class _SingleChunkStream:
+    def __init__(self, text):
+        self._text = text
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        yield LLMResponse(self._text)
+
+class _DeadlineStream:
+    """Iterates a backend stream, raising LLMDeadlineExceeded if it runs past the request's deadline."""
+    def __init__(self, stream, deadline, deadline_seconds):
+        self._iterator = stream.__aiter__()
+        self._deadline = deadline
+        self._deadline_seconds = deadline_seconds
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        remaining = self._deadline - time.monotonic()
+        try:
+            if remaining <= 0:
+                raise asyncio.TimeoutError
+            return await asyncio.wait_for(self._iterator.__anext__(), remaining)
+        except asyncio.TimeoutError as e:
+            LLM_ATTEMPTS.labels("timeout").inc()
+            aclose = getattr(self._iterator, "aclose", None)
+            if aclose is not None:
+                await aclose()
+            raise LLMDeadlineExceeded(f"LLM deadline of {self._deadline_seconds:g}s exceeded while streaming.") from e
+
+class HTTPLLMBackend:
+    """
+    Backend for a JSON endpoint that takes {"prompt": ...} and answers {"text": ...},
+    such as fake_llm_server.py. Timeouts are left to ResilientLLMClient.
+    """
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+        self._client = httpx.Client(timeout=None)
+        self._async_client = None  # bound to the event loop that first uses it
+
+    def generate_content(self, prompt, generation_config=None, stream=False):
+        response = self._client.post(self.endpoint, json={"prompt": prompt, "generation_config": generation_config})
+        response.raise_for_status()
+        return LLMResponse(response.json()["text"])
+
+    async def generate_content_async(self, prompt, generation_config=None, stream=False):
+        if self._async_client is None:
+            self._async_client = httpx.AsyncClient(timeout=None)
+        response = await self._async_client.post(self.endpoint, json={"prompt": prompt, "generation_config": generation_config})
+        response.raise_for_status()
+        text = response.json()["text"]
+        return _SingleChunkStream(text) if stream else LLMResponse(text)
+
+def create_llm_backend(name=LLM_BACKEND):
+    """Returns the raw client for `name`: anything with Gemini's generate_content(_async) methods."""
+    if name == "gemini":
+        from utils.gemini_client import create_gemini_model
+        return create_gemini_model(LLM_MODEL)
+    if name == "http":
+        return HTTPLLMBackend(LLM_HTTP_ENDPOINT)
+    if name == "stub":
+        from utils.stub_llm import StubLLMClient
+        return StubLLMClient()
+    raise ValueError(f"Unknown LLM backend '{name}'. Expected gemini, http or stub.")
+
+class ResilientLLMClient:
+    """
+    Wraps an LLM backend with a per-request deadline, per-attempt timeouts, bounded
+    retries with full-jitter exponential backoff, and optional hedging: if an attempt
+    has not answered after the recent p95 latency, a second one is sent and whichever
+    answers first is kept. Exposes the same generate_content(_async) methods as the backend.
+
+    Synchronous attempts run on their own daemon threads so they can be timed out; a stalled
+    call is abandoned rather than interrupted, and cannot hold up interpreter exit.
+    Pass `create_backend` instead of `backend` to create the backend on first use.
+    """
+    def __init__(self, backend=None, deadline=LLM_DEADLINE_SECONDS, attempt_timeout=LLM_ATTEMPT_TIMEOUT_SECONDS,
+                 max_retries=LLM_MAX_RETRIES, backoff_base=LLM_BACKOFF_BASE_SECONDS, backoff_max=LLM_BACKOFF_MAX_SECONDS,
+                 hedging=LLM_HEDGING_ENABLED, hedge_delay=LLM_HEDGE_DELAY_SECONDS, hedge_min_delay=LLM_HEDGE_MIN_DELAY_SECONDS,
+                 create_backend=None):
+        self._backend = backend
+        self._create_backend = create_backend
+        self._backend_lock = threading.Lock()
+        self.deadline = deadline
+        self.attempt_timeout = attempt_timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.hedging = hedging
+        self.default_hedge_delay = hedge_delay
+        self.hedge_min_delay = hedge_min_delay
+        self._latencies = deque(maxlen=200)
+        self._latencies_lock = threading.Lock()
+
+    @property
+    def backend(self):
+        if self._backend is None:
+            with self._backend_lock:
+                if self._backend is None:
+                    self._backend = self._create_backend()
+        return self._backend
+
+    def hedge_delay(self):
+        """How long to wait for an attempt before hedging: the p95 of recent successful calls."""
+        with self._latencies_lock:
+            latencies = list(self._latencies)
+        if len(latencies) < MIN_LATENCY_SAMPLES:
+            return self.default_hedge_delay
+        return max(float(np.percentile(latencies, 95)), self.hedge_min_delay)
+
+    def _record_latency(self, seconds):
+        with self._latencies_lock:
+            self._latencies.append(seconds)
+
+    def _backoff(self, attempt):
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    def _attempt_timeout(self, deadline):
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise LLMDeadlineExceeded(f"LLM deadline of {self.deadline:g}s exceeded.")
+        return min(self.attempt_timeout, remaining)
+
+    def _retry_delay(self, attempt, error, deadline):
+        """Returns how long to sleep before the next attempt, or raises if there shouldn't be one."""
+        if isinstance(error, LLMDeadlineExceeded):
+            raise error
+        if attempt >= self.max_retries or not is_retryable(error):
+            raise LLMError(f"LLM request failed after {attempt + 1} attempt(s): {error}") from error
+        delay = self._backoff(attempt)
+        if time.monotonic() + delay >= deadline:
+            raise LLMDeadlineExceeded(f"LLM deadline of {self.deadline:g}s exceeded; last error: {error}") from error
+        return delay
+
+    def _submit(self, prompt, generation_config):
+        future = Future()
+
+        def run():
+            if not future.set_running_or_notify_cancel():
+                return
+            started = time.monotonic()
+            try:
+                response = self.backend.generate_content(prompt, generation_config=generation_config)
+            except Exception as e:
+                future.set_exception(e)
+                return
+            self._record_latency(time.monotonic() - started)
+            future.set_result(response)
+
+        threading.Thread(target=run, name="llm-attempt", daemon=True).start()
+        return future
+
+    def generate_content(self, prompt, generation_config=None, stream=False):
+        deadline = time.monotonic() + self.deadline
+        attempt = 0
+        while True:
+            try:
+                return self._hedged_attempt(prompt, generation_config, deadline)
+            except Exception as e:
+                delay = self._retry_delay(attempt, e, deadline)
+            time.sleep(delay)
+            attempt += 1
+
+    def _hedged_attempt(self, prompt, generation_config, deadline):
+        timeout = self._attempt_timeout(deadline)
+        attempt_deadline = time.monotonic() + timeout
+        futures = [self._submit(prompt, generation_config)]
+        if self.hedging:
+            done, _ = wait(futures, timeout=min(self.hedge_delay(), timeout))
+            if not done:
+                LLM_HEDGES.labels("sent").inc()
+                futures.append(self._submit(prompt, generation_config))
+
+        error = None
+        pending = set(futures)
+        while pending:
+            done, pending = wait(pending, timeout=max(attempt_deadline - time.monotonic(), 0), return_when=FIRST_COMPLETED)
+            if not done:
+                break
+            for future in done:
+                try:
+                    response = future.result()
+                except Exception as e:
+                    LLM_ATTEMPTS.labels("error").inc()
+                    error = e
+                    continue
+                LLM_ATTEMPTS.labels("ok").inc()
+                if future is not futures[0]:
+                    LLM_HEDGES.labels("won").inc()
+                for other in pending:
+                    other.cancel()
+                return response
+        if error is not None and not pending:
+            raise error
+        LLM_ATTEMPTS.labels("timeout").inc(len(pending))
+        raise LLMTimeout(f"LLM attempt timed out after {timeout:g}s.")
+
+    async def generate_content_async(self, prompt, generation_config=None, stream=False):
+        if stream:
+            # Tokens may already have reached the caller when a stream fails, so streams are not retried.
+            # The rest of the deadline bounds the whole stream, so a stalled one can't hold an LLM slot.
+            deadline = time.monotonic() + self.deadline
+            timeout = self._attempt_timeout(deadline)
+            try:
+                stream = await asyncio.wait_for(
+                    self.backend.generate_content_async(prompt, generation_config=generation_config, stream=True), timeout)
+            except asyncio.TimeoutError as e:
+                raise LLMTimeout(f"LLM stream did not start within {timeout:g}s.") from e
+            return _DeadlineStream(stream, deadline, self.deadline)
+
+        deadline = time.monotonic() + self.deadline
+        attempt = 0
+        while True:
+            try:
+                return await self._hedged_attempt_async(prompt, generation_config, deadline)
+            except Exception as e:
+                delay = self._retry_delay(attempt, e, deadline)
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    async def _attempt_async(self, prompt, generation_config, timeout):
+        started = time.monotonic()
+        try:
+            response = await asyncio.wait_for(self.backend.generate_content_async(prompt, generation_config=generation_config), timeout)
+        except asyncio.TimeoutError as e:
+            LLM_ATTEMPTS.labels("timeout").inc()
+            raise LLMTimeout(f"LLM attempt timed out after {timeout:g}s.") from e
+        except Exception:
+            LLM_ATTEMPTS.labels("error").inc()
+            raise
+        LLM_ATTEMPTS.labels("ok").inc()
+        self._record_latency(time.monotonic() - started)
+        return response
+
+    async def _hedged_attempt_async(self, prompt, generation_config, deadline):
+        timeout = self._attempt_timeout(deadline)
+        if not self.hedging:
+            return await self._attempt_async(prompt, generation_config, timeout)
+
+        attempt_deadline = time.monotonic() + timeout
+        first = asyncio.ensure_future(self._attempt_async(prompt, generation_config, timeout))
+        tasks = [first]
+        done, _ = await asyncio.wait(tasks, timeout=min(self.hedge_delay(), timeout))
+        if not done:
+            LLM_HEDGES.labels("sent").inc()
+            tasks.append(asyncio.ensure_future(
+                self._attempt_async(prompt, generation_config, max(attempt_deadline - time.monotonic(), 0.001))))
+
+        pending = set(tasks)
+        error = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is not first:
+                            LLM_HEDGES.labels("won").inc()
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+# The Gemini SDK is slow to import, so the backend is created by the first LLM call
+client = ResilientLLMClient(create_backend=create_llm_backend)
@@ -0,0 +1,181 @@
+import os
+import json
+import time
+import shutil
+import logging
+import contextvars
+from contextlib import contextmanager
+
+from prometheus_client import Counter, Gauge, Histogram, REGISTRY, CollectorRegistry, multiprocess
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+from core.config import METRICS_TRACE_REQUESTS, METRICS_TRACE_LOG_FILE, METRICS_MULTIPROC_DIR
+
+# With several server workers, prometheus_client keeps each process's values in files under this
+# directory and /metrics adds them up. Gauges are summed over live processes; other processes that
+# import this module, like the extraction pool's, only ever contribute zeros.
+MULTIPROC_DIR_ENV = "PROMETHEUS_MULTIPROC_DIR"
+
+STAGE_SECONDS = Histogram(
+    "promptclaim_stage_seconds", "Time spent in each query or ingestion stage.", ["stage"],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60),
+)
+REQUEST_SECONDS = Histogram("promptclaim_request_seconds", "End-to-end HTTP request latency.", ["method", "path", "status"])
+REQUESTS_IN_FLIGHT = Gauge("promptclaim_requests_in_flight", "HTTP requests currently being served.", multiprocess_mode="livesum")
+READY = Gauge(
+    "promptclaim_ready", "Worker processes whose model and index are loaded, so queries can be served.", multiprocess_mode="livesum",
+)
+CHUNKS_SCANNED = Histogram(
+    "promptclaim_chunks_scanned", "Candidate chunks searched per query.",
+    buckets=(10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000),
+)
+PROMPT_CHARS = Histogram(
+    "promptclaim_prompt_chars", "Size of the prompt sent to the LLM, in characters.",
+    buckets=(1000, 2000, 4000, 8000, 16000, 32000, 64000),
+)
+DECISION_CACHE_LOOKUPS = Counter("promptclaim_decision_cache_lookups", "Decision cache lookups.", ["result"])
+INGESTED_CHUNKS = Counter("promptclaim_ingested_chunks", "Chunks added to the index by uploads.")
+INGESTION_JOBS = Counter("promptclaim_ingestion_jobs", "Finished upload jobs by outcome (succeeded, failed).", ["outcome"])
+INGESTION_JOBS_PENDING = Gauge(
+    "promptclaim_ingestion_jobs_pending", "Upload jobs waiting or in progress, over all workers.", multiprocess_mode="livesum",
+)
+INGESTION_JOBS_PER_PUBLISH = Histogram(
+    "promptclaim_ingestion_jobs_per_publish", "Upload jobs applied by each index publish.",
+    buckets=(1, 2, 4, 8, 16, 32, 64),
+)
+LLM_ATTEMPTS = Counter("promptclaim_llm_attempts", "LLM calls by outcome (ok, timeout, error), counting retries and hedges.", ["outcome"])
+LLM_HEDGES = Counter("promptclaim_llm_hedges", "Hedged LLM attempts sent, and how many answered first.", ["result"])
+
+trace_logger = logging.getLogger("promptclaim.trace")
+if METRICS_TRACE_REQUESTS:
+    trace_handler = logging.FileHandler(METRICS_TRACE_LOG_FILE) if METRICS_TRACE_LOG_FILE else logging.StreamHandler()
+    trace_handler.setFormatter(logging.Formatter("%(message)s"))
+    trace_logger.addHandler(trace_handler)
+    trace_logger.setLevel(logging.INFO)
+    trace_logger.propagate = False
+
+# Stage timings of the request being served, when request tracing is on
+_current_trace = contextvars.ContextVar("promptclaim_trace", default=None)
+
+@contextmanager
+def stage(name):
+    """
+    Times a block into the stage histogram and, if one is active, the current request trace.
+    The trace is a context variable: work handed to a thread must carry the request's context
+    (asyncio.to_thread, or copy_context().run with a custom executor) for its stages to be traced.
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        STAGE_SECONDS.labels(name).observe(elapsed)
+        trace = _current_trace.get()
+        if trace is not None:
+            # A stage run more than once, e.g. per batch item, records its total time. Runs that
+            # overlap, like a batch's LLM calls, can add up to more than the request took.
+            trace["stages"][name] = trace["stages"].get(name, 0.0) + elapsed
+
+def annotate_trace(**fields):
+    """Adds fields such as the policy name or cache outcome to the current request trace."""
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.update(fields)
+
+def record_decision_cache(hit):
+    DECISION_CACHE_LOOKUPS.labels("hit" if hit else "miss").inc()
+    annotate_trace(decision_cache="hit" if hit else "miss")
+
+UNMATCHED_ROUTE = "<unmatched>"
+HTTP_METHODS = {"GET", "HEAD", "POST", "PUT", "PATCH", "DELETE", "OPTIONS"}
+
+class MetricsMiddleware:
+    """
+    ASGI middleware recording request latency per route and the number of requests in flight.
+    Streaming responses count as in flight until their last byte is sent.
+    With request tracing enabled, each request's stage timings are logged as one JSON line.
+    """
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = {"code": 500}
+        trace = {"method": scope["method"], "path": scope["path"], "stages": {}} if METRICS_TRACE_REQUESTS else None
+        token = _current_trace.set(trace)
+
+        async def send_with_status(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        started = time.perf_counter()
+        REQUESTS_IN_FLIGHT.inc()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            REQUESTS_IN_FLIGHT.dec()
+            elapsed = time.perf_counter() - started
+            _current_trace.reset(token)
+            # The route template, e.g. /documents/{filename} rather than every file name. Requests that
+            # matched no route share one label, so scanners and typos can't create new series.
+            route_path = getattr(scope.get("route"), "path", UNMATCHED_ROUTE)
+            method = scope["method"] if scope["method"] in HTTP_METHODS else "OTHER"
+            REQUEST_SECONDS.labels(method, route_path, str(status["code"])).observe(elapsed)
+            if trace is not None:
+                trace.update(status=status["code"], seconds=elapsed)
+                trace_logger.info(json.dumps(trace))
+
+class EmbeddingBatcherCollector:
+    """Exposes an EmbeddingBatcher's counters at scrape time."""
+    def __init__(self, batcher):
+        self.batcher = batcher
+
+    def collect(self):
+        stats = self.batcher.stats()
+        yield CounterMetricFamily("promptclaim_embedding_batches", "Batches encoded by the embedding batcher.", value=stats["batches"])
+        yield CounterMetricFamily("promptclaim_embedding_batched_texts", "Texts encoded by the embedding batcher.", value=stats["texts"])
+        yield GaugeMetricFamily("promptclaim_embedding_batch_size_mean", "Mean texts per encoded batch.", value=stats["mean_batch_size"])
+        yield GaugeMetricFamily("promptclaim_embedding_batch_size_max", "Largest batch encoded so far.", value=stats["max_batch_size"])
+        yield GaugeMetricFamily(
+            "promptclaim_embedding_queue_wait_seconds_mean", "Mean time a text waited to be batched.",
+            value=stats["mean_queue_wait_seconds"],
+        )
+
+_process_collectors = []  # read at scrape time from the worker that answers
+
+def register_batcher_metrics(batcher):
+    collector = EmbeddingBatcherCollector(batcher)
+    REGISTRY.register(collector)
+    _process_collectors.append(collector)
+
+def enable_multiprocess_metrics(directory=METRICS_MULTIPROC_DIR):
+    """
+    Makes server workers started after this call share their metrics through `directory`
+    (or an already set PROMETHEUS_MULTIPROC_DIR). It is emptied first: values left by an
+    earlier run would otherwise be added to this one's.
+    """
+    directory = os.environ.setdefault(MULTIPROC_DIR_ENV, directory)
+    shutil.rmtree(directory, ignore_errors=True)
+    os.makedirs(directory)
+
+def scrape_registry():
+    """
+    The registry /metrics reports. In multiprocess mode the metrics above are added up over
+    every worker; the embedding batcher's stats are those of the worker answering the scrape.
+    """
+    if not os.environ.get(MULTIPROC_DIR_ENV):
+        return REGISTRY
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    for collector in _process_collectors:
+        registry.register(collector)
+    return registry
+
+def mark_worker_stopped():
+    """Drops this process's live gauges from the shared metrics when a worker shuts down."""
+    if os.environ.get(MULTIPROC_DIR_ENV):
+        multiprocess.mark_process_dead(os.getpid())
@@ -1,21 +1,249 @@
-from sentence_transformers import SentenceTransformer
 import faiss
 import numpy as np
 
+from utils.encoder import load_encoder
+
+from core.config import (
+    INDEX_TYPE, HNSW_M, HNSW_EF_CONSTRUCTION, HNSW_EF_SEARCH, IVF_NLIST, IVF_NPROBE, PQ_M, PQ_NBITS,
+    EXACT_SEARCH_MAX_CANDIDATES, EMBEDDING_DTYPE, NORMALIZE_EMBEDDINGS,
+)
+
+INDEX_TYPES = ("flat", "hnsw", "ivf_flat", "ivf_pq")
+EMBEDDING_DTYPES = ("float32", "float16", "int8")
+
+# int8 storage holds unit-vector components in steps of 1/256; sentence embedding components
+# stay well inside the representable ±0.496, and the rounding error barely moves dot products
+INT8_SCALE = 256
+
+# Extra room around the trained int8 value range, for vectors added after training
+SQ_RANGE_MARGIN = 0.1
+
+def index_settings(**overrides):
+    """The configured index type and tuning parameters, with optional overrides (e.g. for benchmarks)."""
+    settings = {
+        "type": INDEX_TYPE,
+        "hnsw_m": HNSW_M,
+        "hnsw_ef_construction": HNSW_EF_CONSTRUCTION,
+        "hnsw_ef_search": HNSW_EF_SEARCH,
+        "ivf_nlist": IVF_NLIST,
+        "ivf_nprobe": IVF_NPROBE,
+        "pq_m": PQ_M,
+        "pq_nbits": PQ_NBITS,
+        "dtype": EMBEDDING_DTYPE,
+        "normalize": NORMALIZE_EMBEDDINGS,
+    }
+    settings.update(overrides)
+    if settings["type"] not in INDEX_TYPES:
+        raise ValueError(f"Unknown index type '{settings['type']}'. Expected one of {', '.join(INDEX_TYPES)}.")
+    if settings["dtype"] not in EMBEDDING_DTYPES:
+        raise ValueError(f"Unknown embedding dtype '{settings['dtype']}'. Expected one of {', '.join(EMBEDDING_DTYPES)}.")
+    return settings
+
+def normalize_vectors(vectors):
+    """Scales each row to unit length, so inner product equals cosine similarity."""
+    vectors = np.array(vectors, dtype="float32", ndmin=2)
+    faiss.normalize_L2(vectors)
+    return vectors
+
+def to_storage(vectors, dtype=EMBEDDING_DTYPE):
+    """Encodes float32 embeddings for embeddings.npy; int8 expects normalized vectors."""
+    vectors = np.asarray(vectors, dtype="float32")
+    if dtype == "int8":
+        return np.clip(np.rint(vectors * INT8_SCALE), -127, 127).astype(np.int8)
+    return vectors.astype(dtype)
+
+def from_storage(vectors):
+    """Decodes stored embeddings (any EMBEDDING_DTYPE) back to float32."""
+    vectors = np.asarray(vectors)
+    if vectors.dtype == np.int8:
+        return vectors.astype("float32") / INT8_SCALE
+    return np.ascontiguousarray(vectors, dtype="float32")
+
+def prepare_embeddings(embeddings, settings=None):
+    """Freshly encoded embeddings as float32 for the index, normalized if configured."""
+    settings = settings or index_settings()
+    return normalize_vectors(embeddings) if settings["normalize"] else np.ascontiguousarray(embeddings, dtype="float32")
+
+def _ivf_nlist(settings, n):
+    # Around 4*sqrt(n) clusters by default, with at least 39 training points per cluster as FAISS recommends
+    nlist = settings["ivf_nlist"] or int(4 * np.sqrt(n))
+    return max(1, min(nlist, n // 39))
+
+def built_index_type(dim, n, settings=None):
+    """
+    The type of index built for `n` vectors: the configured one, or flat when there are too few
+    vectors to train it (or the type is unknown). A flat index loaded under another configured
+    type is therefore only stale once the corpus has grown enough to train that type.
+    """
+    settings = settings or index_settings()
+    index_type = settings["type"]
+    if index_type == "hnsw":
+        return index_type
+    if index_type == "ivf_flat" and n >= 39:
+        return index_type
+    if index_type == "ivf_pq" and n >= 2 ** settings["pq_nbits"] and dim % settings["pq_m"] == 0:
+        return index_type
+    return "flat"
+
+def _make_index(dim, n, settings):
+    """
+    Creates an untrained inner index, or a flat one when there are too few vectors to train the configured type.
+    float16 and int8 storage use FAISS's scalar-quantized variants; normalized vectors are ranked by inner product.
+    """
+    index_type = built_index_type(dim, n, settings)
+    metric = faiss.METRIC_INNER_PRODUCT if settings["normalize"] or settings["dtype"] == "int8" else faiss.METRIC_L2
+    qtype = {"float16": faiss.ScalarQuantizer.QT_fp16, "int8": faiss.ScalarQuantizer.QT_8bit}.get(settings["dtype"])
+    if index_type == "hnsw":
+        if qtype is None:
+            index = faiss.IndexHNSWFlat(dim, settings["hnsw_m"], metric)
+        else:
+            index = faiss.IndexHNSWSQ(dim, qtype, settings["hnsw_m"], metric)
+        index.hnsw.efConstruction = settings["hnsw_ef_construction"]
+        return _widen_sq_range(index)
+    if index_type == "ivf_flat":
+        quantizer = faiss.IndexFlat(dim, metric)
+        if qtype is None:
+            return faiss.IndexIVFFlat(quantizer, dim, _ivf_nlist(settings, n), metric)
+        return _widen_sq_range(faiss.IndexIVFScalarQuantizer(quantizer, dim, _ivf_nlist(settings, n), qtype, metric))
+    if index_type == "ivf_pq":
+        # PQ codes are already compact; the storage dtype only affects embeddings.npy
+        quantizer = faiss.IndexFlat(dim, metric)
+        return faiss.IndexIVFPQ(quantizer, dim, _ivf_nlist(settings, n), settings["pq_m"], settings["pq_nbits"], metric)
+    if settings["type"] != "flat":
+        print(f"Using a flat index: {n} vectors are not enough to train a '{settings['type']}' index.")
+    if qtype is None:
+        return faiss.IndexFlat(dim, metric)
+    return _widen_sq_range(faiss.IndexScalarQuantizer(dim, qtype, metric))
+
+def _widen_sq_range(index):
+    # int8 quantizers learn each dimension's range when trained; leave a margin for later additions
+    if isinstance(index, faiss.IndexHNSW):
+        storage = faiss.downcast_index(index.storage)
+        if isinstance(storage, faiss.IndexScalarQuantizer):
+            storage.sq.rangestat_arg = SQ_RANGE_MARGIN
+    elif isinstance(index, (faiss.IndexScalarQuantizer, faiss.IndexIVFScalarQuantizer)):
+        index.sq.rangestat_arg = SQ_RANGE_MARGIN
+    return index
+
+def index_type_of(index):
+    """Names the kind of index wrapped in an IndexIDMap2, as used in config.ini."""
+    inner = faiss.downcast_index(index.index) if isinstance(index, faiss.IndexIDMap) else index
+    if isinstance(inner, faiss.IndexHNSW):
+        return "hnsw"
+    if isinstance(inner, faiss.IndexIVFPQ):
+        return "ivf_pq"
+    if isinstance(inner, faiss.IndexIVF):
+        return "ivf_flat"
+    return "flat"
+
+def configure_search(index, settings=None):
+    """Applies the query-time knobs (HNSW efSearch, IVF nprobe), which can change without a rebuild."""
+    settings = settings or index_settings()
+    inner = faiss.downcast_index(index.index) if isinstance(index, faiss.IndexIDMap) else index
+    if isinstance(inner, faiss.IndexHNSW):
+        inner.hnsw.efSearch = settings["hnsw_ef_search"]
+    elif isinstance(inner, faiss.IndexIVF):
+        inner.nprobe = settings["ivf_nprobe"]
+    return index
+
 def build_faiss_index(text_chunks, model_name='all-MiniLM-L6-v2'):
-    model = SentenceTransformer(model_name)
-    embeddings = model.encode(text_chunks)
-    index = faiss.IndexFlatL2(embeddings.shape[1])
-    index.add(np.array(embeddings))
+    model = load_encoder(model_name)
+    embeddings = prepare_embeddings(model.encode(text_chunks))
+    index = build_faiss_index_from_embeddings(embeddings)
     return model, index, embeddings
 
-def build_faiss_index_from_embeddings(embeddings):
-    """Builds a FAISS index from pre-computed embeddings."""
-    index = faiss.IndexFlatL2(embeddings.shape[1])
-    index.add(np.array(embeddings))
-    return index
+def build_faiss_index_from_embeddings(embeddings, ids=None, settings=None):
+    """
+    Builds an id-mapped FAISS index from pre-computed embeddings, of the type set in config.ini
+    (or `settings`). IVF and int8 indexes are trained on these embeddings first.
+    `embeddings` may be float32 or as stored in embeddings.npy (see to_storage).
+    Vectors are keyed by `ids` (defaults to 0..n-1) so they can later be added or removed individually.
+    """
+    settings = settings or index_settings()
+    embeddings = from_storage(embeddings)
+    if settings["normalize"] or settings["dtype"] == "int8":
+        embeddings = normalize_vectors(embeddings)
+    if ids is None:
+        ids = np.arange(len(embeddings))
+    inner = _make_index(embeddings.shape[1], len(embeddings), settings)
+    if not inner.is_trained:
+        inner.train(embeddings)
+    index = faiss.IndexIDMap2(inner)
+    index.add_with_ids(embeddings, np.asarray(ids, dtype='int64'))
+    return configure_search(index, settings)
+
+def supports_remove(index):
+    # HNSW graphs can't drop vectors; such indexes are rebuilt from the stored embeddings instead
+    return index_type_of(index) != "hnsw"
+
+def _query_vector(q_vec, index):
+    # Indexes of normalized vectors rank by inner product, so queries are normalized to match
+    if index.metric_type == faiss.METRIC_INNER_PRODUCT:
+        return normalize_vectors(q_vec)
+    return np.asarray(q_vec, dtype='float32').reshape(1, -1)
 
 def search_topk(query, model, index, text_chunks, k=5):
+    q_vec = _query_vector(model.encode([query]), index)
+    scores, ids = index.search(q_vec, k)
+    return [text_chunks[i] for i in ids[0] if i != -1]
+
+def search_topk_ids(query, model, index, candidate_ids, k=5, candidate_vectors=None):
+    """
+    Searches the index restricted to `candidate_ids` and returns the matching ids.
+    Reuses the vectors already stored in the index, so only the query is encoded.
+    """
+    if len(candidate_ids) == 0:
+        return []
     q_vec = model.encode([query])
-    scores, ids = index.search(np.array(q_vec), k)
-    return [text_chunks[i] for i in ids[0]]
+    return search_ids_by_vector(q_vec, index, candidate_ids, k, candidate_vectors)
+
+def _selector_params(index, selector):
+    inner = faiss.downcast_index(index.index) if isinstance(index, faiss.IndexIDMap) else index
+    if isinstance(inner, faiss.IndexHNSW):
+        return faiss.SearchParametersHNSW(sel=selector, efSearch=inner.hnsw.efSearch)
+    if isinstance(inner, faiss.IndexIVF):
+        return faiss.SearchParametersIVF(sel=selector, nprobe=inner.nprobe)
+    return faiss.SearchParameters(sel=selector)
+
+def search_ids_by_vector(q_vec, index, candidate_ids, k=5, candidate_vectors=None):
+    """
+    Like search_topk_ids, for a query that has already been encoded.
+    With `candidate_vectors` (the stored embeddings of `candidate_ids`, row for row) and no more
+    than EXACT_SEARCH_MAX_CANDIDATES candidates, those vectors are scanned exactly instead:
+    that costs O(candidates) rather than a filtered pass over the whole index, and stays
+    exact with approximate indexes, whose filtered search can miss results for small filters.
+    """
+    if len(candidate_ids) == 0:
+        return []
+    q_vec = _query_vector(q_vec, index)
+    k = min(k, len(candidate_ids))
+    if candidate_vectors is not None and len(candidate_ids) <= EXACT_SEARCH_MAX_CANDIDATES:
+        return search_vectors_exact(q_vec, candidate_vectors, candidate_ids, k, index.metric_type)
+
+    params = _selector_params(index, faiss.IDSelectorBatch(np.asarray(candidate_ids, dtype='int64')))
+    scores, ids = index.search(q_vec, k, params=params)
+    return [int(i) for i in ids[0] if i != -1]
+
+def reciprocal_rank_fusion(rankings, k=60):
+    """
+    Merges ranked id lists: each id scores the sum of 1 / (k + rank) over the lists it appears in.
+    Only ranks matter, so dense and BM25 results combine without calibrating their scores.
+    """
+    scores = {}
+    for ranking in rankings:
+        for rank, chunk_id in enumerate(ranking, start=1):
+            scores[chunk_id] = scores.get(chunk_id, 0.0) + 1.0 / (k + rank)
+    return sorted(scores, key=scores.get, reverse=True)
+
+def search_vectors_exact(q_vec, vectors, ids, k=5, metric=faiss.METRIC_L2):
+    """Brute-force top-k over `vectors` (float32 or stored), returning the matching entries of `ids`, best first."""
+    vectors = from_storage(vectors)
+    q_vec = np.asarray(q_vec, dtype='float32').reshape(-1)
+    if metric == faiss.METRIC_INNER_PRODUCT:
+        distances = -(vectors @ q_vec)
+    else:
+        distances = ((vectors - q_vec) ** 2).sum(axis=1)
+    k = min(k, len(distances))
+    top = np.argpartition(distances, k - 1)[:k]
+    top = top[np.argsort(distances[top], kind="stable")]
+    return [int(ids[i]) for i in top]
@@ -0,0 +1,78 @@
+import json
+import time
+import asyncio
+import hashlib
+import threading
+
+class StubResponse:
+    def __init__(self, text):
+        self.text = text
+
+class _StubStream:
+    def __init__(self, pieces, delay):
+        self._pieces = pieces
+        self._delay = delay
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for piece in self._pieces:
+            if self._delay:
+                await asyncio.sleep(self._delay)
+            yield StubResponse(piece)
+
+class StubLLMClient:
+    """
+    Offline stand-in for the Gemini client with the same generate_content(_async) surface.
+    The answer is derived from a hash of the prompt, so the same prompt always gets the same
+    decision, and an optional fixed `latency` (seconds) simulates the network round trip.
+    `faults` scripts the first calls, in order, for exercising timeouts, retries and hedging:
+    None answers normally, a number of seconds replaces `latency` for that call, and an
+    exception instance is raised instead of answering.
+    """
+    def __init__(self, latency=0.0, faults=None):
+        self.latency = latency
+        self.faults = list(faults or [])
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def _next_call(self):
+        """Counts a call and returns its (latency, error)."""
+        with self._lock:
+            self.calls += 1
+            fault = self.faults.pop(0) if self.faults else None
+        if isinstance(fault, BaseException):
+            return self.latency, fault
+        return (self.latency if fault is None else fault), None
+
+    def _answer(self, prompt):
+        digest = hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+        decision = {
+            "decision": "Approved" if int(digest[0], 16) % 2 == 0 else "Rejected",
+            "monetary_details": [],
+            "justification": [{"clause": digest[:16], "reason": "Stub decision derived from the prompt hash."}],
+        }
+        return "```json\n" + json.dumps(decision, indent=2) + "\n```"
+
+    def generate_content(self, prompt, generation_config=None, stream=False):
+        latency, error = self._next_call()
+        if latency:
+            time.sleep(latency)
+        if error is not None:
+            raise error
+        return StubResponse(self._answer(prompt))
+
+    async def generate_content_async(self, prompt, generation_config=None, stream=False):
+        latency, error = self._next_call()
+        text = self._answer(prompt)
+        if stream:
+            if error is not None:
+                raise error
+            pieces = [text[i:i + 32] for i in range(0, len(text), 32)]
+            return _StubStream(pieces, latency / len(pieces))
+        if latency:
+            await asyncio.sleep(latency)
+        if error is not None:
+            raise error
+        return StubResponse(text)
@@ -0,0 +1,44 @@
+import os
+
+import numpy as np
+
+class TextStore:
+    """
+    A read-only list of strings kept in one memory-mapped file: a row count, the row
+    offsets, then the UTF-8 text. Strings are decoded on access, so every process that
+    opens the same file shares its pages instead of holding its own copy of the corpus.
+    """
+    def __init__(self, path):
+        self.path = path
+        self._buffer = np.memmap(path, dtype=np.uint8, mode="r")
+        count = int(self._buffer[:8].view(np.int64)[0])
+        self._offsets = self._buffer[8:8 * (count + 2)].view(np.int64)
+        self._text = self._buffer[8 * (count + 2):]
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def __getitem__(self, row):
+        if isinstance(row, slice):
+            return [self[i] for i in range(*row.indices(len(self)))]
+        if row < 0:
+            row += len(self)
+        start, end = self._offsets[row], self._offsets[row + 1]
+        return self._text[start:end].tobytes().decode("utf-8")
+
+    def __iter__(self):
+        for row in range(len(self)):
+            yield self[row]
+
+    @staticmethod
+    def write(path, texts):
+        """Writes `texts` to `path` through a temporary file, so open stores keep their old contents."""
+        encoded = [text.encode("utf-8") for text in texts]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum(np.array([len(data) for data in encoded], dtype=np.int64), out=offsets[1:])
+        with open(path + ".tmp", "wb") as f:
+            f.write(np.array([len(encoded)], dtype=np.int64).tobytes())
+            f.write(offsets.tobytes())
+            for data in encoded:
+                f.write(data)
+        os.replace(path + ".tmp", path)